@@ -0,0 +1,208 @@
+# coding=utf-8
+#
+# Recompute the accrued interest and check the amortization figures of
+# every bond in the holding records, against what the trustee reports.
+# validate() only checks the subtotals, this checks bond by bond.
+#
+# All bonds (of any number of files) are checked at once with NumPy
+# arrays, so it is cheap enough to run on every file in bulk.
+#
+# Accrued interest is quantity * coupon_rate * days / basis, from the
+# coupon_start_date to the valuation date. The trustee does not say which
+# day count it uses, and different bonds use different ones. A bond's day
+# count is taken from the configuration (by isin, or by portfolio) when
+# given there, otherwise it is the bond's usual one in the portfolio, the
+# day count (of those in dayCounts) that matches the trustee's figure on
+# most of its valuation dates. A bond is an outlier when it is off by more
+# than the tolerance by that day count, so a bond whose figure matches
+# another day count on some date is flagged, not explained away.
+#
+# For HTM bonds, the amortization figures are checked to be consistent:
+#
+# 	amortized_value = quantity * amortized_cost / 100
+# 	amortized_gain_loss = amortized_value - book_cost
+# 	amortized_cost is between average_cost and par (100)
+#
+
+from dif_revised.dif import toDate
+from collections import defaultdict
+from types import MappingProxyType
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def actualDays(start, end):
+	return (end - start).astype(np.int64)
+
+def days30(start, end):
+	"""
+	30/360 (US), a month is 30 days.
+	"""
+	def parts(dates):
+		years = dates.astype('datetime64[Y]')
+		months = dates.astype('datetime64[M]')
+		return years.astype(np.int64), (months - years).astype(np.int64), \
+				(dates - months).astype(np.int64) + 1
+
+	y1, m1, d1 = parts(start)
+	y2, m2, d2 = parts(end)
+	d1 = np.minimum(d1, 30)
+	d2 = np.where((d2 == 31) & (d1 == 30), 30, d2)
+	return (y2 - y1) * 360 + (m2 - m1) * 30 + (d2 - d1)
+
+"""
+Day counts to try, name -> (days function, basis). The days function
+takes the start and end dates (datetime64[D] arrays) and returns the
+number of days in between.
+"""
+dayCounts = MappingProxyType({
+	'act/360': (actualDays, 360),
+	'act/365': (actualDays, 365),
+	'30/360': (days30, 360)
+})
+
+
+
+"""
+The default tolerances, in the bond's currency for amounts, in percent of
+par for amortized_cost.
+"""
+defaultTolerances = MappingProxyType({
+	'accrued_interest': 1.0,
+	'amortized_value': 1.0,
+	'amortized_gain_loss': 1.0,
+	'amortized_cost': 0.01
+})
+
+
+
+def accruedInterest(quantity, couponRate, start, end, dayCount='act/360', extraDays=0):
+	"""
+	quantity, couponRate: [array] of the bonds.
+	start, end: [array] datetime64[D] dates, accrue from start to end.
+	dayCount: a day count in dayCounts.
+	extraDays: days to add, 1 to accrue the end date as well.
+
+	output: [array] the accrued interest of the bonds, zero if the coupon
+		period starts after the end date.
+	"""
+	days, basis = dayCounts[dayCount]
+	return quantity * couponRate * np.maximum(days(start, end) + extraDays, 0) / basis
+
+
+
+def bondColumns(bonds, fields):
+	"""
+	output: [dictionary] field -> array of the field of the bonds.
+	"""
+	return {field: np.array([bond.get(field) or 0.0 for bond in bonds], dtype=np.float64) \
+				for field in fields}
+
+
+
+def conventionName(name, extraDays):
+	return name + (' +1 day' if extraDays else '')
+
+
+
+def checkBonds(records, tolerances=None, conventions=None):
+	"""
+	records: [iterable] holding records, of any number of portfolios and
+		valuation dates, only bonds are checked.
+	tolerances: [dictionary] field -> tolerance, see defaultTolerances.
+	conventions: [dictionary] isin or portfolio -> the day count of its
+		bonds, a day count in dayCounts, optionally followed by ' +1 day'
+		(e.g., '30/360 +1 day'). An isin takes precedence over its
+		portfolio. Bonds not there use their usual day count in the
+		portfolio, inferred from all records given.
+
+	output: [list] outliers, each a dictionary with keys portfolio,
+		valuation_date, isin, accounting, field, trustee, computed,
+		difference, day_count (the closest day count) and
+		expected_day_count (the one computed is by), the last two for
+		accrued interest only.
+	"""
+	tolerances = dict(defaultTolerances, **(tolerances or {}))
+	conventions = conventions or {}
+	bonds = [r for r in records if r['type'] == 'bond']
+	if len(bonds) == 0:
+		return []
+
+	parsed = {}
+	def toDates(field):
+		return np.array([parsed[b[field]] if b[field] in parsed else \
+							parsed.setdefault(b[field], toDate(b[field])) for b in bonds],
+						dtype='datetime64[D]')
+
+	c = bondColumns(bonds, ['quantity', 'coupon_rate', 'accrued_interest', 'average_cost',
+							'amortized_cost', 'amortized_value', 'amortized_gain_loss',
+							'book_cost'])
+	start, valuation = toDates('coupon_start_date'), toDates('valuation_date')
+
+	# accrued interest by every day count, one row each
+	candidates = [(name, extraDays) for name in sorted(dayCounts) for extraDays in (0, 1)]
+	conventionNames = [conventionName(name, extraDays) for (name, extraDays) in candidates]
+	for name in conventions.values():
+		if not name in conventionNames:
+			raise ValueError('checkBonds(): invalid day count {0}'.format(name))
+
+	accrued = np.array([accruedInterest(c['quantity'], c['coupon_rate'], start,
+							valuation, name, extraDays) for (name, extraDays) in candidates])
+	errors = np.abs(accrued - c['accrued_interest'])
+	closest = np.argmin(errors, axis=0)
+
+	# the usual day count of a bond in a portfolio, the one within the
+	# tolerance on most valuation dates, then the closest over all dates
+	positions = defaultdict(list)
+	for (i, bond) in enumerate(bonds):
+		positions[(bond['portfolio'], bond['isin'])].append(i)
+
+	matches = errors <= tolerances['accrued_interest']
+	usual = np.zeros(len(bonds), dtype=np.int64)
+	for ((portfolio, isin), indexes) in positions.items():
+		name = conventions.get(isin, conventions.get(portfolio))
+		if name is None:
+			usual[indexes] = np.lexsort((errors[:, indexes].sum(axis=1),
+										-matches[:, indexes].sum(axis=1)))[0]
+		else:
+			usual[indexes] = conventionNames.index(name)
+
+	computed = accrued[usual, np.arange(len(bonds))]
+
+	checks = [('accrued_interest', c['accrued_interest'], computed,
+				np.ones(len(bonds), dtype=bool))]
+
+	htm = np.array([b['accounting'] == 'htm' for b in bonds])
+	low = np.minimum(c['average_cost'], 100)
+	high = np.maximum(c['average_cost'], 100)
+	checks.extend([
+		('amortized_value', c['amortized_value'],
+			c['quantity'] * c['amortized_cost'] / 100, htm),
+		('amortized_gain_loss', c['amortized_gain_loss'],
+			c['amortized_value'] - c['book_cost'], htm),
+		('amortized_cost', c['amortized_cost'],
+			np.clip(c['amortized_cost'], low, high), htm)
+	])
+
+	outliers = []
+	for (field, trustee, expected, applicable) in checks:
+		for i in np.flatnonzero(applicable & (np.abs(trustee - expected) > tolerances[field])):
+			outliers.append({
+				'portfolio': bonds[i]['portfolio'],
+				'valuation_date': bonds[i]['valuation_date'],
+				'isin': bonds[i]['isin'],
+				'accounting': bonds[i]['accounting'],
+				'field': field,
+				'trustee': float(trustee[i]),
+				'computed': float(expected[i]),
+				'difference': float(trustee[i] - expected[i]),
+				'day_count': conventionNames[closest[i]] if field == 'accrued_interest' else '',
+				'expected_day_count': conventionNames[usual[i]] \
+										if field == 'accrued_interest' else ''
+			})
+
+	logger.debug('checkBonds(): {0} bonds, {1} outliers'.format(len(bonds), len(outliers)))
+	return outliers
@@ -0,0 +1,380 @@
+# coding=utf-8
+#
+# Reprocess trustee files in bulk, say all files of the last few years
+# after a fix in the parser, and export them to Geneva csv files.
+#
+# Files are exported in parallel by a pool of worker processes, while the
+# next files are read from disk ahead of time. Each finished file is
+# written to a journal as soon as it is done, in whatever order, so when
+# the job is interrupted (or a bad file fails), running it again skips the
+# files already done. When a worker process dies, the pool is replaced and
+# the files it had are run again, one at a time.
+#
+# The csv files are named by portfolio as well as date (see byPortfolio of
+# open_dif()), as the files of the funds for the same date usually go to
+# the same output directory.
+#
+# A file that fails does not stop the others. It is read in bulk mode
+# (see dif.readFile()), so all the bad sections of it are found at once,
+# then it is copied to the quarantine directory, and its errors are added
+# to the error report there, one JSON line per error.
+#
+# A run can be stopped cleanly with a Progress object (see progress.py):
+# once it is cancelled, no more files are sent to the workers, the files
+# being exported are finished and written to the journal, then backfill()
+# returns. From the command line, the first Ctrl-C does that, the workers
+# ignore it.
+#
+
+from dif_revised.geneva import open_dif
+from dif_revised.dif import BadInput, parserLog, toDate
+from dif_revised.ratelog import summaryText
+from dif_revised.progress import Progress
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, \
+								FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from os.path import join, basename, abspath
+from datetime import date
+import json, os, re, shutil, signal, time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def listInputs(root, startDate=None, endDate=None):
+	"""
+	root: the directory to search for trustee files (.xls and .xlsx), sub
+		directories included.
+	startDate, endDate: (date) if given, only files with a date in their
+		file name (yyyy-mm-dd, like 'CLM BAL 2018-05-31.xls') between the
+		two dates, inclusive, are returned.
+
+	output: [list] full path to the files, sorted by date then by name.
+	"""
+	def fileDate(file):
+		m = re.search(r'(\d{4})-(\d{2})-(\d{2})', basename(file))
+		return date(int(m.group(1)), int(m.group(2)), int(m.group(3))) if m else None
+
+	def inRange(file):
+		if startDate is None and endDate is None:
+			return True
+		dt = fileDate(file)
+		if dt is None:
+			return False
+		return (startDate is None or dt >= startDate) and (endDate is None or dt <= endDate)
+
+	files = [join(directory, f) for (directory, _, fileNames) in os.walk(root) \
+				for f in fileNames if f.lower().endswith(('.xls', '.xlsx'))]
+	return sorted(filter(inRange, files), key=lambda f: (fileDate(f) or date.min, f))
+
+
+
+def readJournal(journal):
+	"""
+	output: [dictionary] full path of input file -> its latest journal
+		entry.
+	"""
+	entries = {}
+	if not os.path.exists(journal):
+		return entries
+
+	with open(journal, encoding='utf-8') as f:
+		for line in f:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue	# the last line of an interrupted run
+			entries[entry['file']] = entry
+
+	return entries
+
+
+
+def exportFile(args):
+	"""
+	args: (input file, content of the file, output directory, prefix, force)
+
+	output: (csv files, portValues) from open_dif(), the parser's log
+		counts of the file (see ratelog.py), and the rows and sections
+		parsed and csv rows written.
+
+	Runs in a worker process.
+	"""
+	file, contents, outputDir, prefix, force = args
+	portValues = {}
+	progress = Progress()
+	parserLog.summary(reset=True)
+	files = open_dif(contents, portValues, outputDir, prefix, force=force, strict=False,
+						progress=progress, byPortfolio=True)
+	return files, portValues, parserLog.summary(reset=True), \
+			(progress.rows, progress.sections, progress.rowsWritten)
+
+
+
+def ignoreInterrupt():
+	"""
+	Workers ignore Ctrl-C, so that it stops the main process only, which
+	lets them finish their files.
+	"""
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+
+def readContents(file):
+	with open(file, 'rb') as f:
+		return f.read()
+
+
+
+def logProgress(progress):
+	logger.info('backfill(): {done}/{total} files, {failed} failed, '
+				'{rate:.2f} files/s, ETA {eta:.0f}s'.format(**progress))
+
+
+
+def backfill(files, outputDir, prefix, journal=None, workers=None, readAhead=4,
+				force=False, retryFailed=False, report=logProgress, quarantineDir=None,
+				progress=None, crashRetries=1):
+	"""
+	files: [list] input files, e.g., from listInputs().
+	outputDir, prefix: same as open_dif(), the portfolio id follows the
+		prefix in the csv file names.
+	journal: the journal file, default is backfill_journal.jsonl in the
+		output directory.
+	workers: number of worker processes, default is the number of CPUs.
+	readAhead: number of files read ahead of the workers.
+	force: passed to open_dif(), True to export files even if the output
+		manifest says they are up to date.
+	retryFailed: True to retry files that failed in an earlier run.
+	report: a function called with the progress (a dictionary with done,
+		failed, total, rate in files per second and eta in seconds) after
+		each file.
+	quarantineDir: the directory to copy failed files to, with the error
+		report (error_report.jsonl), default is quarantine in the output
+		directory.
+	progress: a Progress object (see progress.py), if given, the rows,
+		sections and files done, and the csv rows written, are added to it. When it is cancelled, the
+		files not yet sent to the workers are left for the next run.
+	crashRetries: the number of times a file is run again when its worker
+		process dies (say it runs out of memory). The pool is replaced, and
+		the files of the dead pool run again one at a time, a file that
+		kills its worker more often than this fails as BrokenProcessPool.
+
+	output: [dictionary] the summary of this run, with keys done, failed,
+		skipped, cancelled (True if stopped by progress), elapsed (seconds)
+		and log_counts (the parser's log messages of all files, by kind,
+		which are also logged in one line).
+	"""
+	def cancelled():
+		return progress is not None and progress.isCancelled()
+
+	journal = journal or join(outputDir, 'backfill_journal.jsonl')
+	quarantineDir = quarantineDir or join(outputDir, 'quarantine')
+	finished = readJournal(journal)
+	todo = [abspath(f) for f in files if not abspath(f) in finished or \
+				(retryFailed and finished[abspath(f)]['status'] != 'ok')]
+	workers = workers or os.cpu_count()
+	endJournalLine(journal)
+	status = {'done': 0, 'failed': 0, 'total': len(todo), 'rate': 0.0, 'eta': 0.0}
+	logCounts = Counter()
+	start = time.time()
+
+	def newPool():
+		return ProcessPoolExecutor(max_workers=workers, initializer=ignoreInterrupt)
+
+	def fail(file, e, error):
+		errors = fileErrors(e)
+		writeJournal(journalFile, {'file': file, 'status': 'error', 'error': error,
+									'errors': errors})
+		quarantine(file, errors, quarantineDir)
+		status['failed'] = status['failed'] + 1
+		if progress is not None:
+			progress.update(files=1)
+
+	pool = newPool()
+	try:
+		with ThreadPoolExecutor(max_workers=1) as reader, \
+			open(journal, 'a', encoding='utf-8') as journalFile:
+
+			contents = {}	# file -> future of its content, the read ahead
+			pending = {}	# future of export -> (file, args)
+			crashed = []	# (file, args) of files whose worker died, to run again
+			attempts = Counter()
+			i = 0
+			while ((i < len(todo) or crashed) and not cancelled()) or pending:
+				# keep the workers busy, with readAhead files read in advance.
+				# Files whose worker died run again one at a time, so that a
+				# file that kills its worker does not fail the others.
+				while len(pending) < workers and not cancelled():
+					if crashed:
+						if pending:
+							break
+						file, args = crashed.pop(0)
+					elif i < len(todo):
+						for f in todo[i:i+workers+readAhead]:
+							if not f in contents:
+								contents[f] = reader.submit(readContents, f)
+
+						file = todo[i]
+						i = i + 1
+						try:
+							args = (file, contents.pop(file).result(), outputDir, prefix, force)
+						except OSError as e:
+							fail(file, e, '{0}'.format(e))
+							continue
+					else:
+						break
+
+					try:
+						future = pool.submit(exportFile, args)
+					except BrokenProcessPool:
+						pool.shutdown(wait=False)
+						pool = newPool()
+						future = pool.submit(exportFile, args)
+					pending[future] = (file, args)
+
+				if not pending:
+					continue
+
+				# results in the order they are done, a slow file does not
+				# hold up the others
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					file, args = pending.pop(future)
+					try:
+						outputs, portValues, counts, (rows, sections, rowsWritten) = \
+							future.result()
+						logCounts.update(counts)
+						writeJournal(journalFile, {'file': file, 'status': 'ok',
+													'outputs': outputs, 'portValues': portValues,
+													'log_counts': counts})
+						status['done'] = status['done'] + 1
+						if progress is not None:
+							progress.update(rows=rows, sections=sections, files=1,
+											rowsWritten=rowsWritten)
+					except BrokenProcessPool as e:
+						attempts[file] = attempts[file] + 1
+						if attempts[file] <= crashRetries:
+							logger.warning('backfill(): worker died on {0}, run it again'.format(file))
+							crashed.append((file, args))
+							continue
+						logger.error('backfill(): {0} failed: worker died'.format(file))
+						fail(file, e, 'BrokenProcessPool: the worker died on this file')
+					except Exception as e:
+						logger.error('backfill(): {0} failed: {1}'.format(file, e))
+						fail(file, e, '{0}: {1}'.format(type(e).__name__, e))
+
+					elapsed = time.time() - start
+					processed = status['done'] + status['failed']
+					status['rate'] = processed / elapsed if elapsed > 0 else 0.0
+					status['eta'] = (status['total'] - processed) / status['rate'] \
+										if status['rate'] > 0 else 0.0
+					report(dict(status))
+
+				if any(isinstance(f.exception(), BrokenProcessPool) for f in done):
+					# the other pending files of the dead pool fail the same way
+					pool.shutdown(wait=False)
+					pool = newPool()
+	finally:
+		pool.shutdown(wait=True)
+
+	if logCounts:
+		logger.info('backfill(): log summary: %s', summaryText(logCounts))
+	if cancelled():
+		logger.info('backfill(): cancelled, {0} files left for the next run'.format(
+					status['total'] - status['done'] - status['failed']))
+
+	return {'done': status['done'], 'failed': status['failed'],
+			'skipped': len(files) - len(todo), 'cancelled': cancelled(),
+			'elapsed': time.time() - start, 'log_counts': dict(logCounts)}
+
+
+
+def fileErrors(e):
+	"""
+	output: [list] the errors of a failed file, as dictionaries with keys
+		stage, section, error and message. All the errors found in bulk
+		mode for BadInput, otherwise the one error that stopped the file.
+	"""
+	if isinstance(e, BadInput):
+		return e.errors
+	else:
+		return [{'stage': 'file', 'section': '', 'error': type(e).__name__,
+				'message': str(e)}]
+
+
+
+def quarantine(file, errors, quarantineDir):
+	"""
+	Copy a failed file to the quarantine directory, and add its errors to
+	the error report there.
+	"""
+	os.makedirs(quarantineDir, exist_ok=True)
+	quarantined = join(quarantineDir, basename(file))
+	try:
+		shutil.copyfile(file, quarantined)
+	except OSError as e:
+		logger.error('quarantine(): copy {0} failed: {1}'.format(file, e))
+		quarantined = ''
+
+	with open(join(quarantineDir, 'error_report.jsonl'), 'a', encoding='utf-8') as f:
+		for error in errors:
+			f.write(json.dumps(dict(error, file=file, quarantined_as=quarantined),
+								ensure_ascii=False) + '\n')
+
+
+
+def endJournalLine(journal):
+	"""
+	If the last run was interrupted in the middle of writing a line to the
+	journal, end that line so that new entries start on a line of their own.
+	"""
+	if not os.path.exists(journal) or os.path.getsize(journal) == 0:
+		return
+
+	with open(journal, 'rb+') as f:
+		f.seek(-1, os.SEEK_END)
+		if f.read(1) != b'\n':
+			f.write(b'\n')
+
+
+
+def writeJournal(journalFile, entry):
+	journalFile.write(json.dumps(entry) + '\n')
+	journalFile.flush()
+	os.fsync(journalFile.fileno())
+
+
+
+
+if __name__ == '__main__':
+	import argparse
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	parser = argparse.ArgumentParser(description='backfill Geneva csv files')
+	parser.add_argument('inputDir')
+	parser.add_argument('outputDir')
+	parser.add_argument('prefix')
+	parser.add_argument('--start', type=toDate, help='yyyy-mm-dd')
+	parser.add_argument('--end', type=toDate, help='yyyy-mm-dd')
+	parser.add_argument('--workers', type=int)
+	parser.add_argument('--force', action='store_true')
+	parser.add_argument('--retry-failed', action='store_true')
+	args = parser.parse_args()
+
+	# the first Ctrl-C stops cleanly, the second one at once
+	progress = Progress()
+	def interrupt(signum, frame):
+		logger.info('backfill(): stopping after the files being exported, '
+					'Ctrl-C again to stop now')
+		progress.cancel()
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+
+	signal.signal(signal.SIGINT, interrupt)
+	print(backfill(listInputs(args.inputDir, args.start, args.end), args.outputDir,
+					args.prefix, workers=args.workers, force=args.force,
+					retryFailed=args.retry_failed, progress=progress))
+	print(progress.snapshot())
@@ -0,0 +1,317 @@
+# coding=utf-8
+#
+# Benchmarks with the sample workbooks. Run them like:
+#
+# 	python -m dif_revised.benchmark sections
+#
+# The samples are small, so a big workbook is made by repeating the
+# holding sections of a sample many times.
+#
+
+from dif_revised.utility import get_current_path
+from dif_revised.dif import open_workbook, worksheetToLines, readHolding, readFile, \
+								readSummaryFile, iterSections, sectionToRecords, toDate
+from dif_revised.cashflow import cashFlowLadder
+from dif_revised.sharedrecords import toShared, SharedRecords
+from dif_revised.navhistory import navAnalytics
+from dif_revised.bondrisk import bondRisk, dv01Buckets
+from dif_revised.geneva import genevaFields
+import dif_revised.dif as dif
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from os.path import join
+from datetime import date, timedelta
+import numpy as np
+import pickle, time, os, re, sys
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class LinesWorksheet():
+	"""
+	A worksheet made of lines, looks like a xlrd worksheet to readHolding().
+	"""
+	def __init__(self, lines):
+		self.lines = lines
+		self.nrows = len(lines)
+		self.ncols = max(len(line) for line in lines)
+
+	def cell_value(self, row, column):
+		line = self.lines[row]
+		return line[column] if column < len(line) else ''
+
+
+
+def bigWorksheet(fileName='CL Franklin DIF 2018-05-28(2nd Revised).xls', copies=50):
+	"""
+	output: a LinesWorksheet with the header of the sample and its holding
+		sections repeated a number of times.
+	"""
+	ws = open_workbook(join(get_current_path(), 'samples', fileName)).\
+			sheet_by_name('Portfolio Val.')
+	lines = worksheetToLines(ws)
+	starts = [i for i in range(len(lines)) if isinstance(lines[i][0], str) \
+				and re.match(r'[IVX]+\.{0,1}\s+', lines[i][0])]
+
+	# the last section is never parsed (see iterSections()), so repeat
+	# from the first section up to the last one.
+	return LinesWorksheet(lines[:starts[0]] + lines[starts[0]:starts[-1]] * copies \
+							+ lines[starts[-1]:])
+
+
+
+def timeIt(function, repeat=3):
+	"""
+	output: the best time in seconds of running the function.
+	"""
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+
+def benchSections(copies=50, workers=None):
+	"""
+	Parse a big worksheet, section by section in this process, then in
+	parallel with a process pool.
+	"""
+	ws = bigWorksheet(copies=copies)
+	workers = workers or os.cpu_count()
+	serial = timeIt(lambda: readHolding(ws))
+	print('sections: {0} rows, serial {1:.3f}s'.format(ws.nrows, serial))
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		readHolding(ws, executor=executor)	# start the workers
+		parallel = timeIt(lambda: readHolding(ws, executor=executor))
+
+	print('sections: {0} workers {1:.3f}s, speedup {2:.2f}x'.format(
+			workers, parallel, serial / parallel))
+
+
+
+def benchFields(copies=50):
+	"""
+	Build the records of a big worksheet for all fields, for the Geneva
+	csv fields only, and for a few fields. The worksheet is split into
+	sections first, as that does not depend on the fields.
+	"""
+	sections = list(iterSections(worksheetToLines(bigWorksheet(copies=copies))))[1:]
+	for (name, fields) in [('all', None), ('geneva', genevaFields),
+							('few', frozenset(['type', 'isin', 'ticker', 'quantity']))]:
+		elapsed = timeIt(lambda: [list(sectionToRecords(lines, fields)) for lines in sections], 10)
+		print('fields: {0} {1:.3f}s'.format(name, elapsed))
+
+
+
+def benchFilters():
+	"""
+	Read the holdings of the samples, all of them, then HTM bonds only and
+	cash only, the sections that do not match are skipped before parsing.
+	"""
+	wanted = [('all', None), ('htm', {'type': ['bond'], 'accounting': ['htm']}),
+				('cash', {'type': ['cash', 'broker account cash']})]
+	total = {name: 0.0 for (name, _) in wanted}
+	for fileName in sorted(os.listdir(join(get_current_path(), 'samples'))):
+		ws = open_workbook(join(get_current_path(), 'samples', fileName)).\
+				sheet_by_name('Portfolio Val.')
+		lines = worksheetToLines(ws)
+		for (name, filters) in wanted:
+			total[name] += timeIt(lambda: readHolding(LinesWorksheet(lines), filters=filters), 10)
+
+	for (name, _) in wanted:
+		print('filters: {0} {1:.4f}s, {2:.0%} of all'.format(name, total[name],
+				total[name] / total['all']))
+
+
+
+def benchStrings(days=250):
+	"""
+	Memory of the string values in the records of a year of daily files,
+	the samples read once and their lines copied with fresh strings for
+	each day, as reading a new file would.
+
+	The records are read twice, with the values interned, then with
+	interning turned off (dif.intern replaced by a function returning its
+	argument), as before interning. Each time the memory is that of the
+	distinct string objects the records hold.
+	"""
+	def freshCopy(lines):
+		return [[value.encode().decode() if isinstance(value, str) else value \
+					for value in line] for line in lines]
+
+	samples = [worksheetToLines(open_workbook(join(get_current_path(), 'samples', f)).\
+					sheet_by_name('Portfolio Val.')) for f in \
+				['CL Franklin DIF 2018-05-28(2nd Revised).xls', 'CLM BAL 2018-05-31.xls',
+				'CLM GNT 2017-10-25.xls']]
+
+	def stringMemory():
+		history = []
+		for day in range(days):
+			for lines in samples:
+				history.extend(readHolding(LinesWorksheet(freshCopy(lines))))
+
+		values = [value for record in history for value in record.values() \
+					if isinstance(value, str)]
+		distinct = {id(value): value for value in values}.values()
+		return len(history), len(values), sum(map(sys.getsizeof, distinct))
+
+	records, values, interned = stringMemory()
+	intern = dif.intern
+	dif.intern = lambda value: value
+	try:
+		_, _, notInterned = stringMemory()
+	finally:
+		dif.intern = intern
+
+	print('strings: {0} files, {1} records, {2} string values'.format(
+			days * len(samples), records, values))
+	print('strings: not interned {0:.2f}MB, interned {1:.2f}MB, saved {2:.2f}MB'.format(
+			notInterned / 1e6, interned / 1e6, (notInterned - interned) / 1e6))
+
+
+
+def benchCashFlows(days=500):
+	"""
+	Project the cash flow ladder of the HTM bonds of a sample, as if the
+	file was there for many valuation dates.
+	"""
+	records = readFile(join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls'))[0]
+	bonds = [r for r in records if r['type'] == 'bond' and r['accounting'] == 'htm']
+	start = date(2017, 10, 25)
+	manyDates = [dict(r, valuation_date='{0}-{1}-{2}'.format(dt.year, dt.month, dt.day)) \
+					for dt in [start + timedelta(days=i) for i in range(days)] for r in bonds]
+	elapsed = timeIt(lambda: cashFlowLadder(manyDates))
+	print('cashflows: {0} bonds, {1:.3f}s'.format(len(manyDates), elapsed))
+
+
+
+def benchNavHistory(years=5):
+	"""
+	NAV analytics of daily summaries over a number of years, made from the
+	summaries of the samples with a random walk of the unit price.
+	"""
+	summaries = [readSummaryFile(join(get_current_path(), 'samples', f)) for f in \
+					['CL Franklin DIF 2018-05-28(2nd Revised).xls', 'CLM BAL 2018-05-31.xls',
+					'CLM GNT 2017-10-25.xls']]
+	summaries.append(dict(summaries[-1], portfolio='30005'))
+
+	random = np.random.default_rng(0)
+	start, days = date(2013, 1, 1), years * 365
+	history = []
+	for summary in summaries:
+		prices = summary['unit_price'] * np.cumprod(1 + random.normal(0, 0.003, days))
+		for (i, price) in enumerate(prices.tolist()):
+			dt = start + timedelta(days=i)
+			history.append(dict(summary, unit_price=price, nav=price * summary['number_of_units'],
+							valuation_date='{0}-{1}-{2}'.format(dt.year, dt.month, dt.day)))
+
+	elapsed = timeIt(lambda: navAnalytics(history))
+	print('navhistory: {0} summaries, {1} flags, {2:.3f}s'.format(
+			len(history), len(navAnalytics(history)[1]), elapsed))
+
+
+
+def benchBondRisk(days=500):
+	"""
+	Yields, durations and DV01 of the bonds of the samples, as if the files
+	were there for many valuation dates before their own.
+	"""
+	bonds = []
+	for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls', 'CLM BAL 2018-05-31.xls',
+						'CLM GNT 2017-10-25.xls']:
+		bonds.extend(r for r in readFile(join(get_current_path(), 'samples', fileName))[0] \
+						if r['type'] == 'bond')
+	manyDates = [dict(r, valuation_date='{0}-{1}-{2}'.format(dt.year, dt.month, dt.day)) \
+					for i in range(days) for r in bonds \
+					for dt in [toDate(r['valuation_date']) - timedelta(days=i)]]
+	elapsed = timeIt(lambda: dv01Buckets(bondRisk(manyDates)))
+	print('bondrisk: {0} bonds, {1} converged, {2:.3f}s'.format(
+			len(manyDates), sum(r['converged'] for r in bondRisk(manyDates)), elapsed))
+
+
+
+@lru_cache(maxsize=None)
+def bigRecords(copies):
+	"""
+	output: [list] records of a big worksheet, parsed once per process, so
+		that the transport benchmark measures the transport only.
+	"""
+	return readHolding(bigWorksheet(copies=copies))
+
+def bigRecordsShared(copies):
+	return toShared(bigRecords(copies))
+
+
+
+def benchTransport(copies=50, files=8, workers=None):
+	"""
+	Hand the records of a big worksheet from a worker process to the
+	parent, as a pickled list of dictionaries, then through shared memory
+	(see sharedrecords.py), taken as records or used as columns only.
+
+	The worker and the parent side are timed in this process first, then
+	a number of files through a process pool. With many workers the parent
+	side is what limits the throughput, the workers run in parallel.
+	"""
+	def marketValueByCurrency(shared):
+		currency = shared.codes('currency')
+		return np.bincount(currency[currency >= 0], weights=np.nan_to_num(
+					shared.floats('market_value'))[currency >= 0])
+
+	def sharedRecords(toResult):
+		def run(handle):
+			with SharedRecords(handle) as shared:
+				return toResult(shared)
+		return run
+
+	records = bigRecords(copies)
+	methods = [('pickled records', pickle.dumps, pickle.loads),
+				('shared records', toShared, sharedRecords(SharedRecords.records)),
+				('shared columns', toShared, sharedRecords(marketValueByCurrency))]
+	print('transport: {0} records'.format(len(records)))
+	for (name, send, receive) in methods:
+		sent = []
+		worker = timeIt(lambda: sent.append(send(records)))
+		parent = timeIt(lambda: receive(sent.pop()))
+		print('transport: {0}, worker {1:.3f}s, parent {2:.3f}s'.format(name, worker, parent))
+
+	workers = workers or os.cpu_count()
+	with ProcessPoolExecutor(max_workers=workers, initializer=bigRecords,
+								initargs=(copies,)) as executor:
+		def pool(function, receive):
+			return lambda: [receive(f.result()) for f in \
+								[executor.submit(function, copies) for i in range(files)]]
+
+		results = [('pickled records', timeIt(pool(bigRecords, lambda records: records)))] + \
+					[(name, timeIt(pool(bigRecordsShared, receive))) \
+						for (name, send, receive) in methods[1:]]
+
+	for (name, elapsed) in results:
+		print('transport: {0}, {1} files with {2} workers {3:.3f}s'.format(
+				name, files, workers, elapsed))
+
+
+
+benchmarks = {
+	'sections': benchSections,
+	'fields': benchFields,
+	'filters': benchFilters,
+	'strings': benchStrings,
+	'cashflows': benchCashFlows,
+	'transport': benchTransport,
+	'navhistory': benchNavHistory,
+	'bondrisk': benchBondRisk
+}
+
+
+
+if __name__ == '__main__':
+	logging.disable(logging.WARNING)	# the samples log lots of warnings
+	for name in sys.argv[1:] or sorted(benchmarks):
+		benchmarks[name]()
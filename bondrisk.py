@@ -0,0 +1,187 @@
+# coding=utf-8
+#
+# Yield to maturity, duration and DV01 of every bond in the holding
+# records, per valuation date, and DV01 summed up by portfolio, currency
+# and accounting treatment.
+#
+# The cash flows of all bonds are projected at once (see cashflow.py), per
+# 100 par, and the yields of all bonds are solved together by Newton's
+# method on NumPy arrays, each iteration is a few array operations over
+# all cash flows, there is no loop over bonds.
+#
+# The price of a bond is its amortized_cost for HTM bonds (the yield is
+# then the book yield), and its market price otherwise, both in percent of
+# par and clean, the accrued interest is added for the dirty price. The
+# yield is compounded frequency times a year, time is in years of 365
+# days from the valuation date:
+#
+# 	dirty price = sum of cf / (1 + y / frequency) ^ (frequency * t)
+#
+# 	modified duration = macaulay duration / (1 + y / frequency)
+# 	DV01 = modified duration * dirty value * 0.0001
+#
+
+from dif_revised.cashflow import bondArrays, projectCashFlows
+from dif_revised.dif import writeCsv
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def isBond(record):
+	return record['type'] == 'bond'
+
+
+
+def bondPrices(bonds):
+	"""
+	bonds: [list] bond records.
+
+	output: [dictionary] arrays with keys clean (the price in percent of
+		par, see above), accrued (the accrued interest in percent of par)
+		and dirty, one element per bond.
+	"""
+	clean = np.array([(b.get('amortized_cost') if b['accounting'] == 'htm' else b.get('price')) \
+						or np.nan for b in bonds], dtype=np.float64)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		accrued = np.array([b.get('accrued_interest') or 0.0 for b in bonds], dtype=np.float64) \
+					/ np.array([b['quantity'] for b in bonds], dtype=np.float64) * 100
+	accrued = np.nan_to_num(accrued)
+	return {'clean': clean, 'accrued': accrued, 'dirty': clean + accrued}
+
+
+
+def solveYields(bond, years, flows, dirty, frequency=2, guess=None, tolerance=1e-10,
+				maxIterations=50):
+	"""
+	bond: [array] the index of the bond of each cash flow.
+	years: [array] the time of each cash flow, in years.
+	flows: [array] the amount of each cash flow, per 100 par.
+	dirty: [array] the dirty price of each bond, per 100 par.
+	guess: [array] the yields to start from, default 5%.
+
+	output: two arrays, the yield of each bond, and whether it converged.
+		A bond without cash flows or price has yield NaN.
+	"""
+	n = len(dirty)
+	y = np.full(n, 0.05) if guess is None else np.array(guess, dtype=np.float64)
+	step = np.full(n, np.inf)
+	with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+		for i in range(maxIterations):
+			base = 1 + y[bond] / frequency
+			discounted = flows * base ** (-frequency * years)
+			value = np.bincount(bond, discounted, minlength=n)
+			slope = np.bincount(bond, -years * discounted / base, minlength=n)
+			step = (value - dirty) / slope
+			y = np.maximum(y - step, 1e-6 - frequency)	# keep 1 + y / frequency positive
+			if not (np.abs(step) > tolerance).any():
+				break
+
+	converged = np.abs(step) <= tolerance
+	return np.where(converged, y, np.nan), converged
+
+
+
+def bondRisk(records, frequency=2):
+	"""
+	records: [iterable] holding records, of any number of portfolios and
+		valuation dates, only bonds are used.
+	frequency: number of coupons a year.
+
+	output: [list] one dictionary per bond, with keys portfolio,
+		valuation_date, isin, accounting, currency, quantity, clean_price,
+		dirty_price, yield, macaulay_duration, modified_duration, dv01 (in
+		the bond's currency, for the quantity held), dv01_base (in the
+		portfolio's base currency) and converged. The numbers are NaN for a
+		bond whose yield is not found, like a matured one.
+	"""
+	records = list(records)
+	bonds = list(filter(isBond, records))
+	if len(bonds) == 0:
+		return []
+
+	arrays = bondArrays(records, isBond)
+	prices = bondPrices(bonds)
+	n = len(bonds)
+
+	# cash flows per 100 par
+	flows = projectCashFlows(dict(arrays, quantity=np.full(n, 100.0)), frequency)
+	bond = flows['bond']
+	years = (flows['date'] - arrays['valuation'][bond]).astype(np.int64) / 365
+	amounts = flows['coupon'] + flows['redemption']
+
+	y, converged = solveYields(bond, years, amounts, prices['dirty'], frequency,
+								guess=np.maximum(arrays['coupon_rate'], 0.001))
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		base = 1 + y[bond] / frequency
+		discounted = amounts * base ** (-frequency * years)
+		value = np.bincount(bond, discounted, minlength=n)
+		macaulay = np.bincount(bond, years * discounted, minlength=n) / value
+		modified = macaulay / (1 + y / frequency)
+		dv01 = modified * prices['dirty'] / 100 * arrays['quantity'] * 0.0001
+
+	risk = [{
+		'portfolio': b['portfolio'],
+		'valuation_date': b['valuation_date'],
+		'isin': b['isin'],
+		'accounting': b['accounting'],
+		'currency': b['currency'],
+		'quantity': q,
+		'clean_price': c,
+		'dirty_price': d,
+		'yield': yld,
+		'macaulay_duration': mac,
+		'modified_duration': mod,
+		'dv01': dv,
+		'dv01_base': dv * fx,
+		'converged': ok
+	} for (b, q, c, d, yld, mac, mod, dv, fx, ok) in zip(bonds, arrays['quantity'].tolist(),
+		prices['clean'].tolist(), prices['dirty'].tolist(), y.tolist(), macaulay.tolist(),
+		modified.tolist(), dv01.tolist(), arrays['exchange_rate'].tolist(), converged.tolist())]
+
+	logger.debug('bondRisk(): {0} bonds, {1} not converged'.format(n, n - int(converged.sum())))
+	return risk
+
+
+
+def dv01Buckets(risk):
+	"""
+	risk: [list] from bondRisk().
+
+	output: [list] one dictionary per (valuation_date, portfolio, currency,
+		accounting), with keys those four, bonds (the number of bonds),
+		dv01 and dv01_base (sums, bonds without a yield are left out).
+		Sorted by the first four.
+	"""
+	keys = {}
+	bucket = np.array([keys.setdefault((r['valuation_date'], r['portfolio'], r['currency'], \
+						r['accounting']), len(keys)) for r in risk], dtype=np.int64)
+	if len(keys) == 0:
+		return []
+
+	def total(field):
+		return np.bincount(bucket, np.nan_to_num([r[field] for r in risk]), minlength=len(keys))
+
+	counts = np.bincount(bucket, minlength=len(keys)).tolist()
+	dv01, dv01Base = total('dv01').tolist(), total('dv01_base').tolist()
+	return sorted([{
+		'valuation_date': key[0],
+		'portfolio': key[1],
+		'currency': key[2],
+		'accounting': key[3],
+		'bonds': counts[i],
+		'dv01': dv01[i],
+		'dv01_base': dv01Base[i]
+	} for (key, i) in keys.items()], key=lambda b: (b['valuation_date'], b['portfolio'],
+													b['currency'], b['accounting']))
+
+
+
+def writeRisk(file, risk, delimiter=','):
+	headers = ['portfolio', 'valuation_date', 'isin', 'accounting', 'currency', 'quantity',
+				'clean_price', 'dirty_price', 'yield', 'macaulay_duration', 'modified_duration',
+				'dv01', 'dv01_base', 'converged']
+	writeCsv(file, [headers] + [[r[h] for h in headers] for r in risk], delimiter)
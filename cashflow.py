@@ -0,0 +1,178 @@
+# coding=utf-8
+#
+# Project the coupon and redemption cash flows of HTM bonds, from the bond
+# records of readHolding(), and aggregate them into a monthly ladder by
+# valuation date, portfolio and currency.
+#
+# The schedules of all bonds are generated at once with NumPy date arrays,
+# there is no loop over bonds or coupon dates in Python, so thousands of
+# bonds over many valuation dates take about the same time as a few.
+#
+# Coupon dates are counted forward from coupon_start_date (the start of
+# the current coupon period) every 12/frequency months, keeping the day of
+# month (or the month end for shorter months), up to the month of
+# maturity_date, where the last coupon and the redemption are paid on
+# maturity_date itself. Each coupon is quantity * coupon_rate / frequency,
+# the redemption at maturity is the quantity, i.e., par.
+#
+
+from dif_revised.dif import toDate, writeCsv
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def isHtmBond(record):
+	return record['type'] == 'bond' and record['accounting'] == 'htm'
+
+
+
+def bondArrays(records, select=isHtmBond):
+	"""
+	records: [iterable] holding records.
+	select: a function (record) -> True for the bonds to use, the default
+		is HTM bonds.
+
+	output: [dictionary] the HTM bonds as arrays, one element per bond,
+		with keys quantity, coupon_rate, exchange_rate, coupon_start,
+		maturity, valuation (dates as datetime64[D]) and group (index of
+		the bond's (valuation date, portfolio, currency) in groups), and
+		groups, the list of those tuples.
+	"""
+	bonds = list(filter(select, records))
+	groups = {}
+	groupIndex = [groups.setdefault((toDate(b['valuation_date']), b['portfolio'], \
+					b['currency']), len(groups)) for b in bonds]
+
+	parsed = {}		# the same dates repeat a lot, parse each only once
+	def toDates(field):
+		return np.array([parsed[b[field]] if b[field] in parsed else \
+							parsed.setdefault(b[field], toDate(b[field])) for b in bonds],
+						dtype='datetime64[D]')
+
+	def toFloats(field):
+		return np.array([b[field] for b in bonds], dtype=np.float64)
+
+	return {
+		'quantity': toFloats('quantity'),
+		'coupon_rate': toFloats('coupon_rate'),
+		'exchange_rate': toFloats('exchange_rate'),
+		'coupon_start': toDates('coupon_start_date'),
+		'maturity': toDates('maturity_date'),
+		'valuation': toDates('valuation_date'),
+		'group': np.array(groupIndex, dtype=np.int64),
+		'groups': sorted(groups, key=groups.get)
+	}
+
+
+
+def projectCashFlows(bonds, frequency=2):
+	"""
+	bonds: [dictionary] from bondArrays().
+	frequency: number of coupons a year.
+
+	output: [dictionary] the cash flows after the valuation date, one
+		element per cash flow, with keys bond (index of the bond), date
+		(datetime64[D]), coupon and redemption.
+	"""
+	step = 12 // frequency
+	startMonth = bonds['coupon_start'].astype('datetime64[M]')
+	startDay = (bonds['coupon_start'] - startMonth.astype('datetime64[D]')).astype(np.int64)
+	months = (bonds['maturity'].astype('datetime64[M]') - startMonth).astype(np.int64)
+	periods = np.maximum(-(-months // step), 1)
+
+	# flatten the schedules, k is the number of the coupon in its bond
+	bond = np.repeat(np.arange(len(periods)), periods)
+	k = np.arange(len(bond)) - np.repeat(np.cumsum(periods) - periods, periods) + 1
+
+	month = startMonth[bond] + (k * step).astype('timedelta64[M]')
+	monthStart = month.astype('datetime64[D]')
+	monthLength = ((month + 1).astype('datetime64[D]') - monthStart).astype(np.int64)
+	last = k == periods[bond]
+	dates = np.where(last, bonds['maturity'][bond],
+						monthStart + np.minimum(startDay[bond], monthLength - 1))
+
+	coupon = bonds['quantity'][bond] * bonds['coupon_rate'][bond] / frequency
+	redemption = np.where(last, bonds['quantity'][bond], 0.0)
+
+	future = dates > bonds['valuation'][bond]
+	return {
+		'bond': bond[future],
+		'date': dates[future],
+		'coupon': coupon[future],
+		'redemption': redemption[future]
+	}
+
+
+
+def cashFlowLadder(records, frequency=2, horizon=None):
+	"""
+	records: [iterable] holding records, of any number of portfolios and
+		valuation dates.
+	frequency: number of coupons a year.
+	horizon: (int) if given, only cash flows within this number of months
+		after the valuation month are included.
+
+	output: [list] the ladder, one dictionary per (valuation date,
+		portfolio, currency, month), with keys valuation_date (yyyy-mm-dd),
+		portfolio, currency, month (yyyy-mm), coupon, redemption, total and
+		total_base (the total in the portfolio's base currency, by the
+		exchange rate of the valuation date). Sorted by the first four.
+	"""
+	bonds = bondArrays(records)
+	if len(bonds['groups']) == 0:
+		return []
+
+	flows = projectCashFlows(bonds, frequency)
+	flowMonth = flows['date'].astype('datetime64[M]').astype(np.int64)
+	if horizon is not None:
+		valuationMonth = bonds['valuation'][flows['bond']].astype('datetime64[M]').astype(np.int64)
+		within = flowMonth - valuationMonth <= horizon
+		flows = {key: value[within] for (key, value) in flows.items()}
+		flowMonth = flowMonth[within]
+
+	# one bucket per (group, month), summed by bincount
+	group = bonds['group'][flows['bond']]
+	buckets, bucket = np.unique(group * (flowMonth.max() + 1 if len(flowMonth) > 0 else 1) \
+									+ flowMonth, return_inverse=True)
+	sums = {}
+	for field in ('coupon', 'redemption'):
+		sums[field] = np.bincount(bucket, weights=flows[field], minlength=len(buckets))
+	total = sums['coupon'] + sums['redemption']
+	totalBase = np.bincount(bucket, minlength=len(buckets), \
+					weights=(flows['coupon'] + flows['redemption']) * \
+							bonds['exchange_rate'][flows['bond']])
+
+	bucketGroup = np.zeros(len(buckets), dtype=np.int64)
+	bucketGroup[bucket] = group
+	bucketMonth = np.zeros(len(buckets), dtype=np.int64)
+	bucketMonth[bucket] = flowMonth
+
+	groups = [(dt.isoformat(), portfolio, currency) for (dt, portfolio, currency) \
+				in bonds['groups']]
+	monthText = np.datetime_as_string(bucketMonth.astype('datetime64[M]')).tolist()
+	ladder = [{
+		'valuation_date': groups[g][0],
+		'portfolio': groups[g][1],
+		'currency': groups[g][2],
+		'month': m,
+		'coupon': c,
+		'redemption': r,
+		'total': t,
+		'total_base': b
+	} for (g, m, c, r, t, b) in zip(bucketGroup.tolist(), monthText, sums['coupon'].tolist(),
+		sums['redemption'].tolist(), total.tolist(), totalBase.tolist())]
+
+	logger.debug('cashFlowLadder(): {0} bonds, {1} cash flows, {2} buckets'.format(
+					len(bonds['group']), len(flows['date']), len(ladder)))
+	return sorted(ladder, key=lambda r: (r['valuation_date'], r['portfolio'], \
+											r['currency'], r['month']))
+
+
+
+def writeLadder(file, ladder, delimiter=','):
+	headers = ['valuation_date', 'portfolio', 'currency', 'month', 'coupon',
+				'redemption', 'total', 'total_base']
+	writeCsv(file, [headers] + [[row[h] for h in headers] for row in ladder], delimiter)
@@ -0,0 +1,218 @@
+# coding=utf-8
+#
+# Derive the implied trades of a portfolio between two valuation dates,
+# from the holding records of the two trustee files: quantity changes,
+# new and closed positions, and cash movements per bank and currency.
+#
+# A snapshot of a file is a hash table of position key -> amount, so two
+# snapshots are compared in one pass over their keys. The change feed
+# keeps only the last snapshot of each portfolio (optionally saved to a
+# state file), each new file is compared against it, then replaces it, so
+# the history is never compared again.
+#
+
+from dif_revised.dif import toDate
+from dif_revised.exposure import securityKey
+from os.path import exists
+from uuid import uuid4
+import csv, json, os
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def isCash(record):
+	return record['type'] in ('cash', 'broker account cash')
+
+
+
+def positionKey(record):
+	"""
+	output: [tuple] the key of a position in a snapshot, (type, bank,
+		currency) for cash, (type, security, accounting) for others. Cash
+		of the same bank and currency in different accounts is one position.
+	"""
+	if isCash(record):
+		return (record['type'], record['bank'], record['currency'])
+	else:
+		return (record['type'], securityKey(record), record['accounting'])
+
+
+
+def snapshot(records):
+	"""
+	records: [iterable] holding records of one file, from readHolding().
+
+	output: [dictionary] the snapshot, with keys portfolio, valuation_date
+		and positions, a dictionary of position key -> [amount, currency].
+		The amount is the balance (book_cost) for cash and the quantity for
+		others.
+	"""
+	positions = {}
+	portfolio, valuationDate = None, None
+	for record in records:
+		portfolio, valuationDate = record['portfolio'], record['valuation_date']
+		amount = record['book_cost'] if isCash(record) else record['quantity']
+		key = positionKey(record)
+		if key in positions:
+			positions[key][0] = positions[key][0] + amount
+		else:
+			positions[key] = [amount, record.get('currency', '')]
+
+	return {'portfolio': portfolio, 'valuation_date': valuationDate, 'positions': positions}
+
+
+
+def diffSnapshots(before, after, tolerance=1e-6):
+	"""
+	before, after: snapshots of the same portfolio, from snapshot().
+	tolerance: an amount changed by no more than this is not a change.
+
+	output: [list] changes, each a dictionary with keys portfolio,
+		previous_date, date, kind ('cash' or 'position'), type, id (bank
+		for cash, isin, ticker etc. for others), accounting (empty for
+		cash), currency, change ('new', 'closed' or 'changed'), before,
+		after and delta. Sorted by key.
+	"""
+	changes = []
+	old, new = before['positions'], after['positions']
+	for key in sorted(set(old) | set(new)):
+		amountBefore, currency = old.get(key, [0.0, ''])
+		amountAfter, currency = new.get(key, [0.0, currency])
+		if not key in old:
+			change = 'new'
+		elif not key in new:
+			change = 'closed'
+		elif abs(amountAfter - amountBefore) > tolerance:
+			change = 'changed'
+		else:
+			continue
+
+		kind = 'cash' if key[0] in ('cash', 'broker account cash') else 'position'
+		changes.append({
+			'portfolio': after['portfolio'],
+			'previous_date': before['valuation_date'],
+			'date': after['valuation_date'],
+			'kind': kind,
+			'type': key[0],
+			'id': key[1],
+			'accounting': '' if kind == 'cash' else key[2],
+			'currency': currency,
+			'change': change,
+			'before': amountBefore,
+			'after': amountAfter,
+			'delta': amountAfter - amountBefore
+		})
+
+	return changes
+
+
+
+class ChangeFeed():
+	"""
+	The change feed of any number of portfolios, fed one file at a time in
+	date order.
+
+	stateFile: a JSON file to keep the last snapshot of each portfolio, so
+		that tomorrow's run continues from today's. If not given, the
+		snapshots are kept in memory only.
+	"""
+	def __init__(self, stateFile=None):
+		self.stateFile = stateFile
+		self.last = {}		# portfolio -> the last snapshot
+		if stateFile and exists(stateFile):
+			with open(stateFile, encoding='utf-8') as f:
+				for s in json.load(f):
+					s['positions'] = {tuple(key): value for (key, value) in s['positions']}
+					self.last[s['portfolio']] = s
+
+
+	def add(self, records):
+		"""
+		records: [iterable] holding records of one file.
+
+		output: [list] the changes since the last snapshot of the portfolio,
+			see diffSnapshots(), an empty list for the first snapshot of a
+			portfolio, as there is nothing to compare against.
+		"""
+		current = snapshot(records)
+		if current['portfolio'] is None:
+			return []
+
+		previous = self.last.get(current['portfolio'])
+		if previous is not None and \
+			toDate(current['valuation_date']) <= toDate(previous['valuation_date']):
+			raise ValueError('ChangeFeed.add(): {0} {1} is not after the last snapshot {2}'.\
+				format(current['portfolio'], current['valuation_date'], previous['valuation_date']))
+
+		changes = [] if previous is None else diffSnapshots(previous, current)
+		self.last[current['portfolio']] = current
+		if self.stateFile:
+			self.save()
+
+		logger.debug('ChangeFeed.add(): {0} {1}, {2} changes'.format(
+						current['portfolio'], current['valuation_date'], len(changes)))
+		return changes
+
+
+	def save(self):
+		"""
+		Save the last snapshots to the state file, replaced as a whole.
+		"""
+		state = [dict(s, positions=[[list(key), value] for (key, value) \
+					in s['positions'].items()]) for s in self.last.values()]
+		tempFile = '{0}.{1}.tmp'.format(self.stateFile, uuid4().hex)
+		with open(tempFile, 'w', encoding='utf-8') as f:
+			json.dump(state, f)
+		os.replace(tempFile, self.stateFile)
+
+
+
+def changeFeed(snapshots, stateFile=None):
+	"""
+	snapshots: [iterable] holding records of one file each, in date order
+		for each portfolio.
+
+	output: [generator] the changes, file by file.
+	"""
+	feed = ChangeFeed(stateFile)
+	for records in snapshots:
+		for change in feed.add(records):
+			yield change
+
+
+
+"""
+The fields of a change, in the order of csv columns.
+"""
+changeFields = ('portfolio', 'previous_date', 'date', 'kind', 'type', 'id', 'accounting',
+				'currency', 'change', 'before', 'after', 'delta')
+
+def writeChanges(file, changes, fileFormat='jsonl'):
+	"""
+	file: the output file, changes are appended to it, so the feed of
+		each day is added to the same file.
+	changes: [iterable] changes from ChangeFeed.add() or changeFeed().
+	fileFormat: 'jsonl' for one JSON object per line, or 'csv'.
+
+	output: the number of changes written.
+	"""
+	n = 0
+	newFile = not exists(file) or os.path.getsize(file) == 0
+	with open(file, 'a', newline='', encoding='utf-8') as f:
+		if fileFormat == 'jsonl':
+			for change in changes:
+				f.write(json.dumps(change, ensure_ascii=False) + '\n')
+				n = n + 1
+		elif fileFormat == 'csv':
+			writer = csv.writer(f)
+			if newFile:
+				writer.writerow(changeFields)
+			for change in changes:
+				writer.writerow([change[field] for field in changeFields])
+				n = n + 1
+		else:
+			raise ValueError('writeChanges(): unsupported format {0}'.format(fileFormat))
+
+	return n
@@ -6,13 +6,27 @@
 
 from xlrd import open_workbook
 from functools import reduce
-from itertools import chain
-from datetime import datetime
+from itertools import chain, islice, repeat
+from datetime import datetime, date
+from io import BytesIO
+from mmap import mmap
+from os import PathLike, replace, remove
+from os.path import exists
+from uuid import uuid4
+from types import MappingProxyType
+from dif_revised.ratelog import RateLimitedLog
+from sys import intern
 import csv, re
 
 import logging
 logger = logging.getLogger(__name__)
 
+"""
+For messages that can come once per row or per section, counted and rate
+limited, see ratelog.py.
+"""
+parserLog = RateLimitedLog(logger)
+
 
 
 class InvalidAccoutingInfo(Exception):
@@ -36,12 +50,77 @@ class RecordTypeNotSupported(Exception):
 class UnderlyingTypeNotFound(Exception):
 	pass
 
+class BadInput(Exception):
+	"""
+	Raised in bulk mode, with all the errors found in an input file, see
+	readFile().
+	"""
+	def __init__(self, errors):
+		super(BadInput, self).__init__(errors)
+		self.errors = errors
+
+
+
+"""
+The lookup tables below are read only (MappingProxyType), they are built
+once at import and shared by all threads, and no function changes them.
+So is every other module level table in this package.
+
+The base currency of each portfolio, i.e., the currency that a record's
+exchange_rate converts to.
+"""
+baseCurrency = MappingProxyType({
+	'19437': 'HKD',
+	'30003': 'MOP',
+	'30004': 'MOP',
+	'30005': 'MOP'
+})
+
 
 
-def readFile(file):
+"""
+The custodian of equity and bond positions of each portfolio.
+"""
+custodianMap = MappingProxyType({
+	'30003':'ICBCMACAU',
+	'30004':'ICBCMACAU',
+	'30005':'ICBCMACAU',
+	'19437':'BOCHK'
+})
+
+
+def readFile(file, fxTable=None, executor=None, errors=None, fields=None, filters=None,
+				progress=None):
 	"""
-	ws: the full path to the China Life trustee's Excel file, for DIF,
-		balanced fund and guarantee fund.
+	file: the full path to the China Life trustee's Excel file, for DIF,
+		balanced fund and guarantee fund. Or the file's content, as bytes,
+		bytearray, memoryview, mmap or a file like object opened in binary
+		mode, so that a file from an email attachment or an archive can be
+		read without being saved to disk first.
+
+	fxTable: [dictionary] if given, populated with currency -> exchange
+		rate to the portfolio's base currency, see readHolding().
+
+	executor: a process pool to parse sections in parallel, see
+		readHolding().
+
+	errors: [list] if given (bulk mode), a section that fails to parse, or
+		a failed validation, does not raise. The error is appended to the
+		list (see sectionError()), and the rest of the file is read, so
+		that all errors of a file are found in one go. The default is
+		strict mode, the first error raises.
+
+	fields: [iterable] if given, only these fields of the records are
+		wanted, see readHolding(). The fields validate() needs (see
+		validateFields) are in the records as well.
+
+	filters: [dictionary] if given, only the records that match, see
+		readHolding(). The subtotals in summary are of the whole file.
+
+	progress: a Progress object (see progress.py), if given, the rows and
+		sections are added to it as they are parsed, and the file when it
+		is done. When it is cancelled, Cancelled is raised between
+		sections.
 
 	output: two items:
 		[list] a list of holdings of the portfolios, i.e., cash, equity,
@@ -50,14 +129,178 @@ def readFile(file):
 		[dictionary] the portfolio's summary, from the readSummary()
 			function.
 	"""
-	wb = open_workbook(filename=file)
-	records = readHolding(wb.sheet_by_name('Portfolio Val.'))
-	summary = readSummary(wb.sheet_by_name('Portfolio Sum.'))
-	validate(records, summary)
+	wb = openWorkbook(file)
+	try:
+		records = readHolding(worksheetByName(wb, 'Portfolio Val.'), fxTable, executor, errors,
+								None if fields is None else validateFields.union(fields), filters,
+								progress)
+		summary = readSummary(worksheetByName(wb, 'Portfolio Sum.'))
+	finally:
+		closeWorkbook(wb)
+
+	if errors is None:
+		validate(records, summary)
+	else:
+		try:
+			validate(records, summary)
+		except Exception as e:
+			errors.append({'stage': 'validate', 'section': '', 'error': type(e).__name__,
+							'message': str(e)})
+
+	if progress is not None:
+		progress.update(files=1)
 	return records, summary
 
 
 
+def readSummaryFile(file):
+	"""
+	file: the China Life trustee's Excel file, same as readFile().
+
+	output: [dictionary] the portfolio's summary, from the readSummary()
+		function, plus the portfolio id ('portfolio') and valuation date
+		('valuation_date'). The NAV, number of units and unit price are
+		validated the same way as readFile() does.
+
+	This is a fast path for NAV and unit price checks, only the 'Portfolio
+	Sum.' worksheet is loaded, holdings in 'Portfolio Val.' are not read.
+	If the fund name or valuation period are not in the summary, the
+	lines of 'Portfolio Val.' are read only up to its first section.
+	"""
+	wb = openWorkbook(file, onDemand=True)
+	try:
+		lines = list(worksheetToLines(worksheetByName(wb, 'Portfolio Sum.')))
+		infoLines = findPortfolioInfoLines(lines)
+		if len(infoLines) < 2:
+			# fund name or valuation period not in summary, use the header
+			# section of the holdings instead.
+			infoLines = next(iterSections(iterWorksheetLines(
+							worksheetByName(wb, 'Portfolio Val.'))))
+	finally:
+		closeWorkbook(wb)
+
+	summary = linesToSummary(lines)
+	validateNav(summary)
+	summary['valuation_date'], summary['portfolio'], _ = getPortfolioInfo(infoLines)
+	return summary
+
+
+
+def findPortfolioInfoLines(lines):
+	"""
+	lines: [iterable] lines of a worksheet.
+
+	output: [list] the fund name line and the valuation period line,
+		needed by getPortfolioInfo(). Scanning stops as soon as both are
+		found, if not found, the list has less than 2 lines.
+	"""
+	infoLines = {}
+	for line in lines:
+		if not isinstance(line[0], str):
+			continue
+		if line[0].startswith('Valuation Period'):
+			infoLines['Valuation Period'] = line
+		elif line[0].startswith('Fund Name'):
+			infoLines['Fund Name'] = line
+
+		if len(infoLines) == 2:
+			break
+
+	return list(infoLines.values())
+
+
+
+def fileContents(file):
+	"""
+	file: the full path to the Excel file, or its content, see readFile().
+
+	output: None if file is a path, otherwise a buffer of the file's
+		content. Buffers (bytes, bytearray, memoryview, mmap) are returned
+		as is and an in memory file (BytesIO) gives a view of its buffer,
+		so the content is not copied. Other file like objects are read.
+	"""
+	if isinstance(file, (str, PathLike)):
+		return None
+	elif isinstance(file, (bytes, bytearray, memoryview, mmap)):
+		return file
+	elif hasattr(file, 'getbuffer'):
+		return file.getbuffer()
+	elif hasattr(file, 'read'):
+		return file.read()
+	else:
+		raise TypeError('fileContents(): unsupported input {0}'.format(type(file)))
+
+
+
+def fileFormat(file):
+	"""
+	file: the full path to the Excel file, or its content, see readFile().
+
+	output: a string for the format of the file, detected from the first
+		bytes of the file instead of the file name:
+
+		'xlsx': a zip file (Excel 2007 and later)
+		'xls': anything else, left to xlrd to handle
+	"""
+	contents = fileContents(file)
+	if contents is None:
+		with open(file, 'rb') as f:
+			signature = f.read(4)
+	else:
+		signature = bytes(contents[:4])
+
+	if signature == b'PK\x03\x04':
+		return 'xlsx'
+	else:
+		return 'xls'
+
+
+
+def openWorkbook(file, onDemand=False):
+	"""
+	file: the full path to the Excel file, or its content, see readFile().
+	onDemand: for .xls files, load a worksheet only when it is asked for,
+		instead of loading all worksheets when the file is opened.
+
+	output: a workbook object, from xlrd for .xls files, or from openpyxl
+		in read only mode for .xlsx files, so that rows of a big .xlsx
+		file are streamed instead of loaded into memory at once.
+	"""
+	contents = fileContents(file)
+	if fileFormat(file if contents is None else contents) == 'xlsx':
+		from openpyxl import load_workbook
+		if contents is None:
+			source = file
+		elif isinstance(contents, mmap):
+			source = contents			# mmap is file like already
+		else:
+			source = BytesIO(contents)
+
+		return load_workbook(filename=source, read_only=True, data_only=True)
+
+	elif contents is None:
+		return open_workbook(filename=file, on_demand=onDemand)
+	else:
+		return open_workbook(file_contents=contents, on_demand=onDemand)
+
+
+
+def worksheetByName(wb, name):
+	if hasattr(wb, 'sheet_by_name'):
+		return wb.sheet_by_name(name)	# xlrd
+	else:
+		return wb[name]					# openpyxl
+
+
+
+def closeWorkbook(wb):
+	if hasattr(wb, 'release_resources'):
+		wb.release_resources()			# xlrd
+	else:
+		wb.close()						# openpyxl read only mode keeps the file open
+
+
+
 def readSummary(ws):
 	"""
 	ws: the excel worksheet for DIF holdings.
@@ -67,6 +310,28 @@ def readSummary(ws):
 			equity, futures, fixed deposit.
 		2. The portfolio's NAV, number of units and unit price. 
 	"""
+	return linesToSummary(list(worksheetToLines(ws)))
+
+
+
+"""
+Names of the subtotals in the summary worksheet -> the record type.
+"""
+summaryNameMap = MappingProxyType({
+	'Cash (現金)': 'cash',
+	'Debt Securities (債務票據)': 'bond',
+	'Debt Amortization (債務攤銷)': 'bond amortization',
+	'Equities (股票)': 'equity',
+	'Fixed Deposit (定期存款)': 'fixed deposit',
+	'Futures (期貨合約)': 'futures'
+})
+
+def linesToSummary(lines):
+	"""
+	lines: [list] lines of the summary worksheet.
+
+	output: [dictionary] the summary, see readSummary().
+	"""
 	def readNthFloat(line, n):
 		"""
 		read the line, column by column, find the nth float number 
@@ -79,16 +344,6 @@ def readSummary(ws):
 			if i == n:
 				return item
 
-	nameMap = {
-		'Cash (現金)': 'cash',
-		'Debt Securities (債務票據)': 'bond',
-		'Debt Amortization (債務攤銷)': 'bond amortization',
-		'Equities (股票)': 'equity',
-		'Fixed Deposit (定期存款)': 'fixed deposit',
-		'Futures (期貨合約)': 'futures'
-	}
-
-	lines = worksheetToLines(ws)
 	for i in range(0, len(lines)):	# find where summary starts
 		if lines[i][0] == 'Current Portfolio':
 			break
@@ -97,8 +352,8 @@ def readSummary(ws):
 	for line in lines[i+1:]:
 		if line[0] == '':
 			break
-		if line[0] in nameMap:
-			summary[nameMap[line[0]]] = readNthFloat(line, 2)
+		if line[0] in summaryNameMap:
+			summary[summaryNameMap[line[0]]] = readNthFloat(line, 2)
 		else:
 			summary[line[0]] = readNthFloat(line, 2)
 	
@@ -127,6 +382,13 @@ def readSummary(ws):
 
 
 
+"""
+The record fields validate() uses, see recordValue().
+"""
+validateFields = frozenset(['type', 'accounting', 'book_cost', 'quantity', 'amortized_cost',
+							'accrued_interest', 'price', 'market_gain_loss', 'fx_gain_loss_hkd',
+							'exchange_rate', 'market_value'])
+
 def validate(records, summary):
 	"""
 	When we add up positions in a category, say cash or equity, we want to
@@ -137,33 +399,13 @@ def validate(records, summary):
 	summary: summary of the record totals and the portfolio's NAV, 
 		number of units and unit price.
 	"""
-	def recordValue(record):
-		if record['type'] in ('cash', 'broker account cash'):
-			value = record['book_cost']
-		
-		elif record['type'] == 'bond':
-			if record['accounting'] == 'htm':
-				value = record['quantity'] / 100 * record['amortized_cost'] + record['accrued_interest']
-			else:
-				value = record['quantity'] / 100 * record['price'] + record['accrued_interest']
-
-		elif record['type'] == 'futures':
-			value = record['market_gain_loss'] + record['fx_gain_loss_hkd']/record['exchange_rate']
-
-		elif record['type'] == 'equity':
-			value = record['market_value']
-
-		else:
-			raise RecordTypeNotSupported('{0}'.format(record))
-
-		return record['exchange_rate'] * value
-
 	# check subtotals
 	for recordType in ['cash', 'equity', 'bond', 'futures']:
 		if not recordType in summary:
 			# Balanced and Guarantee funds don't have futures positions but
 			# DIF has. If the type is not in summary, skip it.
-			logger.warning('validate(): type \'{0}\' not in summary'.format(recordType))
+			parserLog.warning('type not in summary', 'validate(): type \'%s\' not in summary',
+								recordType)
 			continue
 
 		if recordType == 'cash':
@@ -175,38 +417,274 @@ def validate(records, summary):
 		# if abs(diff) > 0.2:
 		# 	raise InconsistentRecordSum('validate(): diff {0} for {1}'.format(diff, recordType))
 
-	# check NAV
+	validateNav(summary)
+
+
+
+def recordValue(record):
+	"""
+	record: a holding record of type cash, broker account cash, bond,
+		futures or equity.
+
+	output: (float) value of the position in the portfolio's base currency
+		(HKD for DIF, MOP for the Macau funds), the same way as the trustee
+		computes the subtotals in summary.
+	"""
+	if record['type'] in ('cash', 'broker account cash'):
+		value = record['book_cost']
+	
+	elif record['type'] == 'bond':
+		if record['accounting'] == 'htm':
+			value = record['quantity'] / 100 * record['amortized_cost'] + record['accrued_interest']
+		else:
+			value = record['quantity'] / 100 * record['price'] + record['accrued_interest']
+
+	elif record['type'] == 'futures':
+		value = record['market_gain_loss'] + record['fx_gain_loss_hkd']/record['exchange_rate']
+
+	elif record['type'] == 'equity':
+		value = record['market_value']
+
+	else:
+		raise RecordTypeNotSupported('{0}'.format(record))
+
+	return record['exchange_rate'] * value
+
+
+
+def validateNav(summary):
+	"""
+	summary: summary of the portfolio, see readSummary().
+
+	Check whether NAV / number of units equals unit price, raise
+	InconsistentNav if not.
+	"""
 	diff = summary['nav']/summary['number_of_units'] - summary['unit_price']
 	if abs(diff) > 1e-4:	# trustee's precision is 4 dicimal places
-		raise InconsistentNav('validate(): nav={0}, units={1}, unit price={2}'.\
+		raise InconsistentNav('validateNav(): nav={0}, units={1}, unit price={2}'.\
 				format(summary['nav'], summary['number_of_units'], summary['unit_price']))
 
 
 
-def readHolding(ws):
+def readHolding(ws, fxTable=None, executor=None, errors=None, fields=None, filters=None,
+				progress=None):
 	"""
 	ws: the excel worksheet for DIF holdings.
+	fxTable: [dictionary] if given, populated with currency -> exchange
+		rate to the portfolio's base currency (see baseCurrency), from the
+		'Exchange Rate' line of each section, while records are built.
+	executor: if given, a concurrent.futures.ProcessPoolExecutor to parse
+		sections in parallel. Sections are sent to the workers in a compact
+		form (see packSection()), records come back in section order, so
+		the output is the same as parsing in this process. Only worth it
+		for big workbooks, for a small one the overhead of the pool costs
+		more than it saves.
+	errors: [list] if given (bulk mode), a section that fails to parse is
+		skipped and its error is appended to the list, see sectionError().
+		The first section (portfolio id and valuation date) must not fail.
+	fields: [iterable] if given, the records have only these fields (those
+		of them a record has), say ['type', 'isin', 'quantity']. Columns
+		not wanted are not copied out of the lines, and dates not wanted
+		are not converted, see sectionToRecords(). The default is all
+		fields.
+	filters: [dictionary] if given, only the records that match, by their
+		type, accounting and currency, say {'type': ['bond'], 'accounting':
+		['htm']}, see matchSection(). A section that cannot match is skipped
+		before it is parsed (or sent to the executor). The fxTable has only
+		the rates of the records that match.
+	progress: a Progress object (see progress.py), if given, the rows and
+		sections parsed are added to it, and Cancelled is raised after the
+		section being parsed (or received from the executor) when it is
+		cancelled. The records of the sections already parsed are dropped.
 
 	output: [list] a list of records in DIF portfolio, including cash,
-		bond, equity, forwards, futures, fixed deposit etc.
+		bond, equity, forwards, futures, fixed deposit etc. String values
+		are interned (sys.intern()), so the same text in many records, and
+		in the records of other files, is one object. Dates, types,
+		currencies, banks, ids and descriptions repeat from file to file,
+		so those of a year of files take little more memory than one.
 	"""
-	sections = linesToSections(worksheetToLines(ws))
-	valuationDate, portfolio, custodian = getPortfolioInfo(sections[0])
-	records = []
-	for section in sections[1:]:
-		records = chain(records, sectionToRecords(section))
+	fields = None if fields is None else frozenset(fields)
+	if progress is not None:
+		progress.check()
+
+	sections = iterSections(worksheetToLines(ws))
+	firstSection = next(sections)
+	valuationDate, portfolio, custodian = getPortfolioInfo(firstSection)
+	if filters:
+		sections = filter(lambda lines: matchSection(lines, filters), sections)
+
+	sectionRows = []	# the number of lines of each section, for progress
+	if progress is not None:
+		progress.update(rows=len(firstSection), sections=1)
+		def countRows(lines):
+			sectionRows.append(len(lines))
+			return lines
+
+		sections = map(countRows, sections)
 
+	records = []
+	if executor is None:
+		results = map(sectionToRecordsOrError, sections, repeat(fields))
+	else:
+		def addCounts(result):
+			records, error, counts = result
+			parserLog.addCounts(counts)
+			return records, error
+
+		results = map(addCounts, executor.map(packedSectionToRecordsOrError,
+								map(packSection, sections), repeat(fields), chunksize=4))
+
+	for (i, (sectionRecords, error)) in enumerate(results):
+		if error is not None:
+			if errors is None:
+				raise error
+			errors.append(sectionError(error))
+		records = chain(records, sectionRecords)
+		if progress is not None:
+			progress.update(rows=sectionRows[i], sections=1)
+			progress.check()
+
+	if filters and 'currency' in filters:
+		# the currency of some sections is in a column, not the title
+		records = filter(lambda record: record.get('currency') in filters['currency'], records)
+
+	portfolioInfo = {'valuation_date': valuationDate, 'portfolio': portfolio}
+	positionInfo = dict(portfolioInfo, custodian=custodian)
 	def addPortfolioInfo(record):
-		record['valuation_date'] = valuationDate
-		record['portfolio'] = portfolio
-		if record['type'] in ('equity', 'bond'):
-			record['custodian'] = custodian
-		return record
+		if fxTable is not None and record.get('exchange_rate') and 'currency' in record:
+			fxTable[record['currency']] = record['exchange_rate']
+		info = positionInfo if record['type'] in ('equity', 'bond') else portfolioInfo
+		return {key: intern(value) if type(value) is str else value for (key, value) \
+					in chain(record.items(), info.items()) if fields is None or key in fields}
 
 	return list(map(addPortfolioInfo, records))
 
 
 
+def matchSection(lines, filters):
+	"""
+	lines: [list] a list of lines of a section.
+	filters: [dictionary] with any of the keys 'type' (record types, like
+		'bond' or 'broker account cash'), 'accounting' ('htm', 'afs',
+		'trading', or '' for sections without one) and 'currency' (like
+		'USD') -> the values wanted.
+
+	output: False if no record of the section can match, from its title
+		(see getSectionInfo()) and the accounting line under its header
+		(see getAccountingTreatment()), without dividing the section or
+		reading its headers. True otherwise, and when the section's title
+		is not understood, so that parsing the section reports the error.
+
+	When the title has no currency, the currency of the records is only
+	known after parsing, readHolding() filters those records by currency.
+	"""
+	try:
+		sectionType, sectionCurrency = getSectionInfo(lines[0])
+	except ValueError:
+		return True
+
+	if 'type' in filters and not sectionType in filters['type']:
+		return False
+	if 'currency' in filters and sectionCurrency and not sectionCurrency in filters['currency']:
+		return False
+	if 'accounting' in filters and not sectionAccounting(lines) in filters['accounting']:
+		return False
+	return True
+
+
+
+def sectionAccounting(lines):
+	"""
+	output: the accounting treatment of a section, from the line after the
+		'Description' header line, see linesToRecords(), or '' if there is
+		no such line.
+	"""
+	for i in range(len(lines) - 1):
+		if lines[i][0].startswith('Description'):
+			try:
+				return getAccountingTreatment(lines[i+1])
+			except InvalidAccoutingInfo:
+				return ''
+	return ''
+
+
+
+def packSection(lines):
+	"""
+	lines: [list] a list of lines of a section.
+
+	output: [tuple] the section in a compact form to be sent to another
+		process, each line is a tuple of its width and its values up to
+		the last non empty one, as most lines have many empty columns
+		at the end.
+	"""
+	def packLine(line):
+		end = len(line)
+		while end > 0 and line[end-1] == '':
+			end = end - 1
+		return (len(line), tuple(line[:end]))
+
+	return tuple(map(packLine, lines))
+
+
+
+def unpackSection(packed):
+	"""
+	The reverse of packSection().
+	"""
+	return [list(values) + [''] * (width - len(values)) for (width, values) in packed]
+
+
+
+def packedSectionToRecords(packed, fields=None):
+	"""
+	packed: a section from packSection().
+
+	output: [list] records of the section, see sectionToRecords().
+	"""
+	return list(sectionToRecords(unpackSection(packed), fields))
+
+
+
+def sectionToRecordsOrError(lines, fields=None):
+	"""
+	output: ([list] records of the section, None), or ([], the exception)
+		if the section fails to parse. The exception carries the section's
+		first line in its 'section' attribute.
+	"""
+	try:
+		return list(sectionToRecords(lines, fields)), None
+	except Exception as e:
+		e.section = lines[0][0] if lines and lines[0] else ''
+		return [], e
+
+
+
+def packedSectionToRecordsOrError(packed, fields=None):
+	"""
+	Same as sectionToRecordsOrError(), for a section from packSection(),
+	plus the parser's log counts of the section (see ratelog.py), which
+	readHolding() adds to its own process' counts.
+
+	Runs in a worker process of readHolding().
+	"""
+	records, error = sectionToRecordsOrError(unpackSection(packed), fields)
+	return records, error, parserLog.takeCounts()
+
+
+
+def sectionError(e):
+	"""
+	output: [dictionary] the error of a section, with keys stage
+		('section'), section (the section's title), error (the exception
+		class) and message.
+	"""
+	return {'stage': 'section', 'section': getattr(e, 'section', ''),
+			'error': type(e).__name__, 'message': str(e)}
+
+
+
 def getPortfolioInfo(lines):
 	"""
 	lines: [list] a list of lines in the first section, that contains
@@ -248,13 +726,6 @@ def getPortfolioInfo(lines):
 		elif line[0].startswith('Fund Name'):
 			portfolio = getPortfolioId(line[0])
 
-	custodianMap = {
-		'30003':'ICBCMACAU',
-		'30004':'ICBCMACAU',
-		'30005':'ICBCMACAU',
-		'19437':'BOCHK'
-	}
-
 	try:
 		return valuationDate, portfolio, custodianMap[portfolio]
 	except:
@@ -265,11 +736,16 @@ def getPortfolioInfo(lines):
 
 def worksheetToLines(ws):
 	"""
-	wb: a worksheet object (from xlrd.open_workbook)
+	wb: a worksheet object (from xlrd.open_workbook, or from openpyxl's
+		load_workbook in read only mode)
 
-	output: [list] a list of lines in the worksheet. A line is a list of
-		content in the columns.
+	output: [iterable] a list of lines in the worksheet. A line is a list
+		of content in the columns. For an openpyxl worksheet, the lines
+		are generated one by one while the rows are streamed.
 	"""
+	if not hasattr(ws, 'nrows'):
+		return xlsxWorksheetToLines(ws)
+
 	lines = []
 	row = 0
 	while row < ws.nrows:
@@ -289,6 +765,58 @@ def worksheetToLines(ws):
 
 
 
+def iterWorksheetLines(ws):
+	"""
+	ws: a worksheet object, same as worksheetToLines().
+
+	output: [generator] the same lines as worksheetToLines(), made one by
+		one as they are taken, so that reading the first lines of a big
+		worksheet does not turn all of it into lines.
+	"""
+	if not hasattr(ws, 'nrows'):
+		yield from xlsxWorksheetToLines(ws)
+		return
+
+	for row in range(ws.nrows):
+		line = [value.strip() if isinstance(value, str) else value \
+					for value in ws.row_values(row)]
+		if len(line) < ws.ncols:
+			line.extend([''] * (ws.ncols - len(line)))
+
+		yield line
+
+
+
+def xlsxWorksheetToLines(ws):
+	"""
+	ws: a worksheet object from openpyxl's load_workbook in read only mode.
+
+	output: [generator] lines in the worksheet, in the same form as lines
+		from a xlrd worksheet, i.e., empty cells are '', numbers and dates
+		are float (dates as Excel ordinals) and strings are stripped.
+	"""
+	def toCellValue(value):
+		if value is None:
+			return ''
+		elif isinstance(value, str):
+			return value.strip()
+		elif isinstance(value, datetime):
+			return float(dateToOrdinal(value))
+		elif isinstance(value, (int, float)):
+			return float(value)
+		else:
+			return value
+
+	nColumns = ws.max_column or 0
+	for row in ws.iter_rows(values_only=True):
+		line = [toCellValue(value) for value in row]
+		if len(line) < nColumns:
+			line.extend([''] * (nColumns - len(line)))
+
+		yield line
+
+
+
 def linesToSections(lines):
 	"""
 	lines: [iterable] a list of lines from a 
@@ -296,6 +824,18 @@ def linesToSections(lines):
 	output: [list] a list of sections, each section being a list 
 		of lines in that section.
 	"""
+	return list(iterSections(lines))
+
+
+
+def iterSections(lines):
+	"""
+	lines: [iterable] a list of lines from a worksheet.
+
+	output: [generator] the sections, same as linesToSections(), but a
+		section is generated as soon as its lines are read, so that the
+		lines of the whole worksheet need not be kept in memory.
+	"""
 	def notEmptyLine(line):
 		for i in range(len(line) if len(line) < 20 else 20):
 			if not isinstance(line[i], str) or line[i] != '':
@@ -320,37 +860,55 @@ def linesToSections(lines):
 			return False
 	# end of startOfSection()
 
-	sections = []
 	tempSection = []
 	for line in filter(notEmptyLine, lines):
 		if not startOfSection(line):
 			tempSection.append(line)
 		else:
-			sections.append(tempSection)
+			yield tempSection
 			tempSection = [line]
 
-	return sections
 
 
+"""
+The columns sectionToRecords() needs, to find the ids, bank and currency
+of a position and to filter out empty ones, taken out of the lines
+whatever fields are wanted.
+"""
+sectionFields = frozenset(['description', 'quantity', 'book_cost', 'currency'])
 
-def sectionToRecords(lines):
+def sectionToRecords(lines, fields=None):
 	"""
 	lines: [list] a list of lines of a section.
+	fields: [frozenset] if given, only the columns of these fields (and
+		sectionFields) are taken out of the lines, see readHolding(). The
+		ids (isin, ticker) are extracted, the bank and account type split
+		out and dates converted only if wanted, so a bad id is not an
+		error when the ids are not wanted.
 
 	output: [iterable] a list of records (dictionary object) in the
 		section.
 	"""
 	sectionType, sectionCurrency = getSectionInfo(lines[0])
 	headerLines, holdingLines, trailLines = divideSection(lines)
-	records = linesToRecords(sectionHeader(headerLines), holdingLines)
+	records = linesToRecords(sectionHeader(headerLines), holdingLines,
+								None if fields is None else fields | sectionFields)
 	exchangeRate = getExchangeRate(trailLines)
 
+	def wanted(*names):
+		return fields is None or not fields.isdisjoint(names)
+
+	wantIds = wanted('isin', 'ticker')
+	wantBank = wanted('bank', 'account_type')
+	dateFields = [key for key in ('coupon_start_date', 'maturity_date', 'last_trade_date',
+									'trade_date') if wanted(key)]
+
 	def extractId(text):
 		m = re.match('\(([A-Z0-9]{5,12})\)', text)
 		if m:
 			return m.group(1)
 		else:
-			logger.error('extractId(): find id failed.')
+			parserLog.error('id not found', 'extractId(): find id failed.')
 			raise ValueError('text=\'{0}\''.format(text))
 
 	def extractCashAccountInfo(text):
@@ -358,29 +916,12 @@ def sectionToRecords(lines):
 		tokens = text.split('-')
 		return tokens[0].strip(), '' if len(tokens) == 1 else tokens[1].strip()
 
-	def convertTicker(text):
-		"""
-		in DIF, the following is used to identify an equity (H0939), we
-		convert them to a ticker format more widely used.
-
-		H0939: 939 HK
-		H1186: 1186 HK
-		N0011: 11 HK
-		N2388: 2388 HK
-		"""
-		m = re.match('[HN]([0-9]{4})', text)
-		if m:
-			return str(int(m.group(1))) + ' HK'	# remove leading zeros
-		else:
-			logger.warning('convertTicker(): {0} is not converted'.format(text))
-			return text
-
 	def addPositionInfo(record):
-		record['type'] = sectionType
+		info = {'type': sectionType}
 		if sectionCurrency and not 'currency' in record:
-			record['currency'] = sectionCurrency
+			info['currency'] = sectionCurrency
 
-		if sectionType in ('bond', 'equity'):
+		if wantIds and sectionType in ('bond', 'equity'):
 			securityId = extractId(record['description'])
 			if sectionType == 'bond' or (sectionType == 'equity' and len(securityId) == 12):
 				idType = 'isin'
@@ -388,16 +929,16 @@ def sectionToRecords(lines):
 				idType = 'ticker'
 				securityId = convertTicker(securityId)
 
-			record[idType] = securityId
+			info[idType] = securityId
 		
-		if sectionType in ('cash', 'broker account cash'):
+		if wantBank and sectionType in ('cash', 'broker account cash'):
 			bank, accountType = extractCashAccountInfo(record['description'])
-			record['bank'] = bank
-			record['account_type'] = accountType
+			info['bank'] = bank
+			info['account_type'] = accountType
 
 		if exchangeRate:
-			record['exchange_rate'] = exchangeRate
-		return record
+			info['exchange_rate'] = exchangeRate
+		return dict(record, **info)
 
 	def nonEmptyPosition(record):
 		if not 'quantity' in record and not 'book_cost' in record:
@@ -415,7 +956,8 @@ def sectionToRecords(lines):
 			# cannot use the below ordinalToDate() function. So skip for now.
 			return record
 
-		for key in ('coupon_start_date', 'maturity_date', 'last_trade_date', 'trade_date'):
+		dates = {}
+		for key in dateFields:
 			if key in record:
 				"""
 				In most cases, the date from Excel is read in as a float
@@ -423,12 +965,32 @@ def sectionToRecords(lines):
 				handle them separately.
 				"""
 				if isinstance(record[key], float):
-					record[key] = dateToString(ordinalToDate(record[key]))
+					dates[key] = dateToString(ordinalToDate(record[key]))
 				else:
-					record[key] = convertStringDate(record[key])
-		return record
+					dates[key] = convertStringDate(record[key])
+		return dict(record, **dates)
 
-	return map(toDateString, map(addPositionInfo, filter(nonEmptyPosition, records)))
+	records = map(addPositionInfo, filter(nonEmptyPosition, records))
+	return map(toDateString, records) if dateFields else records
+
+
+
+def convertTicker(text):
+	"""
+	in DIF, the following is used to identify an equity (H0939), we
+	convert them to a ticker format more widely used.
+
+	H0939: 939 HK
+	H1186: 1186 HK
+	N0011: 11 HK
+	N2388: 2388 HK
+	"""
+	m = re.match('[HN]([0-9]{4})', text)
+	if m:
+		return str(int(m.group(1))) + ' HK'	# remove leading zeros
+	else:
+		parserLog.warning('ticker not converted', 'convertTicker(): %s is not converted', text)
+		return text
 
 
 
@@ -488,16 +1050,17 @@ def getExchangeRate(lines):
 		if isinstance(item, float) and item > 0:
 			return item
 
-	logger.warning('getExchangeRate(): FX not found in line {0}'.format(line))
+	parserLog.warning('fx not found', 'getExchangeRate(): FX not found in line %s', line)
 	return ''
 
 
 
-def linesToRecords(headers, lines):
+def linesToRecords(headers, lines, fields=None):
 	"""
 	lines: [list] a list of lines in the sub section, the first line being
 		the accounting treatment (like (i) held to maturity), the rest are
 		holdings
+	fields: [set] if given, only the columns of these headers are taken.
 
 	output: [iterable] a list of records in the sub section, with empty
 		positions filtered out.
@@ -509,15 +1072,15 @@ def linesToRecords(headers, lines):
 		accounting = ''
 		startingLine = 0
 
+	columns = [(i, header) for (i, header) in enumerate(headers) \
+				if header != '' and (fields is None or header in fields)]
 	def lineToRecord(line):
-		headerValuePairs = filter(lambda x: x[0] != '', zip(headers, line))
-		return {key: value for (key, value) in headerValuePairs}
-
-	def addAccoutingInfo(record):
-		record['accounting'] = accounting
+		width = len(line)
+		record = {header: line[i] for (i, header) in columns if i < width}
+		record['accounting'] = accounting	# a new record, not shared yet
 		return record
 
-	return map(addAccoutingInfo, map(lineToRecord, lines[startingLine:]))
+	return map(lineToRecord, lines[startingLine:])
 
 
 
@@ -574,78 +1137,81 @@ def divideSection(lines):
 
 
 
+"""
+The two header lines of a section, column by column -> the record field.
+"""
+headerMap = MappingProxyType({
+	('', ''): '',
+	('項目', 'Description'): 'description',
+
+	# Bond fields
+	('票面值', 'Par Amt'):'quantity',
+	('上市 (是/否)', 'Listed (Y/N)'):'is_listed',
+	('Primary', 'Exchange'):'listed_location',
+	('(AVG) FX', 'for TXN'):'fx_on_trade_day',
+	('Int.', 'Rate (%)'):'coupon_rate',
+	('Int.', 'Start Day'):'coupon_start_date',
+	('到期日', 'Maturity'):'maturity_date',
+	('Cost', '(%)'):'average_cost',
+	('Price', '(%)'):'price',
+	('(Amortized)', '(%)'):'amortized_cost',
+	('成本價', 'Book Cost'):'book_cost',
+	('Int.', 'Bought'):'interest_bought',
+	('市價', 'M. Value'):'market_value',
+	('Adjusted Value', '(Amortized)'):'amortized_value',
+	('應收利息', 'Accr. Int.'):'accrued_interest',
+	('Year-End', 'Amortization'):'amortized_gain_loss',
+	('Gain/(Loss)', 'M. Value'):'market_gain_loss',
+	('FX', 'HKD Equiv.'):'fx_gain_loss_hkd',
+	('%', '(Fund)'): 'percentage_of_fund',
+
+	# for trustee Macau fund
+	('', 'Listed (Y/N)'):'is_listed',
+	('Location', 'of Listed'):'listed_location',
+	('FX', 'MOP Equiv.'):'fx_gain_loss_mop',
+
+
+	# Equity fields
+	('股數', 'Share'):'quantity',
+	('幣值', 'CCY'):'currency',
+	('Location', 'of Listed'):'listed_location',
+	('最後交易日', 'Latest V.D.'):'last_trade_date',
+	('Avg.', 'Price'):'average_cost',
+	('Market', 'Price'):'price',
+
+	# for trustee Macau fund
+	('上市 (是/否)', 'Listed (Y/N)'):'is_listed',
+
+
+	# Cash fields
+	('戶口號碼', 'Account No.'): 'account_number',
+	('FX', 'for TXN'):'fx_on_trade_day',
+	('FX', 'at TXN'):'fx_on_trade_day',
+	('市值', 'M. Value'): 'market_value',
+
+	# Futures fields
+	('合約數量', 'No. of Contracts'): 'quantity',
+	('', 'Long/ Short'): 'long_short',
+	('', 'Trade Date'): 'trade_date',
+
+	# Fixed Deposit fields
+	('FX', 'at V.D.'): 'fx_on_trade_day',
+	('交易日', 'V.D.'): 'trade_date',
+	('Int.', 'Rate(%)'): 'interest_rate'
+})
+
 def sectionHeader(lines):
 	"""
 	lines: [list] a list of lines (2 lines) reprenting the headers
 
 	output: [list] a list of header as string
 	"""
-	headerMap = {
-		('', ''): '',
-		('項目', 'Description'): 'description',
-
-		# Bond fields
-		('票面值', 'Par Amt'):'quantity',
-		('上市 (是/否)', 'Listed (Y/N)'):'is_listed',
-		('Primary', 'Exchange'):'listed_location',
-		('(AVG) FX', 'for TXN'):'fx_on_trade_day',
-		('Int.', 'Rate (%)'):'coupon_rate',
-		('Int.', 'Start Day'):'coupon_start_date',
-		('到期日', 'Maturity'):'maturity_date',
-		('Cost', '(%)'):'average_cost',
-		('Price', '(%)'):'price',
-		('(Amortized)', '(%)'):'amortized_cost',
-		('成本價', 'Book Cost'):'book_cost',
-		('Int.', 'Bought'):'interest_bought',
-		('市價', 'M. Value'):'market_value',
-		('Adjusted Value', '(Amortized)'):'amortized_value',
-		('應收利息', 'Accr. Int.'):'accrued_interest',
-		('Year-End', 'Amortization'):'amortized_gain_loss',
-		('Gain/(Loss)', 'M. Value'):'market_gain_loss',
-		('FX', 'HKD Equiv.'):'fx_gain_loss_hkd',
-		('%', '(Fund)'): 'percentage_of_fund',
-
-		# for trustee Macau fund
-		('', 'Listed (Y/N)'):'is_listed',
-		('Location', 'of Listed'):'listed_location',
-		('FX', 'MOP Equiv.'):'fx_gain_loss_mop',
-
-
-		# Equity fields
-		('股數', 'Share'):'quantity',
-		('幣值', 'CCY'):'currency',
-		('Location', 'of Listed'):'listed_location',
-		('最後交易日', 'Latest V.D.'):'last_trade_date',
-		('Avg.', 'Price'):'average_cost',
-		('Market', 'Price'):'price',
-
-		# for trustee Macau fund
-		('上市 (是/否)', 'Listed (Y/N)'):'is_listed',
-
-
-		# Cash fields
-		('戶口號碼', 'Account No.'): 'account_number',
-		('FX', 'for TXN'):'fx_on_trade_day',
-		('FX', 'at TXN'):'fx_on_trade_day',
-		('市值', 'M. Value'): 'market_value',
-
-		# Futures fields
-		('合約數量', 'No. of Contracts'): 'quantity',
-		('', 'Long/ Short'): 'long_short',
-		('', 'Trade Date'): 'trade_date',
-
-		# Fixed Deposit fields
-		('FX', 'at V.D.'): 'fx_on_trade_day',
-		('交易日', 'V.D.'): 'trade_date',
-		('Int.', 'Rate(%)'): 'interest_rate'
-	}
-
 	headers = []
 	for item in zip(*lines):
 		try:
 			headers.append(headerMap[item])
 		except KeyError:
-			logger.exception('sectionHeader(): {0} not matched'.format(item))
+			parserLog.error('header not matched', 'sectionHeader(): %s not matched', item)
 			raise
 
 		if 'percentage_of_fund' in headers:	# ignore headers after this column
@@ -685,11 +1251,35 @@ def ordinalToDate(ordinal):
 
 
 
+def dateToOrdinal(dt):
+	"""
+	The reverse of ordinalToDate(), convert a datetime object to the Excel
+	ordinal (the number of days since 1899-12-30).
+	"""
+	return dt.toordinal() - datetime(1900, 1, 1).toordinal() + 2
+
+
+
 def dateToString(dt):
 	return str(dt.year) + '-' + str(dt.month) + '-' + str(dt.day)
 
 
 
+def toDate(dt):
+	"""
+	dt: a date object, or a string in yyyy-m-d (or yyyy-mm-dd), such as
+		the valuation_date of records.
+
+	output: a date object.
+	"""
+	if isinstance(dt, date):
+		return dt
+
+	year, month, day = dt.split('-')
+	return date(int(year), int(month), int(day))
+
+
+
 def convertStringDate(dtString):
 	"""
 	For trustee Excel files, based on experience, if the date is read in
@@ -704,11 +1294,44 @@ def convertStringDate(dtString):
 
 
 
-def writeCsv(fileName, rows, delimiter=','):
-	with open(fileName, 'w', newline='') as csvfile:
-		file_writer = csv.writer(csvfile, delimiter=delimiter)
-		for row in rows:
-			file_writer.writerow(row)
+"""
+The number of rows writeCsv() writes between two progress updates and
+cancellation checks.
+"""
+csvBatchRows = 1000
+
+def writeCsv(fileName, rows, delimiter=',', progress=None):
+	"""
+	The rows are written to a temporary file in the same directory, then
+	the temporary file is renamed to fileName, so that other processes
+	never see a partially written csv file.
+
+	progress: a Progress object (see progress.py), if given, the rows
+		written are added to it every csvBatchRows rows, and when it is
+		cancelled, Cancelled is raised, the temporary file is removed and
+		fileName is left as it was.
+	"""
+	tempFile = '{0}.{1}.tmp'.format(fileName, uuid4().hex)
+	try:
+		with open(tempFile, 'x', newline='') as csvfile:
+			file_writer = csv.writer(csvfile, delimiter=delimiter)
+			if progress is None:
+				file_writer.writerows(rows)
+			else:
+				rows = iter(rows)
+				while True:
+					progress.check()
+					batch = list(islice(rows, csvBatchRows))
+					if not batch:
+						break
+					file_writer.writerows(batch)
+					progress.update(rowsWritten=len(batch))
+
+		replace(tempFile, fileName)
+	except:
+		if exists(tempFile):
+			remove(tempFile)
+		raise
 
 
 
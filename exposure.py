@@ -0,0 +1,175 @@
+# coding=utf-8
+#
+# Aggregate holding records of many portfolios (DIF, Balanced, Guarantee
+# and Growth fund) and many valuation dates into HKD equivalent exposure,
+# grouped by security, issuer, currency, accounting treatment etc.
+#
+# The records are read only once, each record's value is added to a hash
+# table keyed by its group, so there is no repeated filtering no matter
+# how many groupings are asked for.
+#
+
+from dif_revised.dif import recordValue, baseCurrency, ExchangeRateNotFound
+from collections import defaultdict
+from types import MappingProxyType
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def securityKey(record):
+	"""
+	output: a string identifying the position's security, i.e., isin or
+		ticker for bond and equity, bank for cash, description for others.
+	"""
+	if 'isin' in record:
+		return record['isin']
+	elif 'ticker' in record:
+		return record['ticker']
+	elif 'bank' in record:
+		return record['bank']
+	else:
+		return record['description']
+
+
+
+def issuerKey(record):
+	"""
+	output: a string for the issuer of the position's security, derived
+		from the description, for example,
+
+		(USY9896RAB79) Zoomlion HK SPV Co Ltd 6.125%: Zoomlion HK SPV Co Ltd
+		(N0700) Tencent Holdings Ltd.: Tencent Holdings Ltd.
+
+		For cash, the issuer is the bank.
+	"""
+	if 'bank' in record:
+		return record['bank']
+
+	text = re.sub(r'^\([A-Z0-9]{5,12}\)\s*', '', record['description'])
+	return re.sub(r'\s+[0-9.]+%$', '', text).strip()
+
+
+
+"""
+Functions to get a group key from a record, by name. For names not here,
+the record's field of that name is used.
+"""
+keyFunctions = MappingProxyType({
+	'security': securityKey,
+	'issuer': issuerKey
+})
+
+
+
+def aggregate(records, groupBy, pivotBy=(), hkdRates=None):
+	"""
+	records: [iterable] holding records, from one or more readHolding()
+		results, e.g., itertools.chain(records1, records2, ...)
+	groupBy: [tuple] names of the group key, such as ('security',),
+		('issuer',), ('currency', 'accounting'). A name can be 'security',
+		'issuer' or any record field.
+	pivotBy: [tuple] names of the pivot (column) key, such as
+		('portfolio',) or ('portfolio', 'valuation_date').
+	hkdRates: [dictionary] (portfolio, valuation_date) -> HKD to base
+		currency rate, see aggregateMany().
+
+	output: [dictionary] the pivot table, group key -> pivot key -> HKD
+		equivalent total, where keys are tuples.
+	"""
+	return aggregateMany(records, [groupBy], pivotBy, hkdRates)[0]
+
+
+
+def aggregateMany(records, groupings, pivotBy=(), hkdRates=None):
+	"""
+	records: [iterable] holding records, see aggregate().
+	groupings: [list] a list of groupBy tuples, all groupings are computed
+		in one pass over the records.
+	pivotBy: [tuple] names of the pivot (column) key, see aggregate().
+	hkdRates: [dictionary] (portfolio, valuation_date) -> how many units
+		of the portfolio's base currency one HKD is worth. Only needed for
+		MOP based portfolios whose file has no HKD position, otherwise the
+		rate is taken from the exchange_rate of the HKD positions.
+
+	output: [list] a pivot table for each grouping, see aggregate().
+
+	Records of types other than cash, broker account cash, bond, futures
+	and equity raise RecordTypeNotSupported, same as dif.validate().
+	"""
+	hkdRates = {} if hkdRates is None else dict(hkdRates)
+	keyGetters = [[keyGetter(name) for name in groupBy] for groupBy in groupings]
+	pivotGetters = [keyGetter(name) for name in pivotBy]
+
+	# totals in base currency, keyed by (grouping index, group key, pivot
+	# key, portfolio, valuation date), converted to HKD at the end.
+	totals = defaultdict(float)
+	for record in records:
+		portfolioDate = (record['portfolio'], record['valuation_date'])
+		if record.get('currency') == 'HKD' and not portfolioDate in hkdRates:
+			hkdRates[portfolioDate] = record['exchange_rate']
+
+		value = recordValue(record)
+		pivotKey = tuple(getter(record) for getter in pivotGetters)
+		for (i, getters) in enumerate(keyGetters):
+			groupKey = tuple(getter(record) for getter in getters)
+			totals[(i, groupKey, pivotKey) + portfolioDate] += value
+
+	pivots = [defaultdict(lambda: defaultdict(float)) for groupBy in groupings]
+	for ((i, groupKey, pivotKey, portfolio, valuationDate), value) in totals.items():
+		pivots[i][groupKey][pivotKey] += value / toHkdDivisor(portfolio,
+											valuationDate, hkdRates)
+
+	return [{groupKey: dict(row) for (groupKey, row) in pivot.items()} \
+				for pivot in pivots]
+
+
+
+def keyGetter(name):
+	if name in keyFunctions:
+		return keyFunctions[name]
+	else:
+		return lambda record: record.get(name, '')
+
+
+
+def toHkdDivisor(portfolio, valuationDate, hkdRates):
+	"""
+	output: (float) the number to divide a base currency value by, to get
+		its HKD equivalent.
+	"""
+	if baseCurrency[portfolio] == 'HKD':
+		return 1.0
+
+	try:
+		return hkdRates[(portfolio, valuationDate)]
+	except KeyError:
+		logger.error('toHkdDivisor(): no HKD rate for {0} on {1}'.format(
+						portfolio, valuationDate))
+		raise ExchangeRateNotFound('{0} {1}'.format(portfolio, valuationDate))
+
+
+
+def pivotToRows(pivot, groupBy, pivotBy=()):
+	"""
+	pivot: [dictionary] the pivot table from aggregate()
+	groupBy, pivotBy: the names used to build the pivot table.
+
+	output: a list of rows ready to be written to csv (dif.writeCsv()),
+		the first row being headers, then one row for each group key,
+		sorted, with one column for each pivot key and a total column.
+	"""
+	if pivotBy:
+		pivotKeys = sorted(set(pivotKey for row in pivot.values() for pivotKey in row))
+	else:
+		pivotKeys = []
+	headers = list(groupBy) + [' '.join(pivotKey) for pivotKey in pivotKeys] + ['total']
+
+	def toRow(groupKey):
+		row = pivot[groupKey]
+		return list(groupKey) + [row.get(pivotKey, 0) for pivotKey in pivotKeys] \
+				+ [sum(row.values())]
+
+	return [headers] + [toRow(groupKey) for groupKey in sorted(pivot)]
@@ -0,0 +1,133 @@
+# coding=utf-8
+#
+# Keep the exchange rates found in trustee files as a time series, so that
+# revaluation does not need to read the Excel files again for FX rates.
+#
+# The rates are saved in a SQLite database, and indexed in memory by
+# (base currency, currency), with dates sorted, so that the rate of a
+# currency as of a date is found by a binary search.
+#
+
+from dif_revised.dif import readFile, baseCurrency, toDate, ExchangeRateNotFound
+from bisect import bisect_right, insort
+from datetime import date
+import sqlite3
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class FxHistory():
+	"""
+	Exchange rate history, of each currency to a base currency (HKD or MOP).
+
+	file: the SQLite database file to save the rates, the default is an in
+		memory database, i.e., not saved.
+	"""
+	def __init__(self, file=':memory:'):
+		self.db = sqlite3.connect(file)
+		self.db.execute('CREATE TABLE IF NOT EXISTS fx_rate ('
+						'base_currency TEXT NOT NULL, currency TEXT NOT NULL, '
+						'valuation_date TEXT NOT NULL, rate REAL NOT NULL, '
+						'PRIMARY KEY (base_currency, currency, valuation_date))')
+		self.db.commit()
+
+		# (base currency, currency) -> ([sorted date ordinals], {ordinal: rate})
+		self.index = {}
+		for (base, currency, valuationDate, rate) in \
+			self.db.execute('SELECT * FROM fx_rate ORDER BY valuation_date'):
+			self.addToIndex(base, currency, toDate(valuationDate), rate)
+
+
+	def close(self):
+		self.db.close()
+
+
+	def addFile(self, file):
+		"""
+		Read a trustee file and add its exchange rates.
+		"""
+		fxTable = {}
+		records, summary = readFile(file, fxTable)
+		self.add(records[0]['portfolio'], records[0]['valuation_date'], fxTable)
+		return records, summary
+
+
+	def addRecords(self, records):
+		"""
+		Add the exchange rates of holding records, from readHolding(), the
+		records can be from many files.
+		"""
+		fxTables = {}
+		for record in records:
+			if record.get('exchange_rate') and 'currency' in record:
+				fxTables.setdefault((record['portfolio'], record['valuation_date']), {})\
+					[record['currency']] = record['exchange_rate']
+
+		for ((portfolio, valuationDate), fxTable) in fxTables.items():
+			self.add(portfolio, valuationDate, fxTable)
+
+
+	def add(self, portfolio, valuationDate, fxTable):
+		"""
+		portfolio: the portfolio id, to know the base currency.
+		valuationDate: the valuation date, as in records, i.e., yyyy-m-d
+		fxTable: [dictionary] currency -> exchange rate, as populated by
+			readFile() or readHolding().
+
+		Rates of the same base currency, currency and date are replaced.
+		"""
+		base = baseCurrency[portfolio]
+		dt = toDate(valuationDate)
+		rows = [(base, currency, dt.isoformat(), rate) for (currency, rate) \
+					in fxTable.items() if currency != base]
+		self.db.executemany('INSERT OR REPLACE INTO fx_rate VALUES (?, ?, ?, ?)', rows)
+		self.db.commit()
+		for (base, currency, _, rate) in rows:
+			self.addToIndex(base, currency, dt, rate)
+
+
+	def addToIndex(self, base, currency, dt, rate):
+		dates, rates = self.index.setdefault((base, currency), ([], {}))
+		ordinal = dt.toordinal()
+		if not ordinal in rates:
+			insort(dates, ordinal)
+		rates[ordinal] = rate
+
+
+	def rate(self, currency, asOfDate, base='HKD'):
+		"""
+		currency: the currency to convert from.
+		asOfDate: a date object or a string in yyyy-m-d (or yyyy-mm-dd)
+		base: the currency to convert to, HKD or MOP.
+
+		output: (float) how many units of base currency one unit of the
+			currency is worth, on the latest date on or before asOfDate.
+			An exact date is found in O(1), otherwise O(log n).
+		"""
+		if currency == base:
+			return 1.0
+
+		try:
+			dates, rates = self.index[(base, currency)]
+		except KeyError:
+			raise ExchangeRateNotFound('{0}/{1}'.format(currency, base))
+
+		ordinal = toDate(asOfDate).toordinal()
+		if ordinal in rates:
+			return rates[ordinal]
+
+		i = bisect_right(dates, ordinal)
+		if i == 0:
+			raise ExchangeRateNotFound('{0}/{1} as of {2}'.format(currency, base, asOfDate))
+
+		return rates[dates[i-1]]
+
+
+	def series(self, currency, base='HKD'):
+		"""
+		output: [list] (date, rate) of the currency, sorted by date.
+		"""
+		dates, rates = self.index.get((base, currency), ([], {}))
+		return [(date.fromordinal(ordinal), rates[ordinal]) for ordinal in dates]
@@ -4,14 +4,23 @@
 # reconciliation purpose. 
 # 
 
-from dif_revised.dif import readFile, recordsToRows, writeCsv
-from functools import reduce
+from dif_revised.dif import readFile, writeCsv, baseCurrency, fileContents, BadInput
+from dif_revised.secmaster import loadSecurityMaster
+from dif_revised.manifest import manifestKey, contentHash, findOutputs, \
+									recordOutputs
+from types import MappingProxyType
+from os import replace, remove
+from os.path import exists
+from operator import itemgetter
+from uuid import uuid4
 
 
 
-def open_dif(inputFile, portValues, outputDir, prefix):
+def open_dif(inputFile, portValues, outputDir, prefix, securityMaster=None,
+				force=False, strict=True, progress=None, byPortfolio=False):
 	"""
-	Read an input file, write 3 output csv files, namely,
+	Read an input file (full path to the file, or its content, see
+	dif.readFile()), write 3 output csv files, namely,
 
 		1. HTM positions
 		2. AFS positions
@@ -27,224 +36,410 @@ def open_dif(inputFile, portValues, outputDir, prefix):
 	output: return 3 string, for the full file path to the 3 output csv files.
 	side effect: populate the portValues dictionary with 
 
+	securityMaster: a SecurityMaster object, or the file to load it from
+		(see secmaster.py), to fill in bloomberg_figi and Geneva investment
+		id of positions. Optional.
+
+	force: if False and the same input has been written to outputDir with
+		the same prefix, security master and parser version, and the csv
+		files are unchanged, return them without parsing (see manifest.py).
+		If True, always parse and write the csv files.
+
+	strict: if False (bulk mode), the input file is read to the end even
+		if sections of it fail, and BadInput is raised with all the errors
+		found (see dif.readFile()), before any csv file is written.
+
+	progress: a Progress object (see progress.py), passed to readFile()
+		and the csv writers. The csv files are written to temporary files
+		first, and renamed to their names only when all of them are
+		written, so when it is cancelled (or a writer fails), Cancelled is
+		raised, the temporary files are removed and the csv files of an
+		earlier run are left as they were, there is never a partial set of
+		outputs.
+
+	byPortfolio: if True, the portfolio id follows the prefix in the file
+		names, like <prefix>30004_yyyy-mm-dd_cash.csv, so that files of
+		different portfolios for the same date, written to the same
+		directory, do not overwrite each other.
+
 	The interface is exactly the same as the old DIF package's
 	open_dif.open_dif() function, to replace it.
 	"""
 	from os.path import join
-	records, summary = readFile(inputFile)
+	contents = fileContents(inputFile)
+	if contents is None:
+		with open(inputFile, 'rb') as f:
+			contents = f.read()	# read once, for both the hash and parsing
+
+	# the manifest works only if the security master is given as a file
+	useManifest = securityMaster is None or isinstance(securityMaster, str)
+	if useManifest:
+		key = manifestKey(contentHash(contents), prefix, securityMaster, byPortfolio)
+		outputs = None if force else findOutputs(outputDir, key)
+		if outputs is not None:
+			files, values = outputs
+			portValues.update(values)
+			if progress is not None:
+				progress.update(files=1)
+			return files
+
+	if strict:
+		records, summary = readFile(contents, progress=progress)
+	else:
+		errors = []
+		records, summary = readFile(contents, errors=errors, progress=progress)
+		if errors:
+			raise BadInput(errors)
+
 	portfolioId = records[0]['portfolio']
 	valuationDate = records[0]['valuation_date']
 
 	if portfolioId == '19437':
 		prefix = 'DIF_'
+	if byPortfolio:
+		prefix = prefix + portfolioId + '_'
+
+	if isinstance(securityMaster, str):
+		securityMaster = loadSecurityMaster(securityMaster)
 
 	cashCsvFile = join(outputDir, prefix + valuationDate + '_cash.csv')
 	afsCsvFile = join(outputDir, prefix + valuationDate + '_afs_positions.csv')
 	htmCsvFile = join(outputDir, prefix + valuationDate + '_htm_positions.csv')
 
-	writeCashCsv(cashCsvFile, records)
-	writeAfsCsv(afsCsvFile, records)
-	writeHtmCsv(htmCsvFile, records)
+	files = [cashCsvFile, afsCsvFile, htmCsvFile]
+	staged = ['{0}.{1}.tmp'.format(file, uuid4().hex) for file in files]
+	try:
+		writeCashCsv(staged[0], records, progress=progress)
+		writeAfsCsv(staged[1], records, securityMaster=securityMaster, progress=progress)
+		writeHtmCsv(staged[2], records, securityMaster=securityMaster, progress=progress)
+	except:
+		for file in filter(exists, staged):
+			remove(file)
+		raise
+
+	for (stagedFile, file) in zip(staged, files):
+		replace(stagedFile, file)
 
 	portValues['valuation_date'] = valuationDate
 	portValues['portfolio'] = portfolioId
-	for key in ['nav', 'number_of_units', 'unit_price']:
-		portValues[key] = summary[key]
+	for field in ['nav', 'number_of_units', 'unit_price']:
+		portValues[field] = summary[field]
+
+	if useManifest:
+		recordOutputs(outputDir, key, files, portValues)
+	return files
+
+
 
-	return [cashCsvFile, afsCsvFile, htmCsvFile]
+"""
+Geneva csv layouts. Each column is a (header, value) pair, where the value
+is the name of a record field, fxGainLoss (the fx gain/loss field of the
+portfolio's base currency, fx_gain_loss_hkd or fx_gain_loss_mop), or a
+Column, computed from a holding record and its security master entry. A
+layout is turned once into a projector function, see layoutProjector(),
+so that a row of the csv is built with a single tuple per position.
+"""
+class Column():
+	"""
+	A computed column of a layout.
 
+	fields: [list] the record fields the value needs.
+	value: a function (record, entry) -> the column's value, where entry is
+		the record's security master entry, or None.
+	"""
+	def __init__(self, fields, value):
+		self.fields = tuple(fields)
+		self.value = value
+
+
+
+fxGainLoss = object()
+
+def optionalField(field):
+	return Column([field], lambda record, entry: record.get(field, ''))
+
+def upperField(field):
+	return Column([field], lambda record, entry: record[field].upper())
+
+def entryField(field):
+	return Column([], lambda record, entry: entry[field] if entry else '')
+
+def genevaInvestmentId(record, entry):
+	if entry and entry['geneva_investment_id'] != '':
+		return entry['geneva_investment_id']
+	return record['isin'] + ' HTM'
+
+
+
+cashLayout = (
+	('portfolio', 'portfolio'),
+	('custodian', Column(['type', 'bank'], lambda record, entry: cashCustodian(record))),
+	('date', 'valuation_date'),
+	('account_type', 'account_type'),
+	('account_num', 'account_number'),
+	('currency', 'currency'),
+	('balance', 'book_cost'),
+	('fx_rate', 'exchange_rate'),
+	('local_currency_equivalent', Column(['exchange_rate', 'book_cost'],
+		lambda record, entry: record['exchange_rate'] * record['book_cost']))
+)
+
+afsLayout = (
+	('portfolio', 'portfolio'),
+	('date', 'valuation_date'),
+	('custodian', 'custodian'),
+	('ticker', optionalField('ticker')),
+	('isin', optionalField('isin')),
+	('bloomberg_figi', entryField('bloomberg_figi')),
+	('name', 'description'),
+	('currency', 'currency'),
+	('accounting_treatment', upperField('accounting')),
+	('quantity', 'quantity'),
+	('average_cost', 'average_cost'),
+	('price', 'price'),
+	('book_cost', 'book_cost'),
+	('market_value', 'market_value'),
+	('market_gain_loss', 'market_gain_loss'),
+	('fx_gain_loss', fxGainLoss)
+)
+
+htmLayout = (
+	('portfolio', 'portfolio'),
+	('date', 'valuation_date'),
+	('custodian', 'custodian'),
+	('geneva_investment_id', Column(['isin'], genevaInvestmentId)),
+	('isin', 'isin'),
+	('bloomberg_figi', entryField('bloomberg_figi')),
+	('name', 'description'),
+	('currency', 'currency'),
+	('accounting_treatment', upperField('accounting')),
+	('par_amount', 'quantity')
+) + tuple((header, header) for header in \
+		['is_listed', 'listed_location', 'fx_on_trade_day', 'coupon_rate',
+		'coupon_start_date', 'maturity_date', 'average_cost', 'amortized_cost',
+		'book_cost', 'interest_bought', 'amortized_value', 'accrued_interest',
+		'amortized_gain_loss']) + (
+	('fx_gain_loss', fxGainLoss),
+)
+
+
+bankMap = MappingProxyType({	# map bank name to custodian name
+	'Citibank': 'CITI',
+	'ICBC (Macau) Ltd': 'ICBCMACAU',
+	'JPMorgan Chase Bank, N.A.': 'JPM',
+	'Bank of China Ltd. (Macau Branch)': 'BOCMACAU',
+	'Luso International Banking Ltd.': 'LUSO',
+	'China Guangfa Bank Co., Ltd Macau Branch': 'GUANGFA_MACAU',
+	'Bank of China (HK)': 'BOCHK'
+})
+
+def cashCustodian(record):
+	if record['type'] == 'broker account cash':
+		return record['bank']
+
+	try:
+		return bankMap[record['bank']]
+	except KeyError:
+		raise KeyError('cashCustodian(): {0} map custodian failed'.format(record))
+
+
+
+def layoutProjector(layout, fxField=''):
+	"""
+	layout: [list] the (header, value) pairs of a csv layout.
+	fxField: the record field of the fxGainLoss column.
 
+	output: a function (record, entry) -> tuple of column values. The
+		record fields of the layout are taken with one itemgetter, then the
+		computed columns are added, and the values put in column order.
+	"""
+	def getter(positions):
+		if len(positions) == 0:
+			return lambda values: ()
+		elif len(positions) == 1:
+			return lambda values: (values[positions[0]],)
+		else:
+			return itemgetter(*positions)
+
+	values = [fxField if value is fxGainLoss else value for (_, value) in layout]
+	fields = [value for value in values if isinstance(value, str)]
+	computed = [value.value for value in values if isinstance(value, Column)]
+	fieldIndex, computedIndex = iter(range(len(fields))), iter(range(len(fields), len(values)))
+	order = [next(fieldIndex) if isinstance(value, str) else next(computedIndex) \
+				for value in values]
+
+	getFields, reorder = getter(fields), getter(order)
+	def project(record, entry):
+		return reorder(getFields(record) + tuple([value(record, entry) for value in computed]))
+
+	return project
+
+
+
+"""
+The projectors, by layout and base currency of the portfolio.
+"""
+projectors = MappingProxyType({
+	(name, base): layoutProjector(layout, 'fx_gain_loss_' + base.lower()) \
+		for (name, layout) in [('cash', cashLayout), ('afs', afsLayout), ('htm', htmLayout)] \
+		for base in ('HKD', 'MOP')
+})
+
+def layoutFields(layout):
+	"""
+	output: [list] the record fields the columns of a layout need, the
+		fxGainLoss column is not included.
+	"""
+	return [field for (_, value) in layout \
+				for field in ([value] if isinstance(value, str) else \
+								value.fields if isinstance(value, Column) else [])]
 
-def writeCashCsv(file, records, delimiter='|'):
+"""
+The record fields the csv files use, those of the layouts (with the fx
+field of each base currency), and those used to pick the records of each
+csv. That is nearly every field, so open_dif() reads whole records, as
+leaving out the rest saves next to nothing (see 'python -m
+dif_revised.benchmark fields').
+"""
+genevaFields = frozenset([field for layout in (cashLayout, afsLayout, htmLayout) \
+							for field in layoutFields(layout)] + \
+						['fx_gain_loss_' + base.lower() for base in ('HKD', 'MOP')] + \
+						['type', 'accounting', 'portfolio', 'valuation_date'])
+
+def layoutHeaders(layout):
+	return [header for (header, _) in layout]
+
+
+
+def projectRows(name, layout, records, securityMaster=None):
+	"""
+	name: name of the layout, 'cash', 'afs' or 'htm'.
+	layout: the layout.
+	records: the positions to be written to csv.
+
+	output: a list of rows ready to be written to csv, with the first row
+		being headers, or an empty list if there are no records. The
+		projector is picked once for a portfolio (the fx field depends on
+		the portfolio's base currency), not for each record.
+	"""
+	if not records:
+		return []
+
+	rows = [layoutHeaders(layout)]
+	portfolio, project = None, None
+	for (record, entry) in zip(records, securityMasterEntries(securityMaster, records)):
+		if record['portfolio'] != portfolio:
+			portfolio = record['portfolio']
+			project = projectors[(name, baseCurrency[portfolio])]
+		rows.append(project(record, entry))
+
+	return rows
+
+
+
+def writeCashCsv(file, records, delimiter='|', progress=None):
 	"""
 	records: the holding records of the portfolio, including cash, bond,
 		equity, futures, etc.
 
 	file: the output csv file
 
+	progress: a Progress object (see progress.py), the rows written are
+		added to it, and when it is cancelled the file is not written,
+		see dif.writeCsv().
+
 	output: no return value, the function writes cash records to
 		the output csv file with headers needed by Geneva reconciliation.
 		The cash records include bank cash and futures broker account cash.
+		Cash entries of the same custodian and the same currency are merged
+		into one entry.
 	"""
-	cashHeaders = ['portfolio', 'custodian', 'date', 'account_type',
-					'account_num', 'currency', 'balance', 'fx_rate',
-					'local_currency_equivalent']
-
-	bankMap = {	# map bank name to custodian name
-		'Citibank': 'CITI',
-		'ICBC (Macau) Ltd': 'ICBCMACAU',
-		'JPMorgan Chase Bank, N.A.': 'JPM',
-		'Bank of China Ltd. (Macau Branch)': 'BOCMACAU',
-		'Luso International Banking Ltd.': 'LUSO',
-		'China Guangfa Bank Co., Ltd Macau Branch': 'GUANGFA_MACAU',
-		'Bank of China (HK)': 'BOCHK'
-	}
-
 	def cash(record):
 		if record['type'] in ('cash', 'broker account cash'):
 			return True
 		return False
 
-	def toCashRecords(record):
-		r = {}
-		r['date'] = record['valuation_date']
-		if record['type'] == 'cash':
-			try:
-				r['custodian'] = bankMap[record['bank']]
-			except KeyError:
-				raise KeyError('toCashRecords(): {0} map custodian failed'.format(record))
-		elif record['type'] == 'broker account cash':
-			r['custodian'] = record['bank']
-
-		r['account_num'] = record['account_number']
-		r['balance'] = record['book_cost']
-		r['fx_rate'] = record['exchange_rate']
-		r['local_currency_equivalent'] = record['exchange_rate'] * record['book_cost']
-
-		for header in ['portfolio', 'account_type', 'currency']:
-			r[header] = record[header]
-
-		return r
-
-	def consolidateCash(cashList, cash):
-		"""
-		Merge cash entries of the same bank, of the same currency to one
-		entry.
-		"""
-		def findMatchingCash(cashList, cash):
-			for i in range(len(cashList)):
-				c = cashList[i]
-				if c['custodian'] == cash['custodian'] and c['currency'] == cash['currency']:
-					return i
-
-			return -1
-
-		def mergeCashToList(cashList, index, cash):
-			if index == -1:
-				cashList.append(cash)
-			else:
-				cashList[index]['balance'] = cashList[index]['balance'] + cash['balance']
-				cashList[index]['local_currency_equivalent'] = cashList[index]['local_currency_equivalent'] + cash['local_currency_equivalent']
-			return cashList
-
-		i = findMatchingCash(cashList, cash)
-		return mergeCashToList(cashList, i, cash)
+	rows = projectRows('cash', cashLayout, list(filter(cash, records)))
+	headers = layoutHeaders(cashLayout)
+	iCustodian, iCurrency, iBalance, iEquivalent = map(headers.index,
+		['custodian', 'currency', 'balance', 'local_currency_equivalent'])
 
-	writeCsv(file,
-		recordsToRows(reduce(consolidateCash, map(toCashRecords, filter(cash, records)), []), 
-						cashHeaders),
-		delimiter)
+	consolidated = {}	# (custodian, currency) -> row
+	for row in rows[1:]:
+		key = (row[iCustodian], row[iCurrency])
+		if not key in consolidated:
+			consolidated[key] = list(row)
+		else:
+			consolidated[key][iBalance] = consolidated[key][iBalance] + row[iBalance]
+			consolidated[key][iEquivalent] = consolidated[key][iEquivalent] + row[iEquivalent]
 
+	writeCsv(file, rows[:1] + list(consolidated.values()), delimiter, progress)
 
 
-def writeAfsCsv(file, records, delimiter='|'):
+
+def writeAfsCsv(file, records, delimiter='|', securityMaster=None, progress=None):
 	"""
 	records: the holding records of the portfolio, including cash, bond,
 		equity, futures, etc.
 
 	file: the output csv file
 
+	securityMaster: a SecurityMaster object to look up bloomberg_figi,
+		if not given, bloomberg_figi is empty.
+
+	progress: a Progress object, see writeCashCsv().
+
 	output: no return value, the function writes all non HTM records to
 		the output csv file with headers needed by Geneva reconciliation.
 	"""
-	afsHeaders = ['portfolio', 'date', 'custodian', 'ticker', 'isin',
-				'bloomberg_figi', 'name', 'currency', 'accounting_treatment',
-				'quantity', 'average_cost', 'price', 'book_cost', 'market_value',
-				'market_gain_loss', 'fx_gain_loss']
-
 	def afsPosition(record):
 		if record['type'] == 'equity' or \
 			(record['type'] == 'bond' and record['accounting'] != 'htm'):
 			return True
 		return False
 
-	def toAfsRecords(record):
-		"""
-		map an avaible for sale (AFS) or Trading position (can be either equity
-		or bond) to the record ready to be written to the csv.
-		"""
-		r = {}
-		r['date'] = record['valuation_date']
-		r['geneva_investment_id'] = ''
-		r['bloomberg_figi'] = ''
-		r['accounting_treatment'] = record['accounting'].upper()
-		r['name'] = record['description']
-		try:
-			r['fx_gain_loss'] = record['fx_gain_loss_hkd']
-		except KeyError:
-			r['fx_gain_loss'] = record['fx_gain_loss_mop']
-
-		for header in afsHeaders:
-			if header in ('date', 'geneva_investment_id', 'bloomberg_figi',
-							'accounting_treatment', 'name', 'fx_gain_loss'):
-				pass
-			elif header in ('ticker', 'isin'):
-				try:
-					r[header] = record[header]
-				except KeyError:
-					r[header] = ''
-			else:
-				r[header] = record[header]
-
-		return r
-	# end of toAfsRecords()
 	writeCsv(file,
-		recordsToRows(list(map(toAfsRecords, filter(afsPosition, records))), afsHeaders),
-		delimiter)
+		projectRows('afs', afsLayout, list(filter(afsPosition, records)), securityMaster),
+		delimiter, progress)
 
 
 
-def writeHtmCsv(file, records, delimiter='|'):
+def writeHtmCsv(file, records, delimiter='|', securityMaster=None, progress=None):
 	"""
 	records: the holding records of the portfolio, including cash, bond,
 		equity, futures, etc.
 
 	file: the output csv file
 
+	securityMaster: a SecurityMaster object to look up bloomberg_figi and
+		geneva_investment_id, if not given or the bond is not found,
+		bloomberg_figi is empty and geneva_investment_id is isin + ' HTM'.
+
+	progress: a Progress object, see writeCashCsv().
+
 	output: no return value, the function writes the HTM bond records to
 		the output csv file with headers needed by Geneva reconciliation.
 	"""
-	htmHeaders = ['portfolio', 'date', 'custodian', 'geneva_investment_id', 'isin',
-				'bloomberg_figi', 'name', 'currency', 'accounting_treatment',
-				'par_amount', 'is_listed', 'listed_location', 'fx_on_trade_day',
-				'coupon_rate', 'coupon_start_date', 'maturity_date', 'average_cost',
-				'amortized_cost', 'book_cost', 'interest_bought', 'amortized_value',
-				'accrued_interest', 'amortized_gain_loss', 'fx_gain_loss']
-
 	def htmPosition(record):
 		if record['type'] == 'bond' and record['accounting'] == 'htm':
 			return True
 		return False
 
-	def toHtmRecords(record):
-		"""
-		map a htm bond record to the record ready to be written to the csv.
-		"""
-		r = {}
-		r['date'] = record['valuation_date']
-		r['geneva_investment_id'] = record['isin'] + ' HTM'
-		r['bloomberg_figi'] = ''
-		r['name'] = record['description']
-		r['accounting_treatment'] = record['accounting'].upper()
-		r['par_amount'] = record['quantity']
-		try:
-			r['fx_gain_loss'] = record['fx_gain_loss_hkd']
-		except KeyError:
-			r['fx_gain_loss'] = record['fx_gain_loss_mop']
-
-		for header in htmHeaders:
-			if header in ('date', 'geneva_investment_id', 'bloomberg_figi',
-							'name', 'accounting_treatment', 'par_amount', 
-							'fx_gain_loss'):
-				continue
-
-			r[header] = record[header]
-
-		return r
-	# end of toHtmRecords()
 	writeCsv(file, 
-		recordsToRows(list(map(toHtmRecords, filter(htmPosition, records))), htmHeaders),
-		delimiter)
+		projectRows('htm', htmLayout, list(filter(htmPosition, records)), securityMaster),
+		delimiter, progress)
+
+
+
+def securityMasterEntries(securityMaster, records):
+	"""
+	output: [list] security master entries of the records, in one batch,
+		or a list of None if there is no security master.
+	"""
+	if securityMaster is None:
+		return [None] * len(records)
+	else:
+		return securityMaster.lookupRecords(records)
 
 
 
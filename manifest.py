@@ -0,0 +1,197 @@
+# coding=utf-8
+#
+# A manifest in the output directory of open_dif(), recording for each
+# input file the hash of its content, the parser version and the hashes of
+# the csv files written for it. When open_dif() is called again with the
+# same input, and the csv files are still there unchanged, the files and
+# portValues are returned from the manifest without parsing.
+#
+# The manifest (dif_manifest.json) is shared by all processes writing to
+# the same directory, so it is updated under a lock file, and replaced as
+# a whole, never written in place.
+#
+
+from dif_revised.utility import get_current_path
+from os.path import join, exists, getmtime, abspath
+from contextlib import contextmanager
+from functools import lru_cache
+from uuid import uuid4
+import ast, hashlib, json, os, time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+manifestName = 'dif_manifest.json'
+
+
+
+def fileHash(file):
+	h = hashlib.sha256()
+	with open(file, 'rb') as f:
+		for block in iter(lambda: f.read(1024*1024), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+
+def contentHash(contents):
+	"""
+	contents: a buffer (bytes, memoryview, mmap etc.) of the input file.
+	"""
+	return hashlib.sha256(contents).hexdigest()
+
+
+
+def parserModules():
+	"""
+	output: [list] the source files of geneva.py, where open_dif() is, and
+		of the modules of this package it imports, directly or not (dif.py,
+		secmaster.py and so on), sorted.
+	"""
+	found, todo = set(), ['geneva']
+	while todo:
+		module = todo.pop()
+		if module in found:
+			continue
+		found.add(module)
+		with open(join(get_current_path(), module + '.py'), 'rb') as f:
+			tree = ast.parse(f.read())
+		for node in ast.walk(tree):
+			if isinstance(node, ast.ImportFrom):
+				names = [node.module or '']
+			elif isinstance(node, ast.Import):
+				names = [alias.name for alias in node.names]
+			else:
+				continue
+			todo.extend(name.split('.')[1] for name in names \
+						if name.startswith('dif_revised.'))
+
+	return sorted(module + '.py' for module in found)
+
+
+
+"""
+The parser version is the hash of the source code of the modules that
+produce the csv files, so that any change to the parser (say a header
+mapping fix in sectionHeader(), or a new security in secmaster.py) makes
+the manifest entries out of date.
+"""
+@lru_cache(maxsize=None)
+def parserVersion():
+	h = hashlib.sha256()
+	for module in parserModules():
+		with open(join(get_current_path(), module), 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()[:16]
+
+
+
+def manifestKey(inputHash, prefix, securityMaster=None, byPortfolio=False):
+	"""
+	output: the key of an entry in the manifest, i.e., the same input
+		content, written with the same prefix, security master file and
+		file names (see byPortfolio of open_dif()).
+	"""
+	if securityMaster is None:
+		master = ''
+	else:
+		master = '{0}@{1}'.format(abspath(securityMaster), getmtime(securityMaster))
+
+	parts = [inputHash, prefix, master]
+	if byPortfolio:
+		parts.append('by portfolio')
+	return '|'.join(parts)
+
+
+
+def readManifest(outputDir):
+	file = join(outputDir, manifestName)
+	if not exists(file):
+		return {}
+
+	try:
+		with open(file, encoding='utf-8') as f:
+			return json.load(f)
+	except ValueError:
+		logger.error('readManifest(): {0} is corrupted, ignored'.format(file))
+		return {}
+
+
+
+def findOutputs(outputDir, key):
+	"""
+	outputDir: the output directory.
+	key: the manifest key, from manifestKey().
+
+	output: (files, portValues) from an earlier open_dif() call, if the
+		manifest has the key with the current parser version, and the csv
+		files are there with the same hashes. Otherwise None.
+	"""
+	entry = readManifest(outputDir).get(key)
+	if entry is None or entry['parser_version'] != parserVersion():
+		return None
+
+	files = [join(outputDir, f) for f in entry['files']]
+	for (file, outputHash) in zip(files, entry['output_sha256']):
+		if not exists(file) or fileHash(file) != outputHash:
+			logger.info('findOutputs(): {0} is changed or missing'.format(file))
+			return None
+
+	return files, entry['portValues']
+
+
+
+def recordOutputs(outputDir, key, files, portValues):
+	"""
+	Add (or replace) the entry of the key in the manifest.
+	"""
+	entry = {
+		'parser_version': parserVersion(),
+		'files': [os.path.basename(f) for f in files],
+		'output_sha256': [fileHash(f) for f in files],
+		'portValues': portValues
+	}
+
+	file = join(outputDir, manifestName)
+	with lockFile(file + '.lock'):
+		manifest = readManifest(outputDir)
+		manifest[key] = entry
+		tempFile = '{0}.{1}.tmp'.format(file, uuid4().hex)
+		with open(tempFile, 'w', encoding='utf-8') as f:
+			json.dump(manifest, f, indent=1, sort_keys=True)
+		os.replace(tempFile, file)
+
+
+
+@contextmanager
+def lockFile(file, timeout=30, staleAfter=120):
+	"""
+	A lock between processes, by creating the lock file exclusively. It
+	works the same on Windows and Linux. A lock file older than staleAfter
+	seconds is left by a dead process, and is removed.
+	"""
+	start = time.time()
+	while True:
+		try:
+			fd = os.open(file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			break
+		except FileExistsError:
+			try:
+				if time.time() - getmtime(file) > staleAfter:
+					logger.warning('lockFile(): remove stale lock {0}'.format(file))
+					os.remove(file)
+					continue
+			except OSError:
+				continue	# the lock is just released
+
+			if time.time() - start > timeout:
+				raise TimeoutError('lockFile(): {0}'.format(file))
+			time.sleep(0.01)
+
+	try:
+		yield
+	finally:
+		os.close(fd)
+		os.remove(file)
@@ -0,0 +1,264 @@
+# coding=utf-8
+#
+# NAV and unit price history of each portfolio, from the summaries of many
+# trustee files, with day over day returns, shifts of the subtotal mix
+# (cash, bond, equity etc. as a share of NAV) and flags for jumps.
+#
+# Summaries are read by readSummaryFile(), which loads the summary
+# worksheet only, and can be kept in a SummaryCache (a SQLite database),
+# so that a file is read only once. Once loaded, the history of each
+# portfolio is a few NumPy arrays sorted by date, and all the changes are
+# computed at once, so years of daily files take a few milliseconds.
+#
+# A change is flagged when:
+#
+# 	the unit price return is beyond the return limit;
+# 	the return is an outlier in the portfolio's history, i.e., its robust
+# 	z-score (distance from the median, in median absolute deviations) is
+# 	beyond the z-score limit;
+# 	the share of a subtotal in NAV shifts by more than the mix limit.
+#
+
+from dif_revised.dif import readSummaryFile, summaryNameMap, toDate, dateToString, writeCsv
+from dif_revised.manifest import fileHash, parserVersion
+from types import MappingProxyType
+import numpy as np
+import json, sqlite3
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class SummaryCache():
+	"""
+	Summaries of trustee files, by the hash of the file's content and the
+	parser version, so a file renamed or copied is not read again, and a
+	parser change reads it again.
+
+	file: the SQLite database file, the default is an in memory database,
+		i.e., not saved.
+	"""
+	def __init__(self, file=':memory:'):
+		self.db = sqlite3.connect(file)
+		self.db.execute('CREATE TABLE IF NOT EXISTS summary ('
+						'file_hash TEXT NOT NULL, parser_version TEXT NOT NULL, '
+						'summary TEXT NOT NULL, PRIMARY KEY (file_hash, parser_version))')
+		self.db.commit()
+
+
+	def readSummary(self, file):
+		"""
+		output: [dictionary] the summary of the file, see readSummaryFile(),
+			from the cache if there.
+		"""
+		key = (fileHash(file), parserVersion())
+		row = self.db.execute('SELECT summary FROM summary WHERE file_hash = ? '
+								'AND parser_version = ?', key).fetchone()
+		if row is not None:
+			return json.loads(row[0])
+
+		summary = readSummaryFile(file)
+		self.db.execute('INSERT OR REPLACE INTO summary VALUES (?, ?, ?)',
+						key + (json.dumps(summary),))
+		self.db.commit()
+		return summary
+
+
+	def close(self):
+		self.db.close()
+
+
+
+def loadSummaries(files, cache=None, progress=None):
+	"""
+	files: [iterable] trustee files.
+	cache: a SummaryCache, if not given, every file is read.
+	progress: a Progress object (see progress.py), if given, the files are
+		added to it, and Cancelled is raised between files when it is
+		cancelled.
+
+	output: [list] the summaries of the files.
+	"""
+	read = cache.readSummary if cache is not None else readSummaryFile
+	if progress is None:
+		return [read(file) for file in files]
+
+	summaries = []
+	for file in files:
+		progress.check()
+		summaries.append(read(file))
+		progress.update(files=1)
+	return summaries
+
+
+
+"""
+Fields of a summary that are not subtotals.
+"""
+valueFields = ('nav', 'number_of_units', 'unit_price', 'valuation_date', 'portfolio')
+
+def navHistory(summaries):
+	"""
+	summaries: [iterable] summaries from readSummaryFile() or SummaryCache,
+		of any number of portfolios, in any order.
+
+	output: [dictionary] portfolio -> its history, a dictionary with keys
+		date (datetime64[D] array, sorted), nav, number_of_units, unit_price
+		(float arrays), categories (the names of the subtotals) and
+		subtotals (a float array, one row per date, one column per
+		category, zero where a file does not have that subtotal). The
+		categories are the record types of summaryNameMap first, then the
+		other lines of the summaries in the order first seen.
+
+	When there are two summaries of the same portfolio and date, say a
+	revised file, the later one in summaries is taken.
+	"""
+	byPortfolio = {}
+	for summary in summaries:
+		byDate = byPortfolio.setdefault(summary['portfolio'], {})
+		byDate[toDate(summary['valuation_date'])] = summary
+
+	types = list(dict.fromkeys(summaryNameMap.values()))
+	histories = {}
+	for (portfolio, byDate) in byPortfolio.items():
+		dates = sorted(byDate)
+		ordered = [byDate[dt] for dt in dates]
+		others = dict.fromkeys(name for s in ordered for name in s \
+								if not name in valueFields and not name in types)
+		categories = [t for t in types if any(t in s for s in ordered)] + list(others)
+		histories[portfolio] = {
+			'date': np.array(dates, dtype='datetime64[D]'),
+			'nav': np.array([s['nav'] for s in ordered], dtype=np.float64),
+			'number_of_units': np.array([s.get('number_of_units', np.nan) for s in ordered],
+										dtype=np.float64),
+			'unit_price': np.array([s.get('unit_price', np.nan) for s in ordered],
+									dtype=np.float64),
+			'categories': categories,
+			'subtotals': np.array([[s.get(c) or 0.0 for c in categories] for s in ordered],
+									dtype=np.float64).reshape(len(ordered), len(categories))
+		}
+
+	return histories
+
+
+
+def dayOverDay(history):
+	"""
+	history: [dictionary] the history of a portfolio, from navHistory().
+
+	output: [dictionary] the changes from each date to the next, arrays of
+		one element less than the history, with keys previous_date, date,
+		days (calendar days in between), unit_price_return, nav_change,
+		units_change, weights (the share of each subtotal in NAV, a row per
+		date of the history, not one less) and mix_shift (the change of
+		weights, a row per change).
+	"""
+	nav, price = history['nav'], history['unit_price']
+	with np.errstate(divide='ignore', invalid='ignore'):
+		weights = history['subtotals'] / nav[:, None]
+
+	return {
+		'previous_date': history['date'][:-1],
+		'date': history['date'][1:],
+		'days': np.diff(history['date']).astype(np.int64),
+		'unit_price_return': price[1:] / price[:-1] - 1,
+		'nav_change': np.diff(nav),
+		'units_change': np.diff(history['number_of_units']),
+		'weights': weights,
+		'mix_shift': np.diff(weights, axis=0)
+	}
+
+
+
+"""
+The default limits, the unit price return and the mix shift are fractions,
+0.03 is 3%.
+"""
+defaultLimits = MappingProxyType({
+	'return': 0.03,
+	'z_score': 5.0,
+	'mix_shift': 0.05
+})
+
+def robustZScore(values):
+	"""
+	output: [array] (value - median) / (1.4826 * median absolute deviation),
+		zero where the deviation is zero, i.e., most values are the same.
+	"""
+	valid = values[np.isfinite(values)]
+	if len(valid) == 0:
+		return np.zeros(len(values))
+	median = np.median(valid)
+	mad = 1.4826 * np.median(np.abs(valid - median))
+	if mad == 0:
+		return np.zeros(len(values))
+	return (values - median) / mad
+
+
+
+def flagJumps(portfolio, history, changes, limits=None):
+	"""
+	portfolio: the portfolio id.
+	history, changes: from navHistory() and dayOverDay().
+	limits: [dictionary] name -> limit, see defaultLimits.
+
+	output: [list] flags, each a dictionary with keys portfolio,
+		previous_date, date (as valuation_date of the records, see
+		dateToString()), field ('unit_price' or a subtotal category),
+		value (the return or shift), z_score (of the return, zero for a
+		shift) and reason ('return limit', 'outlier' or 'mix shift').
+	"""
+	limits = dict(defaultLimits, **(limits or {}))
+	returns = changes['unit_price_return']
+	z = robustZScore(returns)
+
+	found = []	# (change index, field, value, z, reason)
+	for i in np.flatnonzero(np.abs(returns) > limits['return']):
+		found.append((i, 'unit_price', returns[i], z[i], 'return limit'))
+	for i in np.flatnonzero((np.abs(z) > limits['z_score']) & \
+							~(np.abs(returns) > limits['return'])):
+		found.append((i, 'unit_price', returns[i], z[i], 'outlier'))
+	for (i, j) in zip(*np.nonzero(np.abs(changes['mix_shift']) > limits['mix_shift'])):
+		found.append((i, history['categories'][j], changes['mix_shift'][i, j], 0.0, 'mix shift'))
+
+	# dates as in the records and summaries (2018-5-28), to join with them
+	dates = [dateToString(dt) for dt in history['date'].tolist()]
+	return [{
+		'portfolio': portfolio,
+		'previous_date': dates[i],
+		'date': dates[i+1],
+		'field': field,
+		'value': float(value),
+		'z_score': float(zScore),
+		'reason': reason
+	} for (i, field, value, zScore, reason) in sorted(found, key=lambda f: f[0])]
+
+
+
+def navAnalytics(summaries, limits=None):
+	"""
+	summaries: [iterable] summaries, see navHistory().
+	limits: [dictionary] name -> limit, see defaultLimits.
+
+	output: two items:
+		[dictionary] portfolio -> {'history': from navHistory(),
+			'changes': from dayOverDay()}
+
+		[list] flags of all portfolios, see flagJumps(), by portfolio and
+			date.
+	"""
+	analytics, flags = {}, []
+	for (portfolio, history) in sorted(navHistory(summaries).items()):
+		changes = dayOverDay(history)
+		analytics[portfolio] = {'history': history, 'changes': changes}
+		flags.extend(flagJumps(portfolio, history, changes, limits))
+
+	logger.debug('navAnalytics(): {0} portfolios, {1} flags'.format(len(analytics), len(flags)))
+	return analytics, flags
+
+
+
+def writeFlags(file, flags, delimiter=','):
+	headers = ['portfolio', 'previous_date', 'date', 'field', 'value', 'z_score', 'reason']
+	writeCsv(file, [headers] + [[f[h] for h in headers] for f in flags], delimiter)
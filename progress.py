@@ -0,0 +1,112 @@
+# coding=utf-8
+#
+# Progress and cancellation of long runs, like a big workbook or a
+# backfill of years of files.
+#
+# A Progress object is handed to readFile(), readHolding(), open_dif(),
+# the Geneva writers, writeCsv() and the batch functions. They add the
+# rows, sections and files they have done, and the csv rows they have
+# written, and the progress (with rates) is reported to a function at
+# most once every few seconds. Any thread, or a signal handler, can cancel
+# it, then the run stops at the next section, file or batch of csv rows
+# with Cancelled. A csv file being written is removed, and open_dif()
+# renames its csv files into place only when all of them are written, so
+# there are no partial outputs. A batch function finishes the files
+# already being exported and returns.
+#
+
+from threading import Event, Lock
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class Cancelled(Exception):
+	pass
+
+
+
+class Progress():
+	"""
+	report: a function called with the progress (see snapshot()), at most
+		once every interval seconds and after each file. Optional.
+	interval: seconds.
+	"""
+	def __init__(self, report=None, interval=5):
+		self.report = report
+		self.interval = interval
+		self.rows = 0
+		self.sections = 0
+		self.files = 0
+		self.rowsWritten = 0
+		self.start = time.monotonic()
+		self.lastReport = self.start
+		self.cancelEvent = Event()
+		self.lock = Lock()
+
+
+	def update(self, rows=0, sections=0, files=0, rowsWritten=0):
+		"""
+		Add the rows (non empty lines of the worksheet), sections and files
+		read, and the csv rows written.
+		"""
+		now = time.monotonic()
+		with self.lock:
+			self.rows = self.rows + rows
+			self.sections = self.sections + sections
+			self.files = self.files + files
+			self.rowsWritten = self.rowsWritten + rowsWritten
+			due = self.report is not None and (files > 0 or now - self.lastReport >= self.interval)
+			if due:
+				self.lastReport = now
+
+		if due:
+			self.report(self.snapshot())
+
+
+	def snapshot(self):
+		"""
+		output: [dictionary] with keys rows, sections, files, rows_written,
+			elapsed (seconds), and the rate of each count, rows_per_second,
+			sections_per_second, files_per_second and
+			rows_written_per_second.
+		"""
+		with self.lock:
+			counts = {'rows': self.rows, 'sections': self.sections, 'files': self.files,
+						'rows_written': self.rowsWritten}
+		elapsed = time.monotonic() - self.start
+		progress = dict(counts, elapsed=elapsed)
+		for (name, n) in counts.items():
+			progress[name + '_per_second'] = n / elapsed if elapsed > 0 else 0.0
+		return progress
+
+
+	def cancel(self):
+		"""
+		Ask the run to stop, safe to call from any thread or a signal
+		handler.
+		"""
+		self.cancelEvent.set()
+
+
+	def isCancelled(self):
+		return self.cancelEvent.is_set()
+
+
+	def check(self):
+		"""
+		Raise Cancelled if the run is cancelled, called between sections,
+		files and batches of csv rows.
+		"""
+		if self.cancelEvent.is_set():
+			raise Cancelled('cancelled after {0} files, {1} sections'.format(
+							self.files, self.sections))
+
+
+
+def logProgress(progress):
+	logger.info('{files} files, {sections} sections, {rows} rows in {elapsed:.1f}s, '
+				'{files_per_second:.2f} files/s, {rows_per_second:.0f} rows/s, '
+				'{rows_written} csv rows written'.format(**progress))
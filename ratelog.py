@@ -0,0 +1,123 @@
+# coding=utf-8
+#
+# Logging for the parser's hot paths, i.e., messages that can come once
+# per row or per section, like an FX rate not found or a ticker not
+# converted. On a big batch those lines cost more than the parsing.
+#
+# Each message has a kind (a short name), every message is counted by its
+# kind, but only the first few of a kind in a time window are written.
+# Arguments are formatted by logging, only when a message is written. A
+# batch job reads the counts at the end, and writes one summary line
+# instead of one line per row.
+#
+# The counts are of a process. A worker process hands its counts over
+# with the results, and the parent adds them to its own, see takeCounts().
+#
+
+from collections import Counter
+from threading import Lock
+import logging, time
+
+
+
+class RateLimitedLog():
+	"""
+	logger: the logger to write to.
+	limit: the number of messages of each kind written in a window, the
+		rest in the window are counted only.
+	interval: the length of the window in seconds.
+	"""
+	def __init__(self, logger, limit=5, interval=60):
+		self.logger = logger
+		self.limit = limit
+		self.interval = interval
+		self.counts = Counter()		# kind -> number of messages, since reset
+		self.windows = {}			# kind -> (start of window, messages in it)
+		self.lock = Lock()
+
+
+	def log(self, level, kind, message, *args):
+		"""
+		level: the logging level.
+		kind: the kind of the message, for counting, like 'fx not found'.
+		message, args: the same as logging, '%s' in message for args.
+		"""
+		now = time.monotonic()
+		with self.lock:
+			self.counts[kind] = self.counts[kind] + 1
+			start, n = self.windows.get(kind, (now, 0))
+			if now - start > self.interval:
+				start, n = now, 0
+			n = n + 1
+			self.windows[kind] = (start, n)
+
+		if n > self.limit or not self.logger.isEnabledFor(level):
+			return
+
+		if n == self.limit:
+			message = message + ' (more \'%s\' messages in %ss are counted only)'
+			args = args + (kind, self.interval)
+		self.logger.log(level, message, *args, extra={'kind': kind})
+
+
+	def debug(self, kind, message, *args):
+		self.log(logging.DEBUG, kind, message, *args)
+
+	def info(self, kind, message, *args):
+		self.log(logging.INFO, kind, message, *args)
+
+	def warning(self, kind, message, *args):
+		self.log(logging.WARNING, kind, message, *args)
+
+	def error(self, kind, message, *args):
+		self.log(logging.ERROR, kind, message, *args)
+
+
+	def summary(self, reset=False):
+		"""
+		output: [dictionary] kind -> number of messages since the last
+			reset, including those not written.
+		"""
+		with self.lock:
+			counts = dict(self.counts)
+			if reset:
+				self.counts.clear()
+				self.windows.clear()
+		return counts
+
+
+	def takeCounts(self):
+		"""
+		output: [dictionary] kind -> number of messages since the counts
+			were last taken or reset, which are cleared. The time windows
+			are kept, so the messages of a worker process are still rate
+			limited across its tasks. The parent gives them to addCounts().
+		"""
+		with self.lock:
+			counts = dict(self.counts)
+			self.counts.clear()
+		return counts
+
+
+	def addCounts(self, counts):
+		"""
+		counts: [dictionary] kind -> number of messages, from takeCounts()
+			of another process.
+		"""
+		with self.lock:
+			self.counts.update(counts)
+
+
+	def logSummary(self, level=logging.INFO, reset=True):
+		"""
+		Write the counts in one line, and return them, see summary().
+		"""
+		counts = self.summary(reset)
+		if counts:
+			self.logger.log(level, 'log summary: %s', summaryText(counts))
+		return counts
+
+
+
+def summaryText(counts):
+	return ', '.join('{0} x{1}'.format(kind, n) for (kind, n) in sorted(counts.items()))
@@ -0,0 +1,155 @@
+# coding=utf-8
+#
+# Reconcile holdings from trustee files with a position extract from
+# Geneva, in this process, instead of uploading csv files (geneva.py) to
+# the external reconciliation setup.
+#
+# The Geneva extract is a csv file with the following columns (a different
+# header can be mapped with the columnMap argument of loadGenevaExtract()):
+#
+# 	portfolio, date, type, investment_id, custodian, currency, quantity,
+# 	balance
+#
+# type is 'cash' for cash balances (custodian, currency and balance are
+# used), anything else for positions (investment_id and quantity are used).
+#
+# Positions are joined on (portfolio, date, investment id), where the
+# investment id is the isin or ticker, or the Geneva investment id of HTM
+# bonds. Cash is joined on (portfolio, date, custodian, currency).
+#
+
+from dif_revised.dif import toDate, writeCsv
+from dif_revised.geneva import cashCustodian
+from collections import defaultdict
+from types import MappingProxyType
+import csv
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+"""
+The default tolerances, a difference within the tolerance is not a break.
+"""
+defaultTolerances = MappingProxyType({
+	'quantity': 0.01,
+	'balance': 0.01
+})
+
+
+
+def loadGenevaExtract(file, delimiter=',', columnMap=None):
+	"""
+	file: the Geneva extract csv file.
+	columnMap: [dictionary] column name used here -> header in the file,
+		for the headers that are different, say {'investment_id': 'Investment'}
+
+	output: [list] rows of the extract as dictionaries with the column
+		names used here, quantity and balance converted to float.
+	"""
+	columnMap = columnMap or {}
+	names = ['portfolio', 'date', 'type', 'investment_id', 'custodian',
+				'currency', 'quantity', 'balance']
+
+	def toFloat(text):
+		return float(text.replace(',', '')) if text.strip() != '' else 0.0
+
+	def toRow(line):
+		row = {name: line.get(columnMap.get(name, name), '').strip() for name in names}
+		row['quantity'] = toFloat(row['quantity'])
+		row['balance'] = toFloat(row['balance'])
+		return row
+
+	with open(file, newline='', encoding='utf-8-sig') as f:
+		return [toRow(line) for line in csv.DictReader(f, delimiter=delimiter)]
+
+
+
+def positionKey(record, securityMaster=None):
+	"""
+	output: the join key of a bond or equity record.
+	"""
+	if record['type'] == 'bond' and record['accounting'] == 'htm':
+		entry = securityMaster.lookupRecord(record) if securityMaster else None
+		if entry and entry['geneva_investment_id'] != '':
+			investmentId = entry['geneva_investment_id']
+		else:
+			investmentId = record['isin'] + ' HTM'
+	else:
+		investmentId = record.get('isin') or record.get('ticker')
+
+	return (record['portfolio'], toDate(record['valuation_date']), investmentId)
+
+
+
+def reconcile(records, genevaRows, tolerances=None, securityMaster=None):
+	"""
+	records: [iterable] holding records from readHolding(), of any number
+		of portfolios and valuation dates.
+	genevaRows: [list] rows from loadGenevaExtract().
+	tolerances: [dictionary] field -> tolerance, see defaultTolerances.
+	securityMaster: a SecurityMaster object for HTM Geneva investment ids.
+
+	output: [list] breaks, each a dictionary with keys kind ('position' or
+		'cash'), portfolio, date, id (investment id, or custodian and
+		currency for cash), field, trustee, geneva, difference and reason
+		('missing in geneva', 'missing in trustee' or 'difference').
+
+	Both sides are summed up by key into hash tables, then joined, so the
+	cost grows linearly with the number of records and rows.
+	"""
+	tolerances = dict(defaultTolerances, **(tolerances or {}))
+	trustee = {'position': defaultdict(float), 'cash': defaultdict(float)}
+	for record in records:
+		if record['type'] in ('bond', 'equity'):
+			trustee['position'][positionKey(record, securityMaster)] += record['quantity']
+		elif record['type'] in ('cash', 'broker account cash'):
+			key = (record['portfolio'], toDate(record['valuation_date']),
+					cashCustodian(record), record['currency'])
+			trustee['cash'][key] += record['book_cost']
+
+	geneva = {'position': defaultdict(float), 'cash': defaultdict(float)}
+	for row in genevaRows:
+		if row['type'].lower() == 'cash':
+			key = (row['portfolio'], toDate(row['date']), row['custodian'], row['currency'])
+			geneva['cash'][key] += row['balance']
+		else:
+			key = (row['portfolio'], toDate(row['date']), row['investment_id'])
+			geneva['position'][key] += row['quantity']
+
+	breaks = []
+	for (kind, field) in [('position', 'quantity'), ('cash', 'balance')]:
+		for key in sorted(set(trustee[kind]) | set(geneva[kind])):
+			if not key in geneva[kind]:
+				reason = 'missing in geneva'
+			elif not key in trustee[kind]:
+				reason = 'missing in trustee'
+			elif abs(trustee[kind][key] - geneva[kind][key]) > tolerances[field]:
+				reason = 'difference'
+			else:
+				continue
+
+			trusteeValue = trustee[kind].get(key, 0.0)
+			genevaValue = geneva[kind].get(key, 0.0)
+			breaks.append({
+				'kind': kind,
+				'portfolio': key[0],
+				'date': key[1].isoformat(),
+				'id': ' '.join(key[2:]),
+				'field': field,
+				'trustee': trusteeValue,
+				'geneva': genevaValue,
+				'difference': trusteeValue - genevaValue,
+				'reason': reason
+			})
+
+	logger.debug('reconcile(): {0} breaks'.format(len(breaks)))
+	return breaks
+
+
+
+def writeBreaks(file, breaks, delimiter=','):
+	headers = ['kind', 'portfolio', 'date', 'id', 'field', 'trustee', 'geneva',
+				'difference', 'reason']
+	writeCsv(file, [headers] + [[b[h] for h in headers] for b in breaks], delimiter)
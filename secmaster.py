@@ -0,0 +1,145 @@
+# coding=utf-8
+#
+# A local security master, maps a security's isin or ticker (as in the
+# holding records, i.e., after convertTicker()) to its Bloomberg FIGI and
+# Geneva investment id, so that the Geneva csv files carry them.
+#
+# The security master is loaded from a csv file or a SQLite database, with
+# the following columns (csv headers, or columns of table security_master):
+#
+# 	isin, ticker, bloomberg_figi, geneva_investment_id
+#
+# isin or ticker can be empty, but not both. geneva_investment_id is the
+# investment id of the HTM position in Geneva. isin and ticker are taken in
+# any case, and a ticker in the trustee's form (H0939) is converted as in
+# the holding records (939 HK).
+#
+
+from dif_revised.dif import convertTicker
+from functools import lru_cache
+from os.path import abspath, getmtime
+from threading import Lock
+from types import MappingProxyType
+import csv, re, sqlite3
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+def securityKey(text):
+	"""
+	text: an isin or a ticker, in any case, or an equity id as in the
+		trustee file (such as H0939).
+
+	output: the isin or ticker as in the holding records, i.e., upper case,
+		and an equity id converted by convertTicker().
+	"""
+	text = text.strip().upper()
+	if re.match('[HN][0-9]{4}$', text):
+		text = convertTicker(text)
+	return text
+
+
+
+class SecurityMaster():
+	"""
+	entries: [iterable] dictionaries with keys isin, ticker, bloomberg_figi
+		and geneva_investment_id.
+
+	The entries are indexed by both isin and ticker once, when the object
+	is created, both in the form of the holding records (see securityKey()).
+	The entries looked up are read only (MappingProxyType), they are
+	shared by all callers.
+	"""
+	def __init__(self, entries, cacheSize=1024):
+		self.index = {}
+		for entry in entries:
+			entry = {key: (entry.get(key) or '').strip() for key in \
+						('isin', 'ticker', 'bloomberg_figi', 'geneva_investment_id')}
+			for key in ('isin', 'ticker'):
+				entry[key] = securityKey(entry[key])
+			entry = MappingProxyType(entry)
+			for key in ('isin', 'ticker'):
+				if entry[key] != '':
+					self.index[entry[key]] = entry
+
+		self.lookup = lru_cache(maxsize=cacheSize)(self.lookupText)
+
+
+	def __len__(self):
+		return len(self.index)
+
+
+	def lookupText(self, text):
+		"""
+		text: an isin, a ticker, or an equity id as in the trustee file
+			(such as H0939), for ad hoc queries. Use lookup() instead, which
+			caches the results.
+
+		output: [mapping] the security master entry, or None if not found.
+		"""
+		return self.index.get(securityKey(text))
+
+
+	def lookupRecord(self, record):
+		"""
+		output: [mapping] the security master entry of a holding record,
+			by its isin or ticker, or None if not found.
+		"""
+		if 'isin' in record:
+			return self.index.get(record['isin'])
+		elif 'ticker' in record:
+			return self.index.get(record['ticker'])
+		else:
+			return None
+
+
+	def lookupRecords(self, records):
+		"""
+		records: [iterable] holding records.
+
+		output: [list] the security master entry (or None) of each record,
+			in the same order as records.
+		"""
+		return [self.lookupRecord(record) for record in records]
+
+
+
+"""
+Security masters loaded in this process, by (full path, modified time) of
+the file, so that a file is loaded only once unless it is changed.
+"""
+_loaded = {}
+_loadLock = Lock()
+
+def loadSecurityMaster(file):
+	"""
+	file: a csv file (.csv) or a SQLite database file (anything else).
+
+	output: a SecurityMaster object.
+
+	Thread safe, a thread loading a file waits for the thread already
+	loading it, then gets the same object.
+	"""
+	key = (abspath(file), getmtime(file))
+	with _loadLock:
+		if not key in _loaded:
+			if file.lower().endswith('.csv'):
+				with open(file, newline='', encoding='utf-8-sig') as f:
+					entries = list(csv.DictReader(f))
+			else:
+				db = sqlite3.connect(file)
+				db.row_factory = sqlite3.Row
+				try:
+					entries = [dict(row) for row in db.execute('SELECT * FROM security_master')]
+				finally:
+					db.close()
+
+			logger.info('loadSecurityMaster(): {0} entries from {1}'.format(len(entries), file))
+			for oldKey in [k for k in _loaded if k[0] == key[0]]:
+				del _loaded[oldKey]		# older version of the same file
+
+			_loaded[key] = SecurityMaster(entries)
+
+		return _loaded[key]
@@ -0,0 +1,301 @@
+# coding=utf-8
+#
+# A long running local server that keeps a pool of warm worker processes
+# for open_dif() requests, so that the caller (such as recon_helper.py)
+# does not pay for interpreter start up, imports and logging setup for
+# every trustee file.
+#
+# The server listens on localhost over HTTP. A request is a POST to
+# /open_dif with a json body like:
+#
+# 	{"inputFile": "<full path to the Excel file>",
+# 	 "outputDir": "<directory to write csv files>",
+# 	 "prefix": "<prefix of csv file names>"}
+#
+# and optionally "securityMaster", the file of the security master (see
+# secmaster.py), which is loaded once in each worker and kept warm.
+#
+# Instead of "inputFile", the caller can send the file content as base64
+# encoded "data". The response is a json object:
+#
+# 	{"files": [<cash csv>, <afs csv>, <htm csv>],
+# 	 "portValues": {"valuation_date": ..., "portfolio": ..., "nav": ...}}
+#
+# or {"error": "<message>"} with a non 200 status code.
+#
+# A request that is not done within the server's timeout gets a 504. The
+# timeout is enforced in the worker: at the deadline the worker's
+# Progress object (see progress.py) is cancelled, so open_dif() stops at
+# its next section or batch of csv rows, writes no csv files, and the
+# worker takes the next request. A request still waiting for a worker at
+# the deadline is not run at all. So after a 504 the client can expect no
+# csv files of that request, and the outputs of an earlier request for
+# the same file left as they were, and can simply send it again.
+#
+# When a worker process dies (say it runs out of memory, or xlrd crashes),
+# the pool is replaced, and the requests the dead pool had get a 503, the
+# client can send them again. Later requests go to the new pool.
+#
+# Workers log through a queue to the server process, whose handlers (as
+# set up by logging.config) write the messages, so the log file has one
+# writer however the workers are started.
+#
+
+from dif_revised.geneva import open_dif
+from dif_revised.progress import Progress, Cancelled
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import Queue
+from threading import Timer, Lock
+import json, base64, time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+class DifServer(ThreadingHTTPServer):
+	"""
+	A localhost http server that hands open_dif() requests over to a pool
+	of worker processes.
+
+	address: (host, port) tuple, use port 0 to let the OS pick a port.
+	workers: number of worker processes, i.e., how many files can be
+		parsed at the same time.
+	requestTimeout: seconds for a request to be done, from when it is
+		received, None means no limit. The worker stops the request at
+		the deadline, see the top of this module.
+
+	The workers' log messages go to the handlers of the root logger, as
+	they are when the server is created.
+	"""
+	daemon_threads = True
+
+	def __init__(self, address=('127.0.0.1', 0), workers=2, requestTimeout=60):
+		super(DifServer, self).__init__(address, DifRequestHandler)
+		self.requestTimeout = requestTimeout
+		self.workers = workers
+		self.logQueue = Queue()
+		self.logListener = QueueListener(self.logQueue, *logging.getLogger().handlers,
+											respect_handler_level=True)
+		self.logListener.start()
+		self.poolLock = Lock()
+		self.executor = self.newPool()
+
+
+	def newPool(self):
+		return ProcessPoolExecutor(max_workers=self.workers, initializer=initWorker,
+									initargs=(self.logQueue, logging.getLogger().level))
+
+
+	def replacePool(self, broken):
+		"""
+		Replace the pool after a worker process died, unless another
+		request has done so already.
+		"""
+		with self.poolLock:
+			if self.executor is broken:
+				logger.error('replacePool(): a worker process died, new pool started')
+				broken.shutdown(wait=False)
+				self.executor = self.newPool()
+
+
+	def submit(self, function, *args):
+		"""
+		Submit to the pool, to a new one if the pool is broken.
+
+		output: (pool, future)
+		"""
+		executor = self.executor
+		try:
+			return executor, executor.submit(function, *args)
+		except BrokenProcessPool:
+			self.replacePool(executor)
+			executor = self.executor
+			return executor, executor.submit(function, *args)
+
+
+	def server_close(self):
+		super(DifServer, self).server_close()
+		self.executor.shutdown(wait=True)
+		self.logListener.stop()
+
+
+
+class DifRequestHandler(BaseHTTPRequestHandler):
+
+	def do_POST(self):
+		if self.path != '/open_dif':
+			self.sendJson(404, {'error': 'unknown path {0}'.format(self.path)})
+			return
+
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+			request = json.loads(self.rfile.read(length).decode('utf-8'))
+		except ValueError as e:
+			self.sendJson(400, {'error': 'invalid request: {0}'.format(e)})
+			return
+
+		timeout = self.server.requestTimeout
+		deadline = None if timeout is None else time.time() + timeout
+		executor = self.server.executor
+		try:
+			executor, future = self.server.submit(runRequest, request, deadline)
+			# the worker stops at the deadline, the grace is for it to say so
+			self.sendJson(200, future.result(timeout=None if timeout is None \
+												else timeout + timeoutGrace))
+		except (TimeoutError, Cancelled):
+			future.cancel()
+			self.sendJson(504, {'error': 'request timed out after {0} seconds'.\
+									format(timeout)})
+		except BrokenProcessPool:
+			self.server.replacePool(executor)
+			self.sendJson(503, {'error': 'the worker process died, try again'})
+		except Exception as e:
+			logger.exception('do_POST()')
+			self.sendJson(500, {'error': '{0}: {1}'.format(type(e).__name__, e)})
+
+
+	def sendJson(self, status, obj):
+		body = json.dumps(obj).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+	def log_message(self, format, *args):
+		logger.debug(format, *args)
+
+
+
+def initWorker(logQueue=None, level=logging.WARNING):
+	"""
+	Runs once in each worker process, so that imports are done before the
+	first request arrives.
+
+	logQueue: if given, log messages of the worker (from level on) are
+		put on it, for the server process to write.
+	"""
+	if logQueue is not None:
+		root = logging.getLogger()
+		for handler in root.handlers[:]:
+			root.removeHandler(handler)	# inherited from the server with fork
+		root.addHandler(QueueHandler(logQueue))
+		root.setLevel(level)
+
+	import dif_revised.dif, dif_revised.geneva
+
+
+
+"""
+Seconds the server waits for a worker past the deadline of a request,
+before it sends a 504 without the worker's answer. A worker stops at its
+next section or batch of csv rows after the deadline, but not while
+xlrd is loading a workbook.
+"""
+timeoutGrace = 5
+
+def runRequest(request, deadline=None):
+	"""
+	request: [dictionary] the json request, see the top of this module.
+	deadline: (time.time()) if given, the request is cancelled at this
+		time, and Cancelled is raised, with no csv files written.
+
+	output: [dictionary] the csv files and portValues from open_dif().
+
+	Runs in a worker process.
+	"""
+	progress = Progress()
+	timer = None
+	if deadline is not None:
+		if deadline <= time.time():
+			raise Cancelled('the deadline passed before the request started')
+		timer = Timer(deadline - time.time(), progress.cancel)
+		timer.daemon = True
+		timer.start()
+
+	try:
+		portValues = {}
+		if 'data' in request:
+			inputFile = base64.b64decode(request['data'])
+		else:
+			inputFile = request['inputFile']
+
+		files = open_dif(inputFile, portValues, request['outputDir'], request['prefix'],
+							request.get('securityMaster'), progress=progress)
+		return {'files': files, 'portValues': portValues}
+	finally:
+		if timer is not None:
+			timer.cancel()
+
+
+
+def requestOpenDif(address, inputFile, portValues, outputDir, prefix, timeout=None,
+					securityMaster=None):
+	"""
+	The client side of the server, with the same interface as open_dif()
+	plus the server address.
+
+	address: (host, port) of the server.
+	inputFile: full path to the input file, or the file content as bytes
+		(sent to the server as is, the server does not save it to disk).
+	timeout: seconds to wait for the server's response.
+	securityMaster: the security master file, as seen by the server.
+
+	output: the 3 csv files, same as open_dif().
+	side effect: populate the portValues dictionary, same as open_dif().
+	"""
+	request = {'outputDir': outputDir, 'prefix': prefix}
+	if securityMaster:
+		request['securityMaster'] = securityMaster
+	if isinstance(inputFile, (bytes, bytearray)):
+		request['data'] = base64.b64encode(inputFile).decode('ascii')
+	else:
+		request['inputFile'] = inputFile
+
+	httpRequest = Request('http://{0}:{1}/open_dif'.format(*address),
+							data=json.dumps(request).encode('utf-8'),
+							headers={'Content-Type': 'application/json'})
+	try:
+		with urlopen(httpRequest, timeout=timeout) as response:
+			result = json.loads(response.read().decode('utf-8'))
+	except HTTPError as e:
+		body = e.read().decode('utf-8', errors='replace')
+		try:
+			message = json.loads(body)['error']
+		except (ValueError, KeyError, TypeError):
+			# not from the server, say a proxy's error page
+			message = 'HTTP {0} {1}: {2}'.format(e.code, e.reason, body)
+		raise RuntimeError('requestOpenDif(): {0}'.format(message))
+
+	portValues.update(result['portValues'])
+	return result['files']
+
+
+
+
+if __name__ == '__main__':
+	import argparse
+	import logging.config
+	logging.config.fileConfig('logging.config', disable_existing_loggers=False)
+
+	parser = argparse.ArgumentParser(description='warm worker server for open_dif()')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--workers', type=int, default=2)
+	parser.add_argument('--timeout', type=float, default=60)
+	args = parser.parse_args()
+
+	server = DifServer(('127.0.0.1', args.port), args.workers, args.timeout)
+	logger.info('serving on {0}'.format(server.server_address))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
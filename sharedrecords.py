@@ -0,0 +1,398 @@
+# coding=utf-8
+#
+# Hand the records parsed in a worker process back to the parent through
+# shared memory, instead of pickling a list of dictionaries, which costs
+# about as much as parsing the file.
+#
+# The worker writes the records into one multiprocessing.shared_memory
+# block in a columnar layout, and returns only a small handle (the block's
+# name and where each column is). The parent maps the block, the columns
+# are NumPy arrays over the shared buffer, nothing is copied until the
+# records are asked for.
+#
+# The layout of a block, for n records and m distinct strings:
+#
+# 	for each field (in the order first seen in the records):
+# 		tags	int8[n], 0 = the record has no such field, 1 = float, 2 = str
+# 		floats	float64[n], the float values, if the field has any
+# 		codes	int32[n], index of the string values, if the field has any
+# 	offsets	int64[m+1], where each string starts in the text
+# 	text	the distinct strings, utf-8 encoded, one after another
+#
+# Record values are floats and strings only (see sectionToRecords()),
+# anything else raises TypeError. Each distinct string is stored once, the
+# same portfolio, date and currency repeat in every record.
+#
+# The parent owns the block once it gets the handle, it must open each
+# handle with SharedRecords and close it, which frees the block.
+#
+# Building the columns in the worker costs more than pickle.dumps(), and
+# SharedRecords.records() more than pickle.loads(), as both of those are
+# in C (see benchTransport() in benchmark.py). So it pays when the parent
+# uses the columns as arrays, its share of the work is then next to none
+# and does not grow with the number of records, while many workers can
+# build the columns in parallel. readFiles() therefore hands out the
+# blocks themselves, as SharedRecords, not records.
+#
+
+
+from dif_revised.dif import readFile
+from multiprocessing import shared_memory, resource_tracker
+from itertools import chain, groupby
+from operator import itemgetter
+from types import MappingProxyType
+import numpy as np
+import os, sys
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+
+MISSING, FLOAT, STRING = 0, 1, 2
+
+class Missing():
+	pass
+
+missing = Missing()		# the value of a field not in a record
+
+valueTags = MappingProxyType({Missing: MISSING, float: FLOAT, str: STRING})
+
+
+
+def align(offset, n=8):
+	return (offset + n - 1) // n * n
+
+
+
+def recordsToColumns(records):
+	"""
+	records: [list] records.
+
+	output: [dictionary] field -> [list] the field's value in each record,
+		missing where a record has no such field, fields in the order first
+		seen.
+
+	Consecutive records with the same fields, like the records of a
+	section, are turned into columns at once.
+	"""
+	fields = dict.fromkeys(chain.from_iterable(records))
+	parts = {field: [] for field in fields}
+	for (keys, run) in groupby(records, key=tuple):
+		run = list(run)
+		if len(keys) > 1:
+			values = zip(*map(itemgetter(*keys), run))
+		else:
+			values = [[record[key] for record in run] for key in keys]
+		for (field, column) in zip(keys, values):
+			parts[field].append(column)
+		for field in fields.keys() - set(keys):
+			parts[field].append([missing] * len(run))
+
+	return {field: list(chain.from_iterable(parts[field])) for field in fields}
+
+
+
+def toShared(records):
+	"""
+	records: [list] records, e.g., from readFile().
+
+	output: [dictionary] the handle of the shared memory block holding the
+		records, small enough to pickle cheaply, with keys name, size,
+		count (the number of records), fields (a list of (field, tags
+		offset, floats offset, codes offset), offset is None for an array
+		not there) and strings ((offsets offset, number of strings, text
+		offset, text size)).
+	"""
+	strings = {}
+	def encode(values):
+		for value in dict.fromkeys(values):
+			if not value in strings:
+				strings[value] = len(strings)
+		return list(map(strings.__getitem__, values))
+
+	columns = []
+	for (field, values) in recordsToColumns(records).items():
+		types = set(map(type, values))
+		if types == {float}:
+			tags, floats, codes = np.full(len(values), FLOAT, dtype=np.int8), values, None
+		elif types == {str}:
+			tags, floats, codes = np.full(len(values), STRING, dtype=np.int8), None, encode(values)
+		elif types <= set(valueTags):
+			tags = np.fromiter(map(valueTags.__getitem__, map(type, values)), np.int8,
+								len(values))
+			floats = np.array(values, dtype=object) if float in types else None
+			if floats is not None:
+				floats[tags != FLOAT] = 0.0
+			codes = np.array(values, dtype=object) if str in types else None
+			if codes is not None:
+				codes[tags != STRING] = ''
+				codes = encode(codes.tolist())
+		else:
+			raise TypeError('toShared(): field {0} has a {1} value, only float and str \
+are supported'.format(field, (types - set(valueTags)).pop().__name__))
+
+		columns.append((field, tags,
+						None if floats is None else np.asarray(floats, dtype=np.float64),
+						None if codes is None else np.array(codes, dtype=np.int32)))
+
+	encoded = [s.encode('utf-8') for s in strings]
+	text = b''.join(encoded)
+	offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+	np.cumsum([len(s) for s in encoded], out=offsets[1:])
+
+	# place the arrays, 8 byte aligned
+	size, placed = 0, []
+	def place(array):
+		nonlocal size
+		if array is None:
+			return None
+		offset = align(size)
+		placed.append((offset, array))
+		size = offset + array.nbytes
+		return offset
+
+	fieldHandles = [(field, place(tags), place(floats), place(codes)) \
+						for (field, tags, floats, codes) in columns]
+	offsetsAt = place(offsets)
+	textAt = size
+	size = size + len(text)
+
+	# the block outlives this process, the parent unlinks it, so the
+	# resource tracker must not remove it when this process exits
+	if sys.version_info >= (3, 13):
+		shm = shared_memory.SharedMemory(create=True, size=max(size, 1), track=False)
+	else:
+		shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+	try:
+		for (offset, array) in placed:
+			np.ndarray(array.shape, array.dtype, shm.buf, offset)[:] = array
+		shm.buf[textAt:textAt + len(text)] = text
+		handle = {'name': shm.name, 'size': size, 'count': len(records),
+					'fields': fieldHandles,
+					'strings': (offsetsAt, len(encoded), textAt, len(text))}
+	except:
+		shm.close()
+		shm.unlink()
+		raise
+
+	if sys.version_info < (3, 13) and os.name == 'posix':
+		# the tracker knows a block by its POSIX name, with a leading slash
+		resource_tracker.unregister('/' + shm.name, 'shared_memory')
+	shm.close()
+	return handle
+
+
+
+class SharedRecords():
+	"""
+	The records in a shared memory block, opened in the parent process
+	with the handle a worker got from toShared(). The parent owns the
+	block, close() frees it.
+
+	handle: the handle from toShared().
+
+	Use it as a context manager, or call close() when done. Arrays from
+	tags(), floats() and codes() are views of the shared block, copy them
+	to keep them after close().
+	"""
+	def __init__(self, handle):
+		self.handle = handle
+		self.count = handle['count']
+		self.shm = shared_memory.SharedMemory(name=handle['name'])
+		self.fields = {field: (tags, floats, codes) for (field, tags, floats, codes) \
+						in handle['fields']}
+		self.strings = None
+
+
+	def __len__(self):
+		return self.count
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+	def array(self, offset, dtype, count):
+		return np.ndarray((count,), dtype, self.shm.buf, offset)
+
+
+	def tags(self, field):
+		"""
+		output: [array] int8, the value type of the field in each record,
+			MISSING, FLOAT or STRING.
+		"""
+		return self.array(self.fields[field][0], np.int8, self.count)
+
+
+	def floats(self, field):
+		"""
+		output: [array] float64, the value of the field in each record, NaN
+			where the value is not a float. No copy if all values are floats.
+		"""
+		tags, floats, codes = self.fields[field]
+		if floats is None:
+			return np.full(self.count, np.nan)
+		values = self.array(floats, np.float64, self.count)
+		if codes is None and not (self.tags(field) == MISSING).any():
+			return values
+		return np.where(self.tags(field) == FLOAT, values, np.nan)
+
+
+	def codes(self, field):
+		"""
+		output: [array] int32, the index of the field's string value in
+			stringTable() in each record, -1 where the value is not a string.
+		"""
+		tags, floats, codes = self.fields[field]
+		if codes is None:
+			return np.full(self.count, -1, dtype=np.int32)
+		return np.where(self.tags(field) == STRING, self.array(codes, np.int32, self.count), -1)
+
+
+	def stringTable(self):
+		"""
+		output: [list] the distinct strings, decoded once.
+		"""
+		if self.strings is None:
+			offsetsAt, n, textAt, textSize = self.handle['strings']
+			offsets = self.array(offsetsAt, np.int64, n + 1).tolist() if n > 0 else [0]
+			text = bytes(self.shm.buf[textAt:textAt + textSize])
+			self.strings = [text[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(n)]
+		return self.strings
+
+
+	def column(self, field):
+		"""
+		output: [list] the value of the field in each record, None where
+			the record has no such field.
+		"""
+		return [None if value is missing else value for value in self.values(field)]
+
+
+	def values(self, field):
+		tags, floats, codes = self.fields[field]
+		tagList = self.tags(field).tolist()
+		if floats is not None:
+			floatValues = self.array(floats, np.float64, self.count).tolist()
+		if codes is not None:
+			strings = self.stringTable()
+			stringValues = [strings[code] for code in self.array(codes, np.int32, self.count).tolist()]
+
+		if floats is None and codes is None:
+			return [missing] * self.count
+		elif codes is None:
+			values = floatValues
+		elif floats is None:
+			values = stringValues
+		else:
+			values = [f if tag == FLOAT else s for (tag, f, s) \
+						in zip(tagList, floatValues, stringValues)]
+
+		if MISSING in tagList:
+			values = [missing if tag == MISSING else value for (tag, value) \
+						in zip(tagList, values)]
+		return values
+
+
+	def records(self):
+		"""
+		output: [list] the records as dictionaries, equal to the records
+			given to toShared(). The fields of a record are in the order
+			the fields were first seen in all records.
+
+		Records with the same set of fields are built the same way, the
+		records of a section all have the same fields.
+		"""
+		names = list(self.fields)
+		if self.count == 0 or len(names) == 0:
+			return [{} for i in range(self.count)]
+
+		def builder(positions):
+			if len(positions) == 1:
+				getter = lambda row: (row[positions[0]],)
+			else:
+				getter = itemgetter(*positions) if positions else (lambda row: ())
+			return [names[i] for i in positions], getter
+
+		present = np.array([self.tags(field) for field in names]).T != MISSING
+		shapes, builders = {}, []	# the fields of a record (as bits) -> builder
+		for (i, key) in enumerate(map(bytes, np.packbits(present, axis=1))):
+			if not key in shapes:
+				shapes[key] = builder(np.flatnonzero(present[i]).tolist())
+			builders.append(shapes[key])
+
+		def toRecord(row, builder):
+			fieldNames, getter = builder
+			return dict(zip(fieldNames, getter(row)))
+
+		return list(map(toRecord, zip(*[self.values(field) for field in names]), builders))
+
+
+
+	def close(self):
+		"""
+		Unmap and free the shared block.
+		"""
+		if self.shm is None:
+			return
+		self.shm.close()
+		self.shm.unlink()
+		self.shm = None
+
+
+
+def readFileToShared(file, fxTable=None):
+	"""
+	Same as readFile(), but the records are returned as a handle of a
+	shared memory block, see toShared(). To be run in a worker process,
+	like:
+
+		handle, summary = executor.submit(readFileToShared, file).result()
+		with SharedRecords(handle) as shared:
+			records = shared.records()
+
+	fxTable: [dictionary] if given, populated as in readFile(), only of use
+		in the same process though.
+	"""
+	records, summary = readFile(file, fxTable)
+	return toShared(records), summary
+
+
+
+def readFiles(files, executor, progress=None):
+	"""
+	files: [list] files to read, see readFile().
+	executor: a concurrent.futures.ProcessPoolExecutor.
+	progress: a Progress object (see progress.py), if given, each file is
+		added to it when taken, and Cancelled is raised before the next
+		file when it is cancelled.
+
+	output: [generator] (file, shared, summary) of each file, in the order
+		of files, where shared is the file's records as a SharedRecords,
+		open until the next file is taken, so the columns are used where
+		they are, nothing is copied. Copy the arrays (or call records())
+		to keep them. A file that fails to read raises when its turn comes.
+
+	Use it to work on columns across many files, to get the records as
+	dictionaries, readFile() in the workers and pickling is faster.
+	"""
+	futures = [executor.submit(readFileToShared, file) for file in files]
+	taken = 0
+	try:
+		for (file, future) in zip(files, futures):
+			if progress is not None:
+				progress.check()
+			taken = taken + 1
+			handle, summary = future.result()
+			with SharedRecords(handle) as shared:
+				if progress is not None:
+					progress.update(files=1)
+				yield file, shared, summary
+	finally:
+		# free the blocks of the files not taken, when stopped early
+		for future in futures[taken:]:
+			if not future.cancel() and future.exception() is None:
+				SharedRecords(future.result()[0]).close()
@@ -0,0 +1,95 @@
+# coding=utf-8
+#
+
+import unittest2
+import numpy as np
+from os.path import join
+from itertools import chain
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+from dif_revised.accrual import checkBonds, accruedInterest, days30
+
+
+
+class TestAccrual(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestAccrual, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestAccrual):
+		"""
+		Called only once before all tests
+		"""
+		TestAccrual.records = list(chain(*[readFile(join(get_current_path(), 'samples', f))[0] \
+			for f in ['CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']]))
+
+
+
+	def testDayCount(self):
+		start = np.array(['2017-05-10', '2018-01-31', '2018-02-28'], dtype='datetime64[D]')
+		end = np.array(['2017-10-25', '2018-03-31', '2018-05-31'], dtype='datetime64[D]')
+		self.assertEqual(list(days30(start, end)), [165, 60, 93])
+		self.assertEqual(list(accruedInterest(np.array([400000.0]), np.array([0.055]),
+			start[:1], end[:1], '30/360')), [400000 * 0.055 * 165 / 360])
+		self.assertEqual(list(accruedInterest(np.array([100.0]), np.array([0.05]),
+			end[:1], start[:1])), [0])
+
+
+
+	def testSamples(self):
+		outliers = checkBonds(TestAccrual.records)
+		# two US treasuries off by a few dollars, the rest match a day count
+		self.assertEqual([(o['isin'], o['field']) for o in outliers],
+			[('US912828S687', 'accrued_interest'), ('US912828UE89', 'accrued_interest')])
+		self.assertAlmostEqual(outliers[0]['difference'], 4.08, 2)
+		self.assertEqual(outliers[0]['day_count'], '30/360')
+		self.assertEqual(checkBonds(TestAccrual.records, {'accrued_interest': 5}), [])
+		self.assertEqual(checkBonds([]), [])
+
+
+
+	def testOutliers(self):
+		records = [dict(r) for r in TestAccrual.records if r['portfolio'] == '30004' \
+					and r['valuation_date'] == '2018-5-31' and r['type'] == 'bond']
+		records[0]['accrued_interest'] = records[0]['accrued_interest'] + 2000
+		records[1]['amortized_value'] = records[1]['amortized_value'] + 100
+		records[1]['amortized_gain_loss'] = records[1]['amortized_gain_loss'] + 100
+		records[0]['amortized_cost'] = 101.0
+		records[0]['amortized_value'] = records[0]['quantity'] * 1.01
+
+		outliers = checkBonds(records)
+		self.assertEqual([(o['isin'], o['field']) for o in outliers],
+			[('XS0508012092', 'accrued_interest'), ('USG59606AA46', 'amortized_value'),
+			('XS0508012092', 'amortized_gain_loss'), ('XS0508012092', 'amortized_cost')])
+		self.assertAlmostEqual(outliers[0]['difference'], 2000 - 400000 * 0.055 / 360, 2)
+		self.assertAlmostEqual(outliers[3]['computed'], 100)
+
+
+
+	def testConventions(self):
+		# the isin's day count takes precedence over its portfolio's
+		outliers = checkBonds(TestAccrual.records,
+					conventions={'30004': 'act/360', 'XS1389124774': 'act/360 +1 day'})
+		self.assertEqual([(o['portfolio'], o['isin'], o['expected_day_count']) for o in outliers[:2]],
+			[('30004', 'XS1810003332', 'act/360'), ('30003', 'XS1389124774', 'act/360 +1 day')])
+		self.assertEqual(outliers[1]['day_count'], '30/360 +1 day')
+		self.assertEqual(len(outliers), 4)
+
+		with self.assertRaises(ValueError):
+			checkBonds(TestAccrual.records, conventions={'30004': 'act/366'})
+
+
+
+	def testConventionChanged(self):
+		# on one date the figure matches act/365, not the bond's usual act/360
+		records = [dict(r) for r in TestAccrual.records]
+		for r in records:
+			if r.get('isin') == 'USG59606AA46' and r['valuation_date'] == '2018-5-31':
+				r['accrued_interest'] = 1041.1
+
+		outliers = checkBonds(records)
+		self.assertEqual((outliers[0]['isin'], outliers[0]['valuation_date']),
+							('USG59606AA46', '2018-5-31'))
+		self.assertEqual((outliers[0]['day_count'], outliers[0]['expected_day_count']),
+							('act/365', 'act/360'))
+		self.assertAlmostEqual(outliers[0]['difference'], 1041.1 - 1055.56, 2)
@@ -0,0 +1,207 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, os, json, time
+from os.path import join
+from datetime import date
+from dif_revised.utility import get_current_path
+from dif_revised.backfill import backfill, listInputs, readJournal, exportFile
+import dif_revised.backfill
+from dif_revised.progress import Progress
+from xlrd import open_workbook
+from dif_revised.dif import worksheetToLines
+from test_bulk import brokenSample, saveXlsx
+
+
+
+def crashingExport(args):
+	"""
+	Kills the worker process on the GNT file, like running out of memory.
+	"""
+	if 'GNT' in args[0]:
+		os._exit(1)
+	return exportFile(args)
+
+
+
+def slowExport(args):
+	if '2017-07-27' in args[0]:
+		time.sleep(1.5)
+	return exportFile(args)
+
+
+
+class TestBackfill(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestBackfill, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		self.inputDir = tempfile.mkdtemp()
+		self.outputDir = tempfile.mkdtemp()
+		os.mkdir(join(self.inputDir, '2018'))
+		for (fileName, directory) in [('CLM BAL 2017-07-27.xls', ''),
+										('CLM GNT 2017-10-25.xls', ''),
+										('CLM BAL 2018-05-31.xls', '2018')]:
+			shutil.copy(join(get_current_path(), 'samples', fileName),
+						join(self.inputDir, directory, fileName))
+
+		with open(join(self.inputDir, '2018', 'CLM BAL 2018-06-01.xls'), 'wb') as f:
+			f.write(b'not an Excel file')
+
+	def tearDown(self):
+		shutil.rmtree(self.inputDir)
+		shutil.rmtree(self.outputDir)
+
+
+
+	def testListInputs(self):
+		files = listInputs(self.inputDir)
+		self.assertEqual([os.path.basename(f) for f in files],
+			['CLM BAL 2017-07-27.xls', 'CLM GNT 2017-10-25.xls',
+			'CLM BAL 2018-05-31.xls', 'CLM BAL 2018-06-01.xls'])
+		self.assertEqual(len(listInputs(self.inputDir, date(2017, 8, 1), date(2018, 5, 31))), 2)
+
+
+
+	def testResume(self):
+		files = listInputs(self.inputDir)
+		reports = []
+		result = backfill(files, self.outputDir, 'clm', workers=2, report=reports.append)
+		self.assertEqual(result['done'], 3)
+		self.assertEqual(result['failed'], 1)
+		self.assertEqual(len(reports), 4)
+		self.assertEqual(reports[-1]['eta'], 0)
+		self.assertEqual(result['log_counts'], {'type not in summary': 3})
+
+		journal = readJournal(join(self.outputDir, 'backfill_journal.jsonl'))
+		self.assertEqual(len(journal), 4)
+		self.assertEqual(journal[files[0]]['portValues']['portfolio'], '30004')
+		self.assertEqual(journal[files[3]]['status'], 'error')
+
+		# a run interrupted while writing the journal
+		with open(join(self.outputDir, 'backfill_journal.jsonl'), 'a') as f:
+			f.write('{"file": "')
+
+		result = backfill(files, self.outputDir, 'clm', workers=2)
+		self.assertEqual(result['skipped'], 4)
+		self.assertEqual(result['done'], 0)
+
+		result = backfill(files, self.outputDir, 'clm', workers=2, retryFailed=True)
+		self.assertEqual(result['skipped'], 3)
+		self.assertEqual(result['failed'], 1)
+		journal = readJournal(join(self.outputDir, 'backfill_journal.jsonl'))
+		self.assertEqual(len(journal), 4)
+
+
+
+	def testQuarantine(self):
+		lines, summaryLines = brokenSample()
+		brokenFile = join(self.inputDir, '2018', 'CLM GNT 2018-06-01.xlsx')
+		saveXlsx(brokenFile, [('Portfolio Val.', lines), ('Portfolio Sum.', summaryLines)])
+
+		result = backfill(listInputs(self.inputDir), self.outputDir, 'clm', workers=2)
+		self.assertEqual((result['done'], result['failed']), (3, 2))
+
+		quarantineDir = join(self.outputDir, 'quarantine')
+		self.assertEqual(sorted(os.listdir(quarantineDir)),
+			['CLM BAL 2018-06-01.xls', 'CLM GNT 2018-06-01.xlsx', 'error_report.jsonl'])
+		with open(join(quarantineDir, 'error_report.jsonl'), encoding='utf-8') as f:
+			report = [json.loads(line) for line in f]
+
+		# the broken file has all its bad sections reported
+		self.assertEqual([(os.path.basename(e['file']), e['stage'], e['error']) for e in report],
+			[('CLM BAL 2018-06-01.xls', 'file', 'XLRDError'),
+			('CLM GNT 2018-06-01.xlsx', 'section', 'KeyError'),
+			('CLM GNT 2018-06-01.xlsx', 'section', 'ValueError')])
+		self.assertEqual(report[1]['quarantined_as'], join(quarantineDir, 'CLM GNT 2018-06-01.xlsx'))
+
+		journal = readJournal(join(self.outputDir, 'backfill_journal.jsonl'))
+		self.assertEqual(len(journal[os.path.abspath(brokenFile)]['errors']), 2)
+
+
+
+	def testSameDate(self):
+		"""
+		The balanced and growth funds, both for 2018-05-31, must not
+		overwrite each other's csv files.
+		"""
+		wb = open_workbook(join(get_current_path(), 'samples', 'CLM BAL 2018-05-31.xls'))
+		sheets = [(name, worksheetToLines(wb.sheet_by_name(name))) \
+					for name in ['Portfolio Val.', 'Portfolio Sum.']]
+		for (name, lines) in sheets:
+			for line in lines:
+				if isinstance(line[0], str) and line[0].startswith('Fund Name'):
+					line[0] = line[0].replace('BALANCED ', 'GROWTH ')
+		growthFile = join(self.inputDir, '2018', 'CLM GRW 2018-05-31.xlsx')
+		saveXlsx(growthFile, sheets)
+
+		files = [join(self.inputDir, '2018', 'CLM BAL 2018-05-31.xls'), growthFile]
+		result = backfill(files, self.outputDir, 'clm', workers=2)
+		self.assertEqual((result['done'], result['failed']), (2, 0))
+
+		journal = readJournal(join(self.outputDir, 'backfill_journal.jsonl'))
+		outputs = [journal[os.path.abspath(f)]['outputs'] for f in files]
+		self.assertEqual([os.path.basename(f[1]) for f in outputs],
+			['clm30004_2018-5-31_afs_positions.csv', 'clm30005_2018-5-31_afs_positions.csv'])
+		self.assertEqual(sorted(f for f in os.listdir(self.outputDir) if f.endswith('.csv')),
+			sorted(os.path.basename(f) for f in outputs[0] + outputs[1]))
+
+
+
+	def testCancel(self):
+		files = listInputs(self.inputDir)
+		progress = Progress(lambda snapshot: progress.cancel(), interval=3600)
+		result = backfill(files, self.outputDir, 'clm', workers=1, progress=progress)
+		self.assertTrue(result['cancelled'])
+		self.assertEqual((result['done'], result['failed']), (1, 0))
+		self.assertEqual(progress.files, 1)
+		self.assertGreater(progress.sections, 10)
+		self.assertGreater(progress.rowsWritten, 3)
+		self.assertEqual(sorted(f for f in os.listdir(self.outputDir) if f.endswith('.csv')),
+			['clm30004_2017-7-27_afs_positions.csv', 'clm30004_2017-7-27_cash.csv',
+			'clm30004_2017-7-27_htm_positions.csv'])
+		self.assertEqual([f for f in os.listdir(self.outputDir) if f.endswith('.tmp')], [])
+
+		# the next run does the rest
+		result = backfill(files, self.outputDir, 'clm', workers=1, progress=Progress())
+		self.assertFalse(result['cancelled'])
+		self.assertEqual((result['skipped'], result['done'], result['failed']), (1, 2, 1))
+
+
+
+	def runWith(self, export, **kwargs):
+		"""
+		backfill() with the workers running export instead of exportFile(),
+		the workers are forked so they see it.
+		"""
+		dif_revised.backfill.exportFile = export
+		try:
+			return backfill(listInputs(self.inputDir), self.outputDir, 'clm', **kwargs)
+		finally:
+			dif_revised.backfill.exportFile = exportFile
+
+
+
+	def testWorkerDied(self):
+		result = self.runWith(crashingExport, workers=2)
+		self.assertEqual((result['done'], result['failed']), (2, 2))
+		journal = readJournal(join(self.outputDir, 'backfill_journal.jsonl'))
+		self.assertEqual(len(journal), 4)
+		failed = {os.path.basename(f): entry for (f, entry) in journal.items() \
+					if entry['status'] == 'error'}
+		self.assertEqual(sorted(failed), ['CLM BAL 2018-06-01.xls', 'CLM GNT 2017-10-25.xls'])
+		self.assertTrue(failed['CLM GNT 2017-10-25.xls']['error'].startswith('BrokenProcessPool'))
+
+		# the next run, with the worker fixed, does the failed ones
+		result = backfill(listInputs(self.inputDir), self.outputDir, 'clm', workers=2,
+							retryFailed=True)
+		self.assertEqual((result['skipped'], result['done'], result['failed']), (2, 1, 1))
+
+
+
+	def testSlowFile(self):
+		result = self.runWith(slowExport, workers=2)
+		self.assertEqual((result['done'], result['failed']), (3, 1))
+		with open(join(self.outputDir, 'backfill_journal.jsonl'), encoding='utf-8') as f:
+			order = [os.path.basename(json.loads(line)['file']) for line in f]
+		self.assertEqual(order[-1], 'CLM BAL 2017-07-27.xls')
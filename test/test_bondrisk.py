@@ -0,0 +1,132 @@
+# coding=utf-8
+#
+
+import unittest2, calendar
+from os.path import join
+from datetime import date
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, toDate
+from dif_revised.bondrisk import bondRisk, dv01Buckets
+
+
+
+def loopYield(record, frequency=2):
+	"""
+	The yield of one bond by bisection, coupon by coupon, to check the
+	vectorized one.
+	"""
+	def addMonths(dt, months):
+		year, month = divmod(dt.month - 1 + months, 12)
+		year, month = dt.year + year, month + 1
+		return date(year, month, min(dt.day, calendar.monthrange(year, month)[1]))
+
+	start, maturity = toDate(record['coupon_start_date']), toDate(record['maturity_date'])
+	valuationDate = toDate(record['valuation_date'])
+	flows, k = [], 1
+	while True:
+		dt = addMonths(start, k * 12 // frequency)
+		last = (dt.year, dt.month) >= (maturity.year, maturity.month)
+		if last:
+			dt = maturity
+		if dt > valuationDate:
+			flows.append(((dt - valuationDate).days / 365,
+							100 * record['coupon_rate'] / frequency + (100 if last else 0)))
+		if last:
+			break
+		k = k + 1
+
+	price = record['amortized_cost'] if record['accounting'] == 'htm' else record['price']
+	dirty = price + record['accrued_interest'] / record['quantity'] * 100
+	def value(y):
+		return sum(cf / (1 + y / frequency) ** (frequency * t) for (t, cf) in flows)
+
+	low, high = -0.5, 1.0
+	for i in range(200):
+		middle = (low + high) / 2
+		if value(middle) > dirty:
+			low = middle
+		else:
+			high = middle
+	return (low + high) / 2
+
+
+
+def bond(**fields):
+	record = {'type': 'bond', 'portfolio': '30005', 'valuation_date': '2018-6-30',
+				'isin': 'XS0000000001', 'accounting': 'afs', 'currency': 'USD',
+				'quantity': 1000000.0, 'coupon_rate': 0.05, 'coupon_start_date': '2018-6-30',
+				'maturity_date': '2023-6-30', 'price': 100.0, 'accrued_interest': 0.0,
+				'exchange_rate': 8.0}
+	record.update(fields)
+	return record
+
+
+
+class TestBondRisk(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestBondRisk, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestBondRisk):
+		"""
+		Called only once before all tests
+		"""
+		TestBondRisk.records = []
+		for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls',
+							'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']:
+			TestBondRisk.records.extend(readFile(join(get_current_path(), 'samples', fileName))[0])
+
+
+
+	def testSameAsLoop(self):
+		bonds = [r for r in TestBondRisk.records if r['type'] == 'bond']
+		risk = bondRisk(TestBondRisk.records)
+		self.assertEqual(len(risk), len(bonds))
+		for (r, b) in zip(risk, bonds):
+			self.assertTrue(r['converged'])
+			self.assertEqual(r['isin'], b['isin'])
+			self.assertAlmostEqual(r['yield'], loopYield(b), 8)
+
+
+
+	def testParBond(self):
+		# annual coupons, no leap years, each period is exactly one year
+		risk = bondRisk([bond(valuation_date='2021-1-1', coupon_start_date='2021-1-1',
+							maturity_date='2024-1-1')], frequency=1)
+		self.assertAlmostEqual(risk[0]['yield'], 0.05, 10)
+
+		risk = bondRisk([bond(), bond(isin='XS0000000002', coupon_rate=0.0,
+							coupon_start_date='2018-6-30', maturity_date='2019-6-30',
+							price=100 / 1.025 ** 2)])
+		self.assertAlmostEqual(risk[1]['yield'], 0.05, 10)
+
+		# a zero coupon bond's macaulay duration is its maturity
+		self.assertAlmostEqual(risk[1]['macaulay_duration'], 365 / 365, 10)
+		self.assertAlmostEqual(risk[1]['modified_duration'], 1 / 1.025, 10)
+		self.assertAlmostEqual(risk[1]['dv01'],
+			risk[1]['modified_duration'] * risk[1]['dirty_price'] / 100 * 1000000 * 0.0001)
+		self.assertAlmostEqual(risk[1]['dv01_base'], risk[1]['dv01'] * 8.0)
+
+
+
+	def testMatured(self):
+		risk = bondRisk([bond(maturity_date='2018-6-1')])
+		self.assertFalse(risk[0]['converged'])
+		self.assertNotEqual(risk[0]['yield'], risk[0]['yield'])	# NaN
+		self.assertEqual(dv01Buckets(risk)[0]['dv01'], 0.0)
+
+
+
+	def testBuckets(self):
+		risk = bondRisk(TestBondRisk.records)
+		buckets = dv01Buckets(risk)
+		self.assertEqual(sum(b['bonds'] for b in buckets), len(risk))
+		for b in buckets:
+			members = [r for r in risk if (r['valuation_date'], r['portfolio'], r['currency'],
+						r['accounting']) == (b['valuation_date'], b['portfolio'], b['currency'],
+						b['accounting'])]
+			self.assertAlmostEqual(b['dv01'], sum(r['dv01'] for r in members), 6)
+			self.assertAlmostEqual(b['dv01_base'], sum(r['dv01_base'] for r in members), 6)
+
+		self.assertEqual(bondRisk([]), [])
+		self.assertEqual(dv01Buckets([]), [])
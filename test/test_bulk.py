@@ -0,0 +1,111 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, os
+from os.path import join
+from openpyxl import Workbook, load_workbook
+from xlrd import open_workbook
+from concurrent.futures import ProcessPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, readHolding, worksheetToLines, BadInput
+from dif_revised.geneva import open_dif
+
+
+
+def brokenSample(fileName='CLM GNT 2017-10-25.xls'):
+	"""
+	output: (holding lines, summary lines) of the sample, with an unknown
+		header in the first bond section, and an equity without its id.
+	"""
+	wb = open_workbook(join(get_current_path(), 'samples', fileName))
+	lines = worksheetToLines(wb.sheet_by_name('Portfolio Val.'))
+	summaryLines = worksheetToLines(wb.sheet_by_name('Portfolio Sum.'))
+
+	header = [i for i in range(len(lines)) if 'Par Amt' in lines[i]][0]
+	lines[header][lines[header].index('Par Amt')] = 'Par Amount'
+
+	equity = [i for i in range(len(lines)) if isinstance(lines[i][0], str) \
+				and lines[i][0].startswith('(H0')][0]
+	lines[equity][0] = 'Tencent without its id'
+	return lines, summaryLines
+
+
+
+def saveXlsx(file, sheets):
+	wb = Workbook()
+	wb.remove(wb.active)
+	for (name, lines) in sheets:
+		ws = wb.create_sheet(name)
+		for line in lines:
+			ws.append([None if value == '' else value for value in line])
+	wb.save(file)
+
+
+
+class TestBulk(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestBulk, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestBulk):
+		"""
+		Called only once before all tests
+		"""
+		TestBulk.lines, TestBulk.summaryLines = brokenSample()
+		TestBulk.tempDir = tempfile.mkdtemp()
+		TestBulk.brokenFile = join(TestBulk.tempDir, 'CLM GNT 2017-10-25.xlsx')
+		saveXlsx(TestBulk.brokenFile, [('Portfolio Val.', TestBulk.lines),
+										('Portfolio Sum.', TestBulk.summaryLines)])
+		TestBulk.brokenSheet = load_workbook(TestBulk.brokenFile)['Portfolio Val.']
+
+	@classmethod
+	def tearDownClass(TestBulk):
+		shutil.rmtree(TestBulk.tempDir)
+
+
+
+	def testStrict(self):
+		with self.assertRaises(KeyError):
+			readHolding(TestBulk.brokenSheet)
+		with self.assertRaises(KeyError):
+			readFile(TestBulk.brokenFile)
+
+
+
+	def testSections(self):
+		records, _ = readFile(join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls'))
+		errors = []
+		partial = readHolding(TestBulk.brokenSheet, errors=errors)
+		self.assertEqual([(e['stage'], e['error']) for e in errors],
+			[('section', 'KeyError'), ('section', 'ValueError')])
+		self.assertTrue(errors[0]['section'].startswith('IV. Debt Securities'))
+		self.assertIn('Par Amount', errors[0]['message'])
+		self.assertTrue(errors[1]['section'].startswith('VI. Equities'))
+
+		# records of the other sections are there, openpyxl keeps floats
+		# shorter, so they are compared with those of the same file
+		self.assertEqual(partial, readFile(TestBulk.brokenFile, errors=[])[0])
+		self.assertEqual(partial[0]['description'], records[0]['description'])
+		self.assertTrue(0 < len(partial) < len(records))
+
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			parallelErrors = []
+			self.assertEqual(readHolding(TestBulk.brokenSheet, executor=executor,
+							errors=parallelErrors), partial)
+		self.assertEqual(parallelErrors, errors)
+
+
+
+	def testFile(self):
+		errors = []
+		records, summary = readFile(TestBulk.brokenFile, errors=errors)
+		self.assertEqual([e['error'] for e in errors], ['KeyError', 'ValueError'])
+		self.assertEqual(summary['nav'], readFile(join(get_current_path(), 'samples',
+							'CLM GNT 2017-10-25.xls'))[1]['nav'])
+
+		outputDir = join(TestBulk.tempDir, 'output')
+		os.mkdir(outputDir)
+		with self.assertRaises(BadInput) as context:
+			open_dif(TestBulk.brokenFile, {}, outputDir, 'test', strict=False)
+		self.assertEqual(context.exception.errors, errors)
+		self.assertEqual(os.listdir(outputDir), [])
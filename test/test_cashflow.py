@@ -0,0 +1,91 @@
+# coding=utf-8
+#
+
+import unittest2, calendar
+from os.path import join
+from itertools import chain
+from datetime import date
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, toDate
+from dif_revised.cashflow import cashFlowLadder
+
+
+
+def loopLadder(records, frequency=2):
+	"""
+	The same ladder as cashFlowLadder(), bond by bond and coupon by coupon.
+	"""
+	def addMonths(dt, months):
+		year, month = divmod(dt.month - 1 + months, 12)
+		year, month = dt.year + year, month + 1
+		return date(year, month, min(dt.day, calendar.monthrange(year, month)[1]))
+
+	ladder = {}
+	for record in filter(lambda r: r['type'] == 'bond' and r['accounting'] == 'htm', records):
+		start, maturity = toDate(record['coupon_start_date']), toDate(record['maturity_date'])
+		valuationDate = toDate(record['valuation_date'])
+		k = 1
+		while True:
+			dt = min(addMonths(start, k * 12 // frequency), maturity)
+			if dt > valuationDate:
+				key = (valuationDate.isoformat(), record['portfolio'], record['currency'],
+						dt.strftime('%Y-%m'))
+				coupon, redemption = ladder.get(key, (0, 0))
+				ladder[key] = (coupon + record['quantity'] * record['coupon_rate'] / frequency,
+								redemption + (record['quantity'] if dt == maturity else 0))
+			if dt == maturity:
+				break
+			k = k + 1
+
+	return [key + value for (key, value) in sorted(ladder.items())]
+
+
+
+class TestCashFlow(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestCashFlow, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestCashFlow):
+		"""
+		Called only once before all tests
+		"""
+		TestCashFlow.records = list(chain(*[readFile(join(get_current_path(), 'samples', f))[0] \
+			for f in ['CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls',
+						'CLM GNT 2017-10-25.xls', 'CL Franklin DIF 2018-07-24.xls']]))
+
+
+
+	def testBalanced(self):
+		ladder = list(filter(lambda r: r['valuation_date'] == '2018-05-31', \
+							cashFlowLadder(TestCashFlow.records)))
+		# two bonds: 5.5% to 2020-11-10 and 5% to 2021-5-12, 400,000 each
+		self.assertEqual([r['month'] for r in ladder],
+			['2018-11', '2019-05', '2019-11', '2020-05', '2020-11', '2021-05'])
+		self.assertAlmostEqual(ladder[0]['coupon'], 21000)
+		self.assertEqual(ladder[0]['redemption'], 0)
+		self.assertAlmostEqual(ladder[4]['total'], 411000 + 10000)
+		self.assertAlmostEqual(ladder[5]['total'], 410000)
+		self.assertAlmostEqual(ladder[5]['total_base'], 410000 * 8.081477972524869, 2)
+		self.assertEqual(ladder[0]['portfolio'], '30004')
+		self.assertEqual(ladder[0]['currency'], 'USD')
+
+
+
+	def testSameAsLoop(self):
+		ladder = cashFlowLadder(TestCashFlow.records)
+		expected = loopLadder(TestCashFlow.records)
+		self.assertEqual(len(ladder), len(expected))
+		for (row, e) in zip(ladder, expected):
+			self.assertEqual((row['valuation_date'], row['portfolio'], row['currency'],
+								row['month']), e[:4])
+			self.assertAlmostEqual(row['coupon'], e[4], 4)
+			self.assertAlmostEqual(row['redemption'], e[5], 4)
+
+
+
+	def testHorizon(self):
+		ladder = cashFlowLadder(TestCashFlow.records, horizon=12)
+		self.assertTrue(all(r['month'] <= '2019-07' for r in ladder))
+		self.assertTrue(len(ladder) < len(cashFlowLadder(TestCashFlow.records)))
+		self.assertEqual(cashFlowLadder([]), [])
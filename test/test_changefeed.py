@@ -0,0 +1,98 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, json
+from os.path import join
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+from dif_revised.changefeed import ChangeFeed, changeFeed, snapshot, diffSnapshots, \
+									writeChanges
+
+
+
+def readSample(fileName):
+	return readFile(join(get_current_path(), 'samples', fileName))[0]
+
+
+
+class TestChangeFeed(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestChangeFeed, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestChangeFeed):
+		"""
+		Called only once before all tests
+		"""
+		TestChangeFeed.bal = [readSample(f) for f in \
+								['CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls']]
+		TestChangeFeed.dif = [readSample(f) for f in \
+								['CL Franklin DIF 2018-05-28(2nd Revised).xls',
+								'CL Franklin DIF 2018-07-24.xls']]
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+
+
+	def testDiff(self):
+		changes = diffSnapshots(*map(snapshot, TestChangeFeed.bal))
+		self.assertEqual(len(changes), 40)
+		byId = {(c['type'], c['id'], c['currency']): c for c in changes}
+
+		bond = byId[('bond', 'XS1810003332', 'USD')]
+		self.assertEqual((bond['change'], bond['accounting'], bond['delta']), ('new', 'afs', 200000))
+		self.assertEqual((bond['previous_date'], bond['date']), ('2017-7-27', '2018-5-31'))
+
+		equity = byId[('equity', '1530 HK', 'HKD')]
+		self.assertEqual((equity['change'], equity['before'], equity['after']), ('closed', 99000, 0))
+
+		cash = byId[('cash', 'ICBC (Macau) Ltd', 'MOP')]
+		self.assertEqual((cash['kind'], cash['change']), ('cash', 'changed'))
+		self.assertAlmostEqual(cash['delta'], 325357.84 - 2678374.76, 2)
+
+		# HTM bonds are held all along, no change
+		self.assertFalse(any(c['accounting'] == 'htm' for c in changes))
+		self.assertEqual(diffSnapshots(snapshot(TestChangeFeed.bal[0]),
+							snapshot(TestChangeFeed.bal[0])), [])
+
+
+
+	def testIncremental(self):
+		expected = list(changeFeed([TestChangeFeed.bal[0], TestChangeFeed.dif[0],
+									TestChangeFeed.bal[1], TestChangeFeed.dif[1]]))
+		self.assertEqual(len(expected), 164)
+
+		# one file a day, a new feed each day, continued from the state file
+		stateFile = join(self.tempDir, 'state.json')
+		changes = []
+		for records in [TestChangeFeed.bal[0], TestChangeFeed.dif[0],
+						TestChangeFeed.bal[1], TestChangeFeed.dif[1]]:
+			changes.extend(ChangeFeed(stateFile).add(records))
+		self.assertEqual(changes, expected)
+
+		with self.assertRaises(ValueError):
+			ChangeFeed(stateFile).add(TestChangeFeed.bal[0])
+
+
+
+	def testWrite(self):
+		changes = diffSnapshots(*map(snapshot, TestChangeFeed.bal))
+		file = join(self.tempDir, 'changes.jsonl')
+		self.assertEqual(writeChanges(file, changes), 40)
+		writeChanges(file, changes[:5])
+		with open(file, encoding='utf-8') as f:
+			lines = f.readlines()
+		self.assertEqual(len(lines), 45)
+		self.assertEqual(json.loads(lines[0]), changes[0])
+
+		file = join(self.tempDir, 'changes.csv')
+		writeChanges(file, changes, 'csv')
+		writeChanges(file, changes[:5], 'csv')
+		with open(file, encoding='utf-8') as f:
+			lines = f.readlines()
+		self.assertEqual(len(lines), 46)	# a header only once
+		self.assertTrue(lines[0].startswith('portfolio,previous_date,date'))
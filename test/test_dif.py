@@ -5,7 +5,8 @@ import unittest2
 from os.path import join
 from xlrd import open_workbook
 from dif_revised.utility import get_current_path
-from dif_revised.dif import readHolding, readSummary, validate
+from dif_revised.dif import readHolding, readSummary, validate, readFile, validateFields, \
+								matchSection, sectionAccounting
 
 
 
@@ -124,6 +125,70 @@ class TestDif(unittest2.TestCase):
 
 
 
+	def testFields(self):
+		file = join(get_current_path(), 'samples',
+						'CL Franklin DIF 2018-05-28(2nd Revised).xls')
+		ws = open_workbook(filename=file).sheet_by_name('Portfolio Val.')
+		fields = ['type', 'isin', 'ticker', 'maturity_date', 'portfolio']
+		records = readHolding(ws, fields=fields)
+		self.assertEqual(records, [{key: value for (key, value) in r.items() if key in fields} \
+									for r in TestDif.records])
+
+		# no ids, banks or dates wanted, they are not extracted
+		fields = ['type', 'quantity', 'market_value', 'currency']
+		self.assertEqual(readHolding(ws, fields=fields),
+							[{key: value for (key, value) in r.items() if key in fields} \
+								for r in TestDif.records])
+
+		# validate() still works on records read with fields
+		records, summary = readFile(file, fields=['isin'])
+		for (record, full) in zip(records, TestDif.records):
+			self.assertEqual(set(record), (validateFields | {'isin'}) & set(full))
+
+
+
+	def testFilters(self):
+		file = join(get_current_path(), 'samples',
+						'CL Franklin DIF 2018-05-28(2nd Revised).xls')
+		ws = open_workbook(filename=file).sheet_by_name('Portfolio Val.')
+		self.assertEqual(readHolding(ws, filters={'type': ['bond'], 'accounting': ['htm']}),
+							list(filter(htmBond, TestDif.records)))
+		self.assertEqual(readHolding(ws, filters={'type': ['equity'], 'currency': ['HKD']}),
+							[r for r in TestDif.records if equity(r) and r['currency'] == 'HKD'])
+
+		fxTable = {}
+		records = readHolding(ws, fxTable, filters={'currency': ['USD']}, fields=['isin'])
+		self.assertEqual(len(records), 73)
+		self.assertEqual(list(fxTable), ['USD'])
+
+
+
+	def testSharedStrings(self):
+		file = join(get_current_path(), 'samples',
+						'CL Franklin DIF 2018-05-28(2nd Revised).xls')
+		records = readFile(file)[0]
+		for (record, other) in zip(records, TestDif.records):
+			for (key, value) in record.items():
+				if isinstance(value, str):
+					self.assertIs(value, other[key])
+
+
+
+	def testMatchSection(self):
+		lines = [['V. Debt Securities (Held-to-Maturity) - US$  (持到期債務票據- 美元)', ''],
+					['', 'Par Amt'], ['Description', ''], ['(i) held to maturity', '']]
+		self.assertTrue(matchSection(lines, {'type': ['bond'], 'currency': ['USD']}))
+		self.assertTrue(matchSection(lines, {'accounting': ['htm', 'afs']}))
+		self.assertFalse(matchSection(lines, {'type': ['equity']}))
+		self.assertFalse(matchSection(lines, {'currency': ['HKD']}))
+		self.assertFalse(matchSection(lines, {'accounting': ['trading']}))
+		self.assertEqual(sectionAccounting(lines[:3]), '')
+
+		# the error is left to parsing
+		self.assertTrue(matchSection([['no title', '']], {'type': ['bond']}))
+
+
+
 	def verifyHtmBond(self, record):
 		self.assertEqual(record['valuation_date'], '2018-5-28')
 		self.assertEqual(record['description'], '(USY9896RAB79) Zoomlion HK SPV Co Ltd 6.125%')
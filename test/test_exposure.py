@@ -0,0 +1,102 @@
+# coding=utf-8
+#
+
+import unittest2
+from os.path import join
+from itertools import chain
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, recordValue, ExchangeRateNotFound
+from dif_revised.exposure import aggregate, aggregateMany, pivotToRows, issuerKey
+
+
+
+class TestExposure(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestExposure, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestExposure):
+		"""
+		Called only once before all tests
+		"""
+		TestExposure.difRecords, _ = readFile(join(get_current_path(), 'samples',
+									'CL Franklin DIF 2018-05-28(2nd Revised).xls'))
+		TestExposure.balRecords, _ = readFile(join(get_current_path(), 'samples',
+									'CLM BAL 2018-05-31.xls'))
+		TestExposure.gntRecords, _ = readFile(join(get_current_path(), 'samples',
+									'CLM GNT 2017-10-25.xls'))
+
+	def allRecords(self):
+		return chain(TestExposure.difRecords, TestExposure.balRecords,
+						TestExposure.gntRecords)
+
+
+
+	def testTotalDif(self):
+		pivot = aggregate(TestExposure.difRecords, ('portfolio',))
+		self.assertEqual(list(pivot.keys()), [('19437',)])
+		self.assertAlmostEqual(pivot[('19437',)][()],
+			sum(recordValue(r) for r in TestExposure.difRecords), 2)
+
+
+
+	def testHkdEquity(self):
+		"""
+		An HKD equity in a MOP based portfolio, its HKD equivalent is its
+		market value.
+		"""
+		pivot = aggregate(self.allRecords(), ('security',), ('portfolio',))
+		record = list(filter(lambda r: r.get('ticker') == '6886 HK',
+							TestExposure.balRecords))[0]
+		self.assertAlmostEqual(pivot[('6886 HK',)][('30004',)],
+								record['market_value'], 4)
+
+
+
+	def testManyGroupings(self):
+		groupings = [('security',), ('issuer',), ('currency',), ('accounting',)]
+		pivots = aggregateMany(self.allRecords(), groupings, ('portfolio',))
+		self.assertEqual(len(pivots), 4)
+
+		def totals(pivot):
+			t = {}
+			for row in pivot.values():
+				for (pivotKey, value) in row.items():
+					t[pivotKey] = t.get(pivotKey, 0) + value
+			return t
+
+		expected = totals(pivots[0])
+		self.assertEqual(sorted(expected.keys()), [('19437',), ('30003',), ('30004',)])
+		for pivot in pivots[1:]:
+			for (pivotKey, value) in totals(pivot).items():
+				self.assertAlmostEqual(value, expected[pivotKey], 2)
+
+		self.assertEqual(sorted(pivots[3].keys()), [('',), ('afs',), ('htm',), ('trading',)])
+		self.assertTrue(('Zoomlion HK SPV Co Ltd',) in pivots[1])
+
+
+
+	def testNoHkdRate(self):
+		records = filter(lambda r: r.get('currency') == 'USD', TestExposure.balRecords)
+		with self.assertRaises(ExchangeRateNotFound):
+			aggregate(records, ('currency',))
+
+		records = filter(lambda r: r.get('currency') == 'USD', TestExposure.balRecords)
+		pivot = aggregate(records, ('currency',), hkdRates={('30004', '2018-5-31'): 1.03})
+		self.assertTrue(pivot[('USD',)][()] > 0)
+
+
+
+	def testIssuer(self):
+		self.assertEqual(issuerKey({'description': '(XS1772375314) TRILLION CHANCE LTD 5%'}),
+							'TRILLION CHANCE LTD')
+		self.assertEqual(issuerKey({'description': '(N0700) Tencent Holdings Ltd.'}),
+							'Tencent Holdings Ltd.')
+
+
+
+	def testPivotToRows(self):
+		pivot = aggregate(self.allRecords(), ('currency',), ('portfolio',))
+		rows = pivotToRows(pivot, ('currency',), ('portfolio',))
+		self.assertEqual(rows[0], ['currency', '19437', '30003', '30004', 'total'])
+		self.assertEqual(len(rows), 1 + len(pivot))
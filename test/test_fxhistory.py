@@ -0,0 +1,63 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil
+from os.path import join
+from datetime import date
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, ExchangeRateNotFound
+from dif_revised.fxhistory import FxHistory
+
+
+
+class TestFxHistory(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestFxHistory, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+
+
+	def testFxTable(self):
+		fxTable = {}
+		readFile(join(get_current_path(), 'samples',
+						'CL Franklin DIF 2018-05-28(2nd Revised).xls'), fxTable)
+		self.assertEqual(sorted(fxTable.keys()), ['CNY', 'HKD', 'USD'])
+		self.assertAlmostEqual(fxTable['USD'], 7.8452, 6)
+		self.assertAlmostEqual(fxTable['CNY'], 1.226, 6)
+
+
+
+	def testAsOf(self):
+		fx = FxHistory()
+		fx.addFile(join(get_current_path(), 'samples', 'CL Franklin DIF 2018-05-28(2nd Revised).xls'))
+		fx.addFile(join(get_current_path(), 'samples', 'CL Franklin DIF 2018-07-24.xls'))
+		fx.addFile(join(get_current_path(), 'samples', 'CLM BAL 2017-07-27.xls'))
+
+		self.assertAlmostEqual(fx.rate('USD', '2018-5-28'), 7.8452, 6)
+		self.assertAlmostEqual(fx.rate('USD', date(2018, 6, 30)), 7.8452, 6)
+		self.assertEqual(fx.rate('HKD', '2018-6-30'), 1.0)
+		self.assertAlmostEqual(fx.rate('HKD', '2017-8-1', 'MOP'), 1.030046455)
+		self.assertEqual(len(fx.series('USD')), 2)
+
+		with self.assertRaises(ExchangeRateNotFound):
+			fx.rate('USD', '2018-5-27')
+		with self.assertRaises(ExchangeRateNotFound):
+			fx.rate('EUR', '2018-5-28')
+		fx.close()
+
+
+
+	def testPersist(self):
+		file = join(self.tempDir, 'fx.db')
+		fx = FxHistory(file)
+		fx.addRecords(readFile(join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls'))[0])
+		fx.close()
+
+		fx = FxHistory(file)
+		self.assertAlmostEqual(fx.rate('USD', '2017-10-25', 'MOP'), 8.0366209)
+		fx.close()
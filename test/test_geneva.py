@@ -0,0 +1,81 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, csv
+from os.path import join
+from dif_revised.utility import get_current_path
+from dif_revised.geneva import open_dif, layoutProjector, layoutFields, Column, fxGainLoss, \
+									optionalField, cashLayout, afsLayout, htmLayout, genevaFields
+
+
+
+def readCsv(file):
+	with open(file, newline='') as f:
+		return list(csv.reader(f, delimiter='|'))
+
+
+
+class TestGeneva(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestGeneva, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		self.outputDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outputDir)
+
+
+
+	def testProjector(self):
+		layout = [('a', 'x'), ('b', optionalField('y')), ('fx', fxGainLoss),
+					('c', Column(['x', 'z'], lambda record, entry: record['x'] + entry['z'])),
+					('d', 'z')]
+		project = layoutProjector(layout, 'fx_gain_loss_mop')
+		self.assertEqual(project({'x': 1, 'z': 3, 'fx_gain_loss_mop': 2.5}, {'z': 10}),
+							(1, '', 2.5, 11, 3))
+		self.assertEqual(layoutFields(layout), ['x', 'y', 'x', 'z', 'z'])
+
+		self.assertEqual(layoutProjector([('a', 'x')])({'x': 1}, None), (1,))
+		self.assertEqual(layoutProjector([('fx', fxGainLoss)], 'fx_gain_loss_hkd')(
+							{'fx_gain_loss_hkd': 2.0}, None), (2.0,))
+		self.assertEqual(layoutProjector([])({}, None), ())
+
+		for layout in (cashLayout, afsLayout, htmLayout):
+			self.assertTrue(set(layoutFields(layout)) <= genevaFields)
+
+
+
+	def testDif(self):
+		portValues = {}
+		cashFile, afsFile, htmFile = open_dif(join(get_current_path(), 'samples',
+									'CL Franklin DIF 2018-05-28(2nd Revised).xls'),
+									portValues, self.outputDir, 'dif')
+		rows = readCsv(cashFile)
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(rows[0][:3], ['portfolio', 'custodian', 'date'])
+
+		rows = readCsv(htmFile)
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(rows[1][:5], ['19437', '2018-5-28', 'BOCHK', 'USY9896RAB79 HTM',
+										'USY9896RAB79'])
+		self.assertEqual(rows[1][-1], '1137003.4800000042')
+
+		rows = readCsv(afsFile)
+		self.assertEqual(len(rows), 80)
+		self.assertEqual(rows[1][8:10], ['TRADING', '5000000.0'])
+
+
+
+	def testBalCash(self):
+		"""
+		Cash of the same custodian and currency is merged.
+		"""
+		portValues = {}
+		cashFile, afsFile, htmFile = open_dif(join(get_current_path(), 'samples',
+									'CLM BAL 2017-07-27.xls'), portValues, self.outputDir, 'bal')
+		rows = readCsv(cashFile)
+		self.assertEqual(len(rows), 7)
+		self.assertEqual(rows[1][:6], ['30004', 'CITI', '2017-7-27', 'Saving Account',
+										'006-391-17836395', 'HKD'])
+		self.assertEqual(len(set((row[1], row[5]) for row in rows[1:])), 6)
@@ -0,0 +1,70 @@
+# coding=utf-8
+#
+
+import unittest2
+from os.path import join
+from io import BytesIO
+from mmap import mmap, ACCESS_READ
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+
+
+
+class TestInput(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestInput, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestInput):
+		"""
+		Called only once before all tests
+		"""
+		TestInput.file = join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls')
+		TestInput.records, TestInput.summary = readFile(TestInput.file)
+		with open(TestInput.file, 'rb') as f:
+			TestInput.data = f.read()
+
+	@classmethod
+	def tearDownClass(TestInput):
+		pass
+
+
+
+	def testBytes(self):
+		self.verifySameAsFile(readFile(TestInput.data))
+
+
+
+	def testMemoryview(self):
+		self.verifySameAsFile(readFile(memoryview(TestInput.data)))
+
+
+
+	def testBytesIO(self):
+		self.verifySameAsFile(readFile(BytesIO(TestInput.data)))
+
+
+
+	def testFileObject(self):
+		with open(TestInput.file, 'rb') as f:
+			self.verifySameAsFile(readFile(f))
+
+
+
+	def testMmap(self):
+		with open(TestInput.file, 'rb') as f:
+			with mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+				self.verifySameAsFile(readFile(m))
+
+
+
+	def testUnsupported(self):
+		with self.assertRaises(TypeError):
+			readFile(12345)
+
+
+
+	def verifySameAsFile(self, result):
+		records, summary = result
+		self.assertEqual(records, TestInput.records)
+		self.assertEqual(summary, TestInput.summary)
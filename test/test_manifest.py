@@ -0,0 +1,91 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, json
+from os.path import join
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.geneva import open_dif
+from dif_revised.manifest import manifestName, parserModules
+
+
+
+def samplePath(fileName):
+	return join(get_current_path(), 'samples', fileName)
+
+def runOpenDif(args):
+	portValues = {}
+	files = open_dif(samplePath(args[0]), portValues, args[1], 'bal')
+	return files, portValues
+
+
+
+class TestManifest(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestManifest, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		self.outputDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outputDir)
+
+
+
+	def testSkipUnchanged(self):
+		file = samplePath('CLM GNT 2017-10-25.xls')
+		portValues = {}
+		files = open_dif(file, portValues, self.outputDir, 'gnt')
+
+		portValues2 = {}
+		with mock.patch('dif_revised.geneva.readFile', side_effect=Exception('parsed')):
+			files2 = open_dif(file, portValues2, self.outputDir, 'gnt')
+		self.assertEqual(files2, files)
+		self.assertEqual(portValues2, portValues)
+
+		# different prefix, force, or changed output: parse again
+		with mock.patch('dif_revised.geneva.readFile', side_effect=Exception('parsed')):
+			with self.assertRaises(Exception):
+				open_dif(file, {}, self.outputDir, 'gnt2')
+			with self.assertRaises(Exception):
+				open_dif(file, {}, self.outputDir, 'gnt', force=True)
+
+			with open(files[0], 'a') as f:
+				f.write('changed')
+			with self.assertRaises(Exception):
+				open_dif(file, {}, self.outputDir, 'gnt')
+
+		portValues3 = {}
+		self.assertEqual(open_dif(file, portValues3, self.outputDir, 'gnt'), files)
+		self.assertEqual(portValues3, portValues)
+
+
+
+	def testBytesInput(self):
+		with open(samplePath('CLM BAL 2017-07-27.xls'), 'rb') as f:
+			data = f.read()
+
+		files = open_dif(samplePath('CLM BAL 2017-07-27.xls'), {}, self.outputDir, 'bal')
+		with mock.patch('dif_revised.geneva.readFile', side_effect=Exception('parsed')):
+			self.assertEqual(open_dif(data, {}, self.outputDir, 'bal'), files)
+
+
+
+	def testManyProcesses(self):
+		fileNames = ['CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls',
+						'CLM GNT 2017-10-25.xls'] * 2
+		with ProcessPoolExecutor(max_workers=3) as executor:
+			results = list(executor.map(runOpenDif, [(f, self.outputDir) for f in fileNames]))
+
+		self.assertEqual(results[:3], results[3:])
+		with open(join(self.outputDir, manifestName)) as f:
+			self.assertEqual(len(json.load(f)), 3)
+
+
+
+	def testParserModules(self):
+		modules = parserModules()
+		for module in ['dif.py', 'geneva.py', 'secmaster.py']:
+			self.assertIn(module, modules)
+		self.assertNotIn('server.py', modules)
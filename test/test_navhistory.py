@@ -0,0 +1,113 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, csv
+from os.path import join
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readSummaryFile
+from dif_revised.navhistory import SummaryCache, loadSummaries, navHistory, dayOverDay, \
+									navAnalytics, writeFlags
+import numpy as np
+
+
+
+def summary(portfolio, valuationDate, unitPrice, cash=10.0, bond=90.0):
+	return {'cash': cash, 'bond': bond, 'number_of_units': 100.0 / unitPrice,
+			'unit_price': unitPrice, 'nav': cash + bond, 'valuation_date': valuationDate,
+			'portfolio': portfolio}
+
+
+
+class TestNavHistory(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestNavHistory, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestNavHistory):
+		"""
+		Called only once before all tests
+		"""
+		TestNavHistory.files = [join(get_current_path(), 'samples', f) for f in \
+			['CLM BAL 2018-05-31.xls', 'CLM BAL 2017-07-27.xls', 'CLM GNT 2017-10-25.xls']]
+
+
+
+	def testCache(self):
+		directory = tempfile.mkdtemp()
+		try:
+			cache = SummaryCache(join(directory, 'summary.db'))
+			summaries = loadSummaries(TestNavHistory.files, cache)
+			self.assertEqual(summaries, [readSummaryFile(f) for f in TestNavHistory.files])
+			cache.close()
+
+			# a new cache on the same database has them, and reads nothing
+			cache = SummaryCache(join(directory, 'summary.db'))
+			count = cache.db.execute('SELECT COUNT(*) FROM summary').fetchone()[0]
+			self.assertEqual(count, 3)
+			self.assertEqual(loadSummaries(TestNavHistory.files, cache), summaries)
+			cache.close()
+		finally:
+			shutil.rmtree(directory)
+
+
+
+	def testHistory(self):
+		histories = navHistory(loadSummaries(TestNavHistory.files))
+		self.assertEqual(sorted(histories), ['30003', '30004'])
+		bal = histories['30004']
+		self.assertEqual(bal['date'].tolist()[0].isoformat(), '2017-07-27')
+		self.assertEqual(bal['categories'][:3], ['cash', 'bond', 'equity'])
+		self.assertEqual(bal['subtotals'].shape, (2, len(bal['categories'])))
+		self.assertAlmostEqual(bal['unit_price'][1], 12.164676)
+
+		changes = dayOverDay(bal)
+		self.assertEqual(changes['days'].tolist(), [308])
+		self.assertAlmostEqual(changes['unit_price_return'][0], 12.164676 / 11.892255 - 1)
+		self.assertTrue(np.allclose(changes['mix_shift'][0],
+									changes['weights'][1] - changes['weights'][0]))
+
+
+
+	def testRevisedFile(self):
+		histories = navHistory([summary('19437', '2018-1-3', 10.0),
+								summary('19437', '2018-1-2', 10.0),
+								summary('19437', '2018-1-3', 10.5)])
+		self.assertEqual(histories['19437']['unit_price'].tolist(), [10.0, 10.5])
+
+
+
+	def testFlags(self):
+		summaries = [summary('30005', '2018-1-{0}'.format(day), 10.0 + 0.001 * day) \
+						for day in range(1, 30)]
+		summaries[10] = summary('30005', '2018-1-11', summaries[9]['unit_price'] * 1.004)
+		summaries[20] = summary('30005', '2018-1-21', summaries[19]['unit_price'] * 1.05)
+		summaries[25] = summary('30005', '2018-1-26', 10.026, cash=20.0, bond=80.0)
+		analytics, flags = navAnalytics(summaries)
+
+		self.assertEqual(len(analytics['30005']['changes']['date']), 28)
+		reasons = [(f['date'], f['field'], f['reason']) for f in flags]
+		self.assertIn(('2018-1-11', 'unit_price', 'outlier'), reasons)
+		self.assertIn(('2018-1-21', 'unit_price', 'return limit'), reasons)
+		self.assertIn(('2018-1-26', 'cash', 'mix shift'), reasons)
+		self.assertIn(('2018-1-26', 'bond', 'mix shift'), reasons)
+
+		# the dates join with those of the summaries
+		valuationDates = {s['valuation_date'] for s in summaries}
+		for f in flags:
+			self.assertIn(f['previous_date'], valuationDates)
+			self.assertIn(f['date'], valuationDates)
+
+		_, flags = navAnalytics(summaries, {'return': 0.1, 'z_score': 1e9, 'mix_shift': 0.5})
+		self.assertEqual(flags, [])
+
+		directory = tempfile.mkdtemp()
+		try:
+			file = join(directory, 'flags.csv')
+			_, flags = navAnalytics(summaries)
+			writeFlags(file, flags)
+			with open(file, newline='') as f:
+				rows = list(csv.reader(f))
+			self.assertEqual(rows[0][:3], ['portfolio', 'previous_date', 'date'])
+			self.assertEqual(len(rows), len(flags) + 1)
+		finally:
+			shutil.rmtree(directory)
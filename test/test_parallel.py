@@ -0,0 +1,54 @@
+# coding=utf-8
+#
+
+import unittest2
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, packSection, unpackSection
+
+
+
+class TestParallel(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestParallel, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestParallel):
+		"""
+		Called only once before all tests
+		"""
+		TestParallel.executor = ProcessPoolExecutor(max_workers=2)
+
+	@classmethod
+	def tearDownClass(TestParallel):
+		TestParallel.executor.shutdown()
+
+
+
+	def testPackSection(self):
+		lines = [['I. Cash - HKD', '', '', ''], ['', 1.0, '', 0.0], ['', '', '', '']]
+		packed = packSection(lines)
+		self.assertEqual(packed, ((4, ('I. Cash - HKD',)), (4, ('', 1.0, '', 0.0)), (4, ())))
+		self.assertEqual(unpackSection(packed), lines)
+
+
+
+	def testSameAsSerial(self):
+		for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls',
+							'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']:
+			file = join(get_current_path(), 'samples', fileName)
+			fxTable, fxTable2 = {}, {}
+			records, summary = readFile(file, fxTable)
+			records2, summary2 = readFile(file, fxTable2, TestParallel.executor)
+			self.assertEqual(records2, records)
+			self.assertEqual(summary2, summary)
+			self.assertEqual(fxTable2, fxTable)
+
+			fields = ['type', 'isin', 'quantity', 'coupon_start_date']
+			records3, _ = readFile(file, executor=TestParallel.executor, fields=fields)
+			self.assertEqual(records3, readFile(file, fields=fields)[0])
+
+			filters = {'type': ['bond', 'cash'], 'currency': ['USD']}
+			records4, _ = readFile(file, executor=TestParallel.executor, filters=filters)
+			self.assertEqual(records4, readFile(file, filters=filters)[0])
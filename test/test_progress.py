@@ -0,0 +1,189 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, os, csv
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, writeCsv, csvBatchRows
+from dif_revised.geneva import open_dif
+from dif_revised.navhistory import loadSummaries
+from dif_revised.progress import Progress, Cancelled
+
+
+
+def samplePath(fileName):
+	return join(get_current_path(), 'samples', fileName)
+
+
+
+def cancelAfter(sections):
+	"""
+	output: a Progress object that cancels itself once the number of
+		sections is reached.
+	"""
+	def report(snapshot):
+		if snapshot['sections'] >= sections:
+			progress.cancel()
+
+	progress = Progress(report, interval=0)
+	return progress
+
+
+
+class TestProgress(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestProgress, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestProgress):
+		"""
+		Called only once before all tests
+		"""
+		TestProgress.file = samplePath('CL Franklin DIF 2018-05-28(2nd Revised).xls')
+
+
+
+	def testToken(self):
+		reports = []
+		progress = Progress(reports.append, interval=3600)
+		progress.update(rows=10, sections=2)
+		self.assertEqual(reports, [])	# not yet due
+		progress.update(files=1)
+		self.assertEqual(len(reports), 1)
+		self.assertEqual((reports[0]['rows'], reports[0]['sections'], reports[0]['files']),
+							(10, 2, 1))
+		self.assertGreater(reports[0]['rows_per_second'], 0)
+
+		progress.check()
+		self.assertFalse(progress.isCancelled())
+		progress.cancel()
+		self.assertTrue(progress.isCancelled())
+		with self.assertRaises(Cancelled):
+			progress.check()
+
+
+
+	def testReadFile(self):
+		progress = Progress()
+		records, summary = readFile(TestProgress.file, progress=progress)
+		self.assertEqual(records, readFile(TestProgress.file)[0])
+		self.assertEqual(progress.files, 1)
+		self.assertGreater(progress.rows, len(records))
+
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			parallel = Progress()
+			readFile(TestProgress.file, executor=executor, progress=parallel)
+		self.assertEqual((parallel.rows, parallel.sections, parallel.files),
+							(progress.rows, progress.sections, progress.files))
+
+
+
+	def testCancelReadFile(self):
+		progress = cancelAfter(3)
+		with self.assertRaises(Cancelled):
+			readFile(TestProgress.file, progress=progress)
+		self.assertEqual((progress.sections, progress.files), (3, 0))
+
+		progress = Progress()
+		progress.cancel()
+		with self.assertRaises(Cancelled):
+			readFile(TestProgress.file, progress=progress)
+		self.assertEqual(progress.sections, 0)
+
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			with self.assertRaises(Cancelled):
+				readFile(TestProgress.file, executor=executor, progress=cancelAfter(3))
+
+
+
+	def testCancelOpenDif(self):
+		outputDir = tempfile.mkdtemp()
+		try:
+			portValues = {}
+			with self.assertRaises(Cancelled):
+				open_dif(TestProgress.file, portValues, outputDir, 'DIF',
+							progress=cancelAfter(5))
+			self.assertEqual(os.listdir(outputDir), [])
+			self.assertEqual(portValues, {})
+
+			progress = Progress()
+			files = open_dif(TestProgress.file, portValues, outputDir, 'DIF', progress=progress)
+			self.assertEqual(len(files), 3)
+			self.assertEqual(progress.files, 1)
+			self.assertGreater(progress.rowsWritten, 3)
+
+			# up to date outputs are not read again, but the file is counted
+			progress = Progress()
+			self.assertEqual(open_dif(TestProgress.file, {}, outputDir, 'DIF',
+										progress=progress), files)
+			self.assertEqual((progress.sections, progress.files), (0, 1))
+		finally:
+			shutil.rmtree(outputDir)
+
+
+
+	def testLoadSummaries(self):
+		files = [samplePath(f) for f in ['CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']]
+		progress = Progress()
+		self.assertEqual(loadSummaries(files, progress=progress), loadSummaries(files))
+		self.assertEqual(progress.files, 2)
+
+		def report(snapshot):
+			progress.cancel()
+
+		progress = Progress(report)
+		with self.assertRaises(Cancelled):
+			loadSummaries(files, progress=progress)
+		self.assertEqual(progress.files, 1)
+
+
+
+	def testCancelWriteCsv(self):
+		directory = tempfile.mkdtemp()
+		try:
+			file = join(directory, 'rows.csv')
+			rows = [[i, 'row {0}'.format(i)] for i in range(csvBatchRows * 2 + 500)]
+			progress = Progress()
+			writeCsv(file, rows, progress=progress)
+			self.assertEqual(progress.rowsWritten, len(rows))
+			with open(file, newline='') as f:
+				self.assertEqual(len(list(csv.reader(f))), len(rows))
+
+			# cancelled after the first batch, the file of the last run is kept
+			progress = Progress(lambda snapshot: progress.cancel(), interval=0)
+			with self.assertRaises(Cancelled):
+				writeCsv(file, rows[:10] + rows, progress=progress)
+			self.assertEqual(progress.rowsWritten, csvBatchRows)
+			self.assertEqual(os.listdir(directory), ['rows.csv'])
+			with open(file, newline='') as f:
+				self.assertEqual(len(list(csv.reader(f))), len(rows))
+		finally:
+			shutil.rmtree(directory)
+
+
+
+	def testCancelGenevaWriters(self):
+		outputDir = tempfile.mkdtemp()
+		try:
+			files = open_dif(TestProgress.file, {}, outputDir, 'DIF')
+			before = {}
+			for file in files:
+				with open(file, 'rb') as f:
+					before[file] = f.read()
+
+			# cancelled once the cash csv is written, while the others are not
+			def report(snapshot):
+				if snapshot['rows_written'] > 0:
+					progress.cancel()
+
+			progress = Progress(report, interval=0)
+			with self.assertRaises(Cancelled):
+				open_dif(TestProgress.file, {}, outputDir, 'DIF', force=True, progress=progress)
+			self.assertGreater(progress.rowsWritten, 0)
+			self.assertEqual([f for f in os.listdir(outputDir) if f.endswith('.tmp')], [])
+			for file in files:
+				with open(file, 'rb') as f:
+					self.assertEqual(f.read(), before[file])
+		finally:
+			shutil.rmtree(outputDir)
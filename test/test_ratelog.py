@@ -0,0 +1,116 @@
+# coding=utf-8
+#
+
+import unittest2, logging
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, parserLog
+from dif_revised.ratelog import RateLimitedLog
+
+
+
+class ListHandler(logging.Handler):
+	def __init__(self):
+		super(ListHandler, self).__init__()
+		self.records = []
+
+	def emit(self, record):
+		self.records.append(record)
+
+
+
+class Expensive():
+	"""
+	An argument that counts how many times it is formatted.
+	"""
+	formatted = 0
+
+	def __str__(self):
+		Expensive.formatted = Expensive.formatted + 1
+		return 'expensive'
+
+
+
+class TestRateLog(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestRateLog, self).__init__(*args, **kwargs)
+
+	def setUp(self):
+		self.logger = logging.getLogger('test_ratelog')
+		self.logger.propagate = False
+		self.handler = ListHandler()
+		self.logger.addHandler(self.handler)
+		self.logger.setLevel(logging.WARNING)
+
+	def tearDown(self):
+		self.logger.removeHandler(self.handler)
+
+
+
+	def testLimit(self):
+		log = RateLimitedLog(self.logger, limit=3)
+		for i in range(10):
+			log.warning('fx not found', 'FX not found in line %s', i)
+		log.error('header not matched', '%s not matched', 'x')
+
+		self.assertEqual([r.getMessage() for r in self.handler.records],
+			['FX not found in line 0', 'FX not found in line 1',
+			'FX not found in line 2 (more \'fx not found\' messages in 60s are counted only)',
+			'x not matched'])
+		self.assertEqual(self.handler.records[0].kind, 'fx not found')
+		self.assertEqual(log.summary(), {'fx not found': 10, 'header not matched': 1})
+
+		self.assertEqual(log.logSummary(logging.WARNING), {'fx not found': 10, 'header not matched': 1})
+		self.assertEqual(self.handler.records[-1].getMessage(),
+			'log summary: fx not found x10, header not matched x1')
+		self.assertEqual(log.summary(), {})
+
+
+
+	def testWindow(self):
+		log = RateLimitedLog(self.logger, limit=1, interval=0)
+		for i in range(3):
+			log.warning('kind', 'message %s', i)
+		self.assertEqual(len(self.handler.records), 3)	# each in a new window
+
+
+
+	def testLazy(self):
+		log = RateLimitedLog(self.logger, limit=2)
+		Expensive.formatted = 0
+		for i in range(5):
+			log.info('below level', 'not written %s', Expensive())
+			log.warning('over limit', 'written twice %s', Expensive())
+		self.assertEqual(len(self.handler.records), 2)
+		self.assertEqual(Expensive.formatted, 0)	# the handler did not format them
+
+
+
+	def testThreads(self):
+		log = RateLimitedLog(self.logger, limit=5)
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			list(executor.map(lambda i: log.warning('kind', 'message %s', i), range(1000)))
+		self.assertEqual(log.summary(), {'kind': 1000})
+		self.assertEqual(len(self.handler.records), 5)
+
+
+
+	def testParser(self):
+		parserLog.summary(reset=True)
+		for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls', 'CLM BAL 2018-05-31.xls']:
+			readFile(join(get_current_path(), 'samples', fileName))
+		self.assertEqual(parserLog.summary(reset=True),
+			{'fx not found': 1, 'type not in summary': 1})
+
+
+
+	def testWorkers(self):
+		# the counts of the sections parsed in worker processes are kept
+		parserLog.summary(reset=True)
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls',
+								'CLM BAL 2018-05-31.xls']:
+				readFile(join(get_current_path(), 'samples', fileName), executor=executor)
+		self.assertEqual(parserLog.summary(reset=True),
+			{'fx not found': 1, 'type not in summary': 1})
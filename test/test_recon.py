@@ -0,0 +1,95 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, csv
+from os.path import join
+from itertools import chain
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+from dif_revised.geneva import cashCustodian
+from dif_revised.recon import loadGenevaExtract, reconcile, positionKey, writeBreaks
+
+
+
+def toGenevaExtract(records, file):
+	"""
+	Write the records as a Geneva extract, with Geneva style headers and
+	yyyy-mm-dd dates.
+	"""
+	with open(file, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(['Portfolio', 'Date', 'Type', 'Investment', 'Custodian',
+							'Currency', 'Quantity', 'Balance'])
+		for record in records:
+			if record['type'] in ('bond', 'equity'):
+				portfolio, dt, investmentId = positionKey(record)
+				writer.writerow([portfolio, dt.isoformat(), record['type'], investmentId,
+									'', record['currency'], record['quantity'], ''])
+			elif record['type'] in ('cash', 'broker account cash'):
+				writer.writerow([record['portfolio'], record['valuation_date'], 'cash', '',
+									cashCustodian(record), record['currency'], '',
+									'{0:,.2f}'.format(record['book_cost'])])
+
+columnMap = {'portfolio': 'Portfolio', 'date': 'Date', 'type': 'Type',
+				'investment_id': 'Investment', 'custodian': 'Custodian',
+				'currency': 'Currency', 'quantity': 'Quantity', 'balance': 'Balance'}
+
+
+
+class TestRecon(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestRecon, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestRecon):
+		"""
+		Called only once before all tests
+		"""
+		TestRecon.records = list(chain(*[readFile(join(get_current_path(), 'samples', f))[0] \
+			for f in ['CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']]))
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+
+
+	def testNoBreak(self):
+		file = join(self.tempDir, 'geneva.csv')
+		toGenevaExtract(TestRecon.records, file)
+		rows = loadGenevaExtract(file, columnMap=columnMap)
+		self.assertEqual(reconcile(TestRecon.records, rows), [])
+
+
+
+	def testBreaks(self):
+		file = join(self.tempDir, 'geneva.csv')
+		toGenevaExtract(TestRecon.records, file)
+		rows = loadGenevaExtract(file, columnMap=columnMap)
+
+		equity = list(filter(lambda r: r['investment_id'] == '6886 HK', rows))[0]
+		equity['quantity'] = equity['quantity'] + 1000
+		htm = list(filter(lambda r: r['investment_id'].endswith(' HTM'), rows))[0]
+		rows.remove(htm)
+		cash = list(filter(lambda r: r['type'] == 'cash', rows))[0]
+		cash['balance'] = cash['balance'] + 0.005	# within tolerance
+		rows.append({'portfolio': '30003', 'date': '2017-10-25', 'type': 'cash',
+					'investment_id': '', 'custodian': 'JPM', 'currency': 'USD',
+					'quantity': 0, 'balance': 100.0})
+
+		breaks = reconcile(TestRecon.records, rows)
+		self.assertEqual(len(breaks), 3)
+		self.assertEqual([(b['id'], b['reason']) for b in breaks],
+			[(htm['investment_id'], 'missing in geneva'), ('6886 HK', 'difference'),
+			('JPM USD', 'missing in trustee')])
+		self.assertEqual(breaks[1]['difference'], -1000)
+		self.assertEqual(breaks[1]['date'], '2018-05-31')
+
+		self.assertEqual(len(reconcile(TestRecon.records, rows, {'quantity': 1000})), 2)
+		self.assertEqual(len(reconcile(TestRecon.records, rows, {'balance': 0.001})), 4)
+
+		writeBreaks(join(self.tempDir, 'breaks.csv'), breaks)
+		with open(join(self.tempDir, 'breaks.csv')) as f:
+			self.assertEqual(len(f.readlines()), 4)
@@ -0,0 +1,122 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, csv, sqlite3
+from os.path import join
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+from dif_revised.geneva import writeAfsCsv, writeHtmCsv
+from dif_revised.secmaster import SecurityMaster, loadSecurityMaster
+
+
+
+def readCsv(file):
+	with open(file, newline='') as f:
+		return list(csv.DictReader(f, delimiter='|'))
+
+
+
+class TestSecMaster(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestSecMaster, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestSecMaster):
+		"""
+		Called only once before all tests
+		"""
+		TestSecMaster.records, _ = readFile(join(get_current_path(), 'samples',
+											'CLM GNT 2017-10-25.xls'))
+		TestSecMaster.entries = [
+			{'isin': 'XS1389124774', 'ticker': '', 'bloomberg_figi': 'BBG00CS1QJ36',
+				'geneva_investment_id': ''},
+			{'isin': '', 'ticker': '1 HK', 'bloomberg_figi': 'BBG008B3SNR9',
+				'geneva_investment_id': ''},
+			{'isin': 'USY32358AA46', 'ticker': '', 'bloomberg_figi': 'BBG0000ABCD1',
+				'geneva_investment_id': 'HKCG 6.25 HTM'}
+		]
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+
+
+	def testLookup(self):
+		master = SecurityMaster(TestSecMaster.entries)
+		self.assertEqual(len(master), 3)
+		self.assertEqual(master.lookup('N0001')['bloomberg_figi'], 'BBG008B3SNR9')
+		self.assertEqual(master.lookup(' 1 hk')['bloomberg_figi'], 'BBG008B3SNR9')
+		self.assertEqual(master.lookup('XS1389124774')['bloomberg_figi'], 'BBG00CS1QJ36')
+		self.assertEqual(master.lookup('XS0000000000'), None)
+		self.assertEqual(master.lookup.cache_info().hits, 0)
+		master.lookup('N0001')
+		self.assertEqual(master.lookup.cache_info().hits, 1)
+
+
+
+	def testKeys(self):
+		# keys in the trustee's form or another case match the records
+		master = SecurityMaster([
+			{'isin': 'xs1389124774', 'ticker': '', 'bloomberg_figi': 'BBG00CS1QJ36'},
+			{'isin': '', 'ticker': 'H0700', 'bloomberg_figi': 'BBG000BMHYD1'},
+			{'isin': '', 'ticker': '939 hk', 'bloomberg_figi': 'BBG000BGXQ48'}])
+		self.assertEqual(master.lookupRecord({'isin': 'XS1389124774'})['bloomberg_figi'],
+							'BBG00CS1QJ36')
+		self.assertEqual(master.lookupRecord({'ticker': '700 HK'})['bloomberg_figi'],
+							'BBG000BMHYD1')
+		self.assertEqual(master.lookup('H0939')['ticker'], '939 HK')
+
+		# an entry cannot be changed by one caller for the others
+		with self.assertRaises(TypeError):
+			master.lookup('700 HK')['bloomberg_figi'] = ''
+		self.assertEqual(master.lookup('700 HK')['bloomberg_figi'], 'BBG000BMHYD1')
+
+
+
+	def testLoadCsv(self):
+		file = join(self.tempDir, 'master.csv')
+		with open(file, 'w', newline='') as f:
+			writer = csv.DictWriter(f, ['isin', 'ticker', 'bloomberg_figi', 'geneva_investment_id'])
+			writer.writeheader()
+			writer.writerows(TestSecMaster.entries)
+
+		master = loadSecurityMaster(file)
+		self.assertEqual(master.lookup('1 HK')['bloomberg_figi'], 'BBG008B3SNR9')
+		self.assertTrue(loadSecurityMaster(file) is master)	# loaded only once
+
+
+
+	def testLoadSqlite(self):
+		file = join(self.tempDir, 'master.db')
+		db = sqlite3.connect(file)
+		db.execute('CREATE TABLE security_master (isin TEXT, ticker TEXT, '
+					'bloomberg_figi TEXT, geneva_investment_id TEXT)')
+		db.executemany('INSERT INTO security_master VALUES (:isin, :ticker, '
+						':bloomberg_figi, :geneva_investment_id)', TestSecMaster.entries)
+		db.commit()
+		db.close()
+
+		master = loadSecurityMaster(file)
+		self.assertEqual(master.lookup('USY32358AA46')['geneva_investment_id'], 'HKCG 6.25 HTM')
+
+
+
+	def testGenevaCsv(self):
+		master = SecurityMaster(TestSecMaster.entries)
+		afsFile = join(self.tempDir, 'afs.csv')
+		writeAfsCsv(afsFile, TestSecMaster.records, securityMaster=master)
+		rows = readCsv(afsFile)
+		figi = {row['isin'] or row['ticker']: row['bloomberg_figi'] for row in rows}
+		self.assertEqual(figi['XS1389124774'], 'BBG00CS1QJ36')
+		self.assertEqual(figi['1 HK'], 'BBG008B3SNR9')
+		self.assertEqual(figi['700 HK'], '')
+
+		htmFile = join(self.tempDir, 'htm.csv')
+		writeHtmCsv(htmFile, TestSecMaster.records, securityMaster=master)
+		rows = {row['isin']: row for row in readCsv(htmFile)}
+		self.assertEqual(rows['USY32358AA46']['geneva_investment_id'], 'HKCG 6.25 HTM')
+		self.assertEqual(rows['USY32358AA46']['bloomberg_figi'], 'BBG0000ABCD1')
+		self.assertEqual(rows['XS0508012092']['geneva_investment_id'], 'XS0508012092 HTM')
@@ -0,0 +1,192 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, threading, os, time, signal, logging
+from os.path import join, isfile
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from dif_revised.utility import get_current_path
+from dif_revised.server import DifServer, requestOpenDif, runRequest
+from dif_revised.progress import Cancelled
+
+
+
+class ProxyErrorHandler(BaseHTTPRequestHandler):
+	"""
+	Answers like a proxy in front of the server, with an html error page.
+	"""
+	def do_POST(self):
+		body = b'<html><body>Bad Gateway</body></html>'
+		self.send_response(502)
+		self.send_header('Content-Type', 'text/html')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+
+class TestServer(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestServer, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestServer):
+		"""
+		Called only once before all tests
+		"""
+		TestServer.server = DifServer(('127.0.0.1', 0), workers=2, requestTimeout=60)
+		TestServer.thread = threading.Thread(target=TestServer.server.serve_forever)
+		TestServer.thread.start()
+		TestServer.address = TestServer.server.server_address
+
+	@classmethod
+	def tearDownClass(TestServer):
+		TestServer.server.shutdown()
+		TestServer.server.server_close()
+		TestServer.thread.join()
+
+
+
+	def setUp(self):
+		self.outputDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.outputDir)
+
+
+
+	def testFilePath(self):
+		file = join(get_current_path(), 'samples',
+						'CL Franklin DIF 2018-05-28(2nd Revised).xls')
+		portValues = {}
+		files = requestOpenDif(TestServer.address, file, portValues,
+								self.outputDir, 'dif')
+		self.assertEqual(files[0], join(self.outputDir, 'DIF_2018-5-28_cash.csv'))
+		for f in files:
+			self.assertTrue(isfile(f))
+		self.assertEqual(portValues['portfolio'], '19437')
+		self.assertEqual(portValues['valuation_date'], '2018-5-28')
+		self.assertAlmostEqual(portValues['nav'], 4248751534.54, 2)
+		self.assertAlmostEqual(portValues['unit_price'], 11.7364)
+
+
+
+	def testBytes(self):
+		file = join(get_current_path(), 'samples', 'CLM BAL 2017-07-27.xls')
+		with open(file, 'rb') as f:
+			data = f.read()
+
+		portValues = {}
+		files = requestOpenDif(TestServer.address, data, portValues,
+								self.outputDir, 'bal')
+		self.assertEqual(files[2], join(self.outputDir, 'bal2017-7-27_htm_positions.csv'))
+		self.assertTrue(isfile(files[2]))
+		self.assertEqual(portValues['portfolio'], '30004')
+
+
+
+	def testError(self):
+		with self.assertRaises(RuntimeError):
+			requestOpenDif(TestServer.address, join(self.outputDir, 'no such file.xls'),
+							{}, self.outputDir, 'dif')
+
+
+
+	def testNotJsonError(self):
+		proxy = HTTPServer(('127.0.0.1', 0), ProxyErrorHandler)
+		thread = threading.Thread(target=proxy.serve_forever)
+		thread.start()
+		try:
+			with self.assertRaisesRegex(RuntimeError, 'HTTP 502 .*Bad Gateway'):
+				requestOpenDif(proxy.server_address, 'any file.xls', {}, self.outputDir, 'dif')
+		finally:
+			proxy.shutdown()
+			proxy.server_close()
+			thread.join()
+
+
+
+	def testDeadline(self):
+		request = {'inputFile': join(get_current_path(), 'samples',
+										'CL Franklin DIF 2018-05-28(2nd Revised).xls'),
+					'outputDir': self.outputDir, 'prefix': 'dif'}
+
+		# stopped in the worker while the file is read, no csv files
+		with self.assertRaises(Cancelled):
+			runRequest(request, time.time() + 0.01)
+		with self.assertRaises(Cancelled):
+			runRequest(request, time.time() - 1)
+		self.assertEqual(os.listdir(self.outputDir), [])
+
+		self.assertEqual(len(runRequest(request, time.time() + 60)['files']), 3)
+
+
+
+	def testTimeout(self):
+		server = DifServer(('127.0.0.1', 0), workers=1, requestTimeout=0.01)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.start()
+		try:
+			file = join(get_current_path(), 'samples', 'CLM BAL 2017-07-27.xls')
+			with self.assertRaisesRegex(RuntimeError, 'timed out'):
+				requestOpenDif(server.server_address, file, {}, self.outputDir, 'bal')
+			self.assertEqual(os.listdir(self.outputDir), [])
+
+			# the one worker is free for the next request
+			server.requestTimeout = 60
+			self.assertEqual(len(requestOpenDif(server.server_address, file, {},
+												self.outputDir, 'bal')), 3)
+		finally:
+			server.shutdown()
+			server.server_close()
+			thread.join()
+
+
+
+	def testWorkerDied(self):
+		records = []
+		handler = logging.Handler()
+		handler.emit = records.append
+		logging.getLogger().addHandler(handler)
+		server = DifServer(('127.0.0.1', 0), workers=1, requestTimeout=60)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.start()
+		try:
+			pid = server.executor.submit(os.getpid).result()
+
+			# the worker waits on the fifo for its input, then is killed
+			fifo = join(self.outputDir, 'input.xls')
+			os.mkfifo(fifo)
+			errors = []
+			def request():
+				try:
+					requestOpenDif(server.server_address, fifo, {}, self.outputDir, 'bal')
+				except RuntimeError as e:
+					errors.append(e)
+
+			requestThread = threading.Thread(target=request)
+			requestThread.start()
+			while True:
+				try:
+					fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+					break
+				except OSError:
+					time.sleep(0.01)	# no reader yet
+			os.kill(pid, signal.SIGKILL)
+			requestThread.join()
+			os.close(fd)
+			self.assertRegex(str(errors[0]), 'worker process died')
+
+			# a new pool takes the next request, its log messages get here
+			file = join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls')
+			self.assertEqual(len(requestOpenDif(server.server_address, file, {},
+												self.outputDir, 'gnt')), 3)
+			self.assertNotEqual(server.executor.submit(os.getpid).result(), pid)
+			self.assertTrue(any(r.processName != 'MainProcess' for r in records))
+		finally:
+			server.shutdown()
+			server.server_close()
+			thread.join()
+			logging.getLogger().removeHandler(handler)
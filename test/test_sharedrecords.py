@@ -0,0 +1,126 @@
+# coding=utf-8
+#
+
+import unittest2
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile
+from dif_revised.sharedrecords import toShared, SharedRecords, readFiles, \
+										MISSING, FLOAT, STRING
+from dif_revised.progress import Progress, Cancelled
+import numpy as np
+
+
+
+def samplePath(fileName):
+	return join(get_current_path(), 'samples', fileName)
+
+
+
+class TestSharedRecords(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestSharedRecords, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestSharedRecords):
+		"""
+		Called only once before all tests
+		"""
+		TestSharedRecords.records = \
+			readFile(samplePath('CL Franklin DIF 2018-05-28(2nd Revised).xls'))[0]
+
+
+
+	def testRoundTrip(self):
+		for fileName in ['CL Franklin DIF 2018-05-28(2nd Revised).xls',
+							'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']:
+			records = readFile(samplePath(fileName))[0]
+			with SharedRecords(toShared(records)) as shared:
+				self.assertEqual(len(shared), len(records))
+				self.assertEqual(shared.records(), records)
+
+
+
+	def testColumns(self):
+		records = [{'type': 'cash', 'book_cost': 100.0},
+					{'type': 'bond', 'book_cost': '', 'isin': 'XS0001'},
+					{'type': 'bond', 'book_cost': 50.5, 'isin': 'XS0001'}]
+		with SharedRecords(toShared(records)) as shared:
+			self.assertEqual(shared.tags('book_cost').tolist(), [FLOAT, STRING, FLOAT])
+			self.assertEqual(shared.tags('isin').tolist(), [MISSING, STRING, STRING])
+			floats = shared.floats('book_cost')
+			self.assertEqual(floats[0], 100.0)
+			self.assertTrue(np.isnan(floats[1]))
+			self.assertEqual(floats[2], 50.5)
+			del floats
+
+			strings = shared.stringTable()
+			self.assertEqual([strings[c] for c in shared.codes('type')], ['cash', 'bond', 'bond'])
+			self.assertEqual(shared.codes('isin')[0], -1)
+			self.assertEqual(shared.column('isin'), [None, 'XS0001', 'XS0001'])
+			self.assertEqual(shared.column('book_cost'), [100.0, '', 50.5])
+			self.assertEqual(shared.records(), records)
+
+
+
+	def testZeroCopy(self):
+		records = TestSharedRecords.records
+		with SharedRecords(toShared(records)) as shared:
+			values = shared.floats('book_cost')
+			self.assertFalse(values.flags['OWNDATA'])
+			self.assertAlmostEqual(values.sum(), sum(r['book_cost'] for r in records),
+								delta=1e-3)
+			del values
+
+
+
+	def testUnsupportedValue(self):
+		with self.assertRaises(TypeError):
+			toShared([{'type': 'cash', 'book_cost': 1}])
+
+
+
+	def testEmpty(self):
+		with SharedRecords(toShared([])) as shared:
+			self.assertEqual(shared.records(), [])
+		with SharedRecords(toShared([{}, {}])) as shared:
+			self.assertEqual(shared.records(), [{}, {}])
+
+
+
+	def testClose(self):
+		handle = toShared(TestSharedRecords.records[:5])
+		shared = SharedRecords(handle)
+		shared.close()
+		shared.close()
+		with self.assertRaises(FileNotFoundError):
+			shared_memory.SharedMemory(name=handle['name'])
+
+
+
+	def testReadFiles(self):
+		files = [samplePath(f) for f in ['CLM BAL 2017-07-27.xls', 'CLM GNT 2017-10-25.xls']]
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			for (file, shared, summary) in readFiles(files, executor):
+				records, fileSummary = readFile(file)
+				self.assertEqual(summary, fileSummary)
+				self.assertEqual(len(shared), len(records))
+				self.assertEqual(shared.column('market_value'),
+									[r.get('market_value') for r in records])
+				self.assertEqual(shared.records(), records)
+			self.assertIsNone(shared.shm)	# closed once the next file is taken
+
+
+
+	def testCancelReadFiles(self):
+		files = [samplePath(f) for f in ['CLM BAL 2017-07-27.xls', 'CLM GNT 2017-10-25.xls']]
+		progress = Progress(lambda snapshot: progress.cancel())
+		taken = []
+		with ProcessPoolExecutor(max_workers=2) as executor:
+			with self.assertRaises(Cancelled):
+				for (file, shared, summary) in readFiles(files, executor, progress):
+					taken.append(file)
+		self.assertEqual(taken, files[:1])
+		self.assertEqual(progress.files, 1)
@@ -0,0 +1,64 @@
+# coding=utf-8
+#
+
+import unittest2
+from os.path import join
+from unittest import mock
+from xlrd.sheet import Sheet
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readSummaryFile, readFile
+
+
+
+class TestSummary(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestSummary, self).__init__(*args, **kwargs)
+
+
+
+	def testDif(self):
+		summary = readSummaryFile(join(get_current_path(), 'samples',
+							'CL Franklin DIF 2018-05-28(2nd Revised).xls'))
+		self.assertEqual(summary['portfolio'], '19437')
+		self.assertEqual(summary['valuation_date'], '2018-5-28')
+		self.assertAlmostEqual(summary['nav'], 4248751534.54, 2)
+		self.assertAlmostEqual(summary['number_of_units'], 362014622.4552, 4)
+		self.assertAlmostEqual(summary['unit_price'], 11.7364)
+
+
+
+	def testGnt(self):
+		summary = readSummaryFile(join(get_current_path(), 'samples',
+							'CLM GNT 2017-10-25.xls'))
+		self.assertEqual(summary['portfolio'], '30003')
+		self.assertEqual(summary['valuation_date'], '2017-10-25')
+
+
+
+	def testFallback(self):
+		"""
+		Without the fund name and valuation period in the summary, they are
+		read from the first lines of the holdings only.
+		"""
+		file = join(get_current_path(), 'samples', 'CLM GNT 2017-10-25.xls')
+		rowValues = Sheet.row_values
+		with mock.patch('dif_revised.dif.findPortfolioInfoLines', return_value=[]), \
+			mock.patch.object(Sheet, 'row_values', autospec=True,
+								side_effect=rowValues) as rows:
+			summary = readSummaryFile(file)
+
+		self.assertEqual((summary['portfolio'], summary['valuation_date']),
+							('30003', '2017-10-25'))
+		self.assertTrue(0 < rows.call_count < 20)
+
+
+
+	def testSameAsReadFile(self):
+		for fileName in ['CL Franklin DIF 2018-07-24.xls', 'CLM BAL 2017-07-27.xls',
+							'CLM BAL 2018-05-31.xls']:
+			file = join(get_current_path(), 'samples', fileName)
+			records, summary = readFile(file)
+			summary2 = readSummaryFile(file)
+			self.assertEqual(summary2.pop('portfolio'), records[0]['portfolio'])
+			self.assertEqual(summary2.pop('valuation_date'), records[0]['valuation_date'])
+			self.assertEqual(summary2, summary)
@@ -0,0 +1,85 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil, os
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, baseCurrency, headerMap, summaryNameMap
+from dif_revised.geneva import open_dif, bankMap, projectors
+
+
+
+fileNames = ['CL Franklin DIF 2018-05-28(2nd Revised).xls', 'CL Franklin DIF 2018-07-24.xls',
+				'CLM BAL 2017-07-27.xls', 'CLM BAL 2018-05-31.xls', 'CLM GNT 2017-10-25.xls']
+
+def readSample(fileName):
+	fxTable = {}
+	records, summary = readFile(join(get_current_path(), 'samples', fileName), fxTable)
+	return records, summary, fxTable
+
+
+
+def readOutputs(files):
+	contents = []
+	for file in files:
+		with open(file, 'rb') as f:
+			contents.append(f.read())
+	return contents
+
+
+
+class TestThreads(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestThreads, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestThreads):
+		"""
+		Called only once before all tests
+		"""
+		TestThreads.expected = {f: readSample(f) for f in fileNames}
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+
+
+	def testReadFile(self):
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			results = list(executor.map(readSample, fileNames * 8))
+
+		for (fileName, result) in zip(fileNames * 8, results):
+			self.assertEqual(result, TestThreads.expected[fileName])
+
+
+
+	def testOpenDif(self):
+		serialDir = join(self.tempDir, 'serial')
+		os.mkdir(serialDir)
+		expected = {f: readOutputs(open_dif(join(get_current_path(), 'samples', f), {},
+						serialDir, 'test', force=True)) for f in fileNames}
+
+		def run(i):
+			outputDir = join(self.tempDir, str(i))
+			os.mkdir(outputDir)
+			fileName = fileNames[i % len(fileNames)]
+			portValues = {}
+			files = open_dif(join(get_current_path(), 'samples', fileName), portValues,
+								outputDir, 'test')
+			return fileName, readOutputs(files), portValues
+
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			for (fileName, contents, portValues) in executor.map(run, range(20)):
+				self.assertEqual(contents, expected[fileName])
+				self.assertEqual(portValues['nav'], TestThreads.expected[fileName][1]['nav'])
+
+
+
+	def testFrozenTables(self):
+		for table in (baseCurrency, headerMap, summaryNameMap, bankMap, projectors):
+			with self.assertRaises(TypeError):
+				table['new key'] = ''
@@ -0,0 +1,118 @@
+# coding=utf-8
+#
+
+import unittest2, tempfile, shutil
+from os.path import join
+from datetime import datetime
+from xlrd import open_workbook, xldate
+from openpyxl import Workbook, load_workbook
+from dif_revised.utility import get_current_path
+from dif_revised.dif import readFile, fileFormat, worksheetToLines
+
+
+
+def xlsToXlsx(inputFile, outputFile):
+	"""
+	Save a copy of the .xls file as .xlsx, cell by cell.
+	"""
+	wb = open_workbook(filename=inputFile)
+	wbOut = Workbook()
+	wbOut.remove(wbOut.active)
+	for ws in wb.sheets():
+		wsOut = wbOut.create_sheet(ws.name)
+		for row in range(ws.nrows):
+			wsOut.append([None if value == '' else value for value in ws.row_values(row)])
+
+	wbOut.save(outputFile)
+
+
+
+class TestXlsx(unittest2.TestCase):
+	def __init__(self, *args, **kwargs):
+		super(TestXlsx, self).__init__(*args, **kwargs)
+
+	@classmethod
+	def setUpClass(TestXlsx):
+		"""
+		Called only once before all tests
+		"""
+		TestXlsx.tempDir = tempfile.mkdtemp()
+
+	@classmethod
+	def tearDownClass(TestXlsx):
+		shutil.rmtree(TestXlsx.tempDir)
+
+
+
+	def testFileFormat(self):
+		file = join(get_current_path(), 'samples', 'CLM BAL 2017-07-27.xls')
+		self.assertEqual(fileFormat(file), 'xls')
+
+		xlsxFile = join(TestXlsx.tempDir, 'bal.dat')	# no file extension
+		xlsToXlsx(file, xlsxFile)
+		self.assertEqual(fileFormat(xlsxFile), 'xlsx')
+
+
+
+	def testDateCell(self):
+		"""
+		A date formatted cell is read by openpyxl as datetime, it must turn
+		into the Excel ordinal, as xlrd gives it.
+		"""
+		xlsxFile = join(TestXlsx.tempDir, 'dates.xlsx')
+		wb = Workbook()
+		ws = wb.active
+		ws.append([datetime(2018, 5, 31), ' Valuation Date ', 3, None])
+		ws['A1'].number_format = 'yyyy-mm-dd'
+		ws.append([datetime(2017, 7, 27, 12, 0)])
+		wb.save(xlsxFile)
+
+		wb = load_workbook(xlsxFile, read_only=True)
+		try:
+			lines = list(worksheetToLines(wb.active))
+		finally:
+			wb.close()
+
+		self.assertEqual(lines[0], [xldate.xldate_from_date_tuple((2018, 5, 31), 0),
+									'Valuation Date', 3.0, ''])
+		self.assertEqual(lines[1][0], xldate.xldate_from_date_tuple((2017, 7, 27), 0))
+		self.assertIsInstance(lines[0][0], float)
+
+
+
+	def testDif(self):
+		self.verifySameAsXls('CL Franklin DIF 2018-05-28(2nd Revised).xls')
+
+
+
+	def testBal(self):
+		self.verifySameAsXls('CLM BAL 2018-05-31.xls')
+
+
+
+	def verifySameAsXls(self, fileName):
+		file = join(get_current_path(), 'samples', fileName)
+		xlsxFile = join(TestXlsx.tempDir, fileName + 'x')
+		xlsToXlsx(file, xlsxFile)
+
+		records, summary = readFile(file)
+		xlsxRecords, xlsxSummary = readFile(xlsxFile)
+		self.assertEqual(len(xlsxRecords), len(records))
+		for (xlsxRecord, record) in zip(xlsxRecords, records):
+			self.verifySameValues(xlsxRecord, record)
+		self.verifySameValues(xlsxSummary, summary)
+
+
+
+	def verifySameValues(self, xlsxRecord, record):
+		"""
+		openpyxl saves float with a shorter representation, so float values
+		are compared with a tolerance.
+		"""
+		self.assertEqual(sorted(xlsxRecord.keys()), sorted(record.keys()))
+		for key in record:
+			if isinstance(record[key], float):
+				self.assertAlmostEqual(xlsxRecord[key], record[key],
+										delta=1e-9*max(1, abs(record[key])))
+			else:
+				self.assertEqual(xlsxRecord[key], record[key])